@@ -0,0 +1,113 @@
+"""
+Stage artifacts for incremental re-renders.
+
+create_video's stages each leave an artifact keyed by a hash of exactly the inputs and
+settings that shape it, so a re-render only redoes the stages downstream of a change:
+- audio: the pre-mixed narration + background music track (narration bytes, BGM bytes,
+  level, normalization).
+- base: the captionless, unfaded main render (scene image bytes in order, frame size,
+  fps, durations, transitions, Ken Burns, engine). Only built for jobs that ask for it
+  (keep_base), since it costs a second full encode.
+- main: the finished render with captions burned in, the fade into the outro and the
+  current audio track (base key + audio key + caption cues and style); rendered in one
+  pass on a miss, or over the base when that is cached.
+Scene crops, transcripts and the conformed outro already have their own caches. With a
+kept base, a caption restyle costs one encode over it and a BGM level change a re-mix
+plus that encode; an unchanged re-render costs only the outro append.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import asset_index
+import disk_cache
+
+STAGE_VERSION = 2
+
+# STAGE_CACHE_DIR='' disables stage artifacts (every render runs all stages in one pass)
+stage_cache = disk_cache.cache_from_env("STAGE_CACHE_DIR", os.path.join("cache", "stages"), "STAGE_CACHE_MAX_MB", 8192)
+
+_digest_lock = threading.Lock()
+_digests = {}  # (path, size, mtime_ns) -> sha256, so unchanged inputs are hashed once per process
+
+
+def content_digest(path):
+    """sha256 of a file's (or zip member's) bytes, memoized on the file's size and mtime."""
+    archive, _ = asset_index.split_member(path)
+    try:
+        st = os.stat(archive)
+        memo_key = (path, st.st_size, st.st_mtime_ns)
+    except OSError:
+        memo_key = None
+    if memo_key is not None:
+        with _digest_lock:
+            digest = _digests.get(memo_key)
+        if digest:
+            return digest
+    digest = asset_index.asset_digest(path)
+    if memo_key is not None:
+        with _digest_lock:
+            _digests[memo_key] = digest
+    return digest
+
+
+def stage_key(stage, **inputs):
+    """Artifact key: sha256 over the stage name, STAGE_VERSION and its inputs (JSON, sorted keys)."""
+    payload = json.dumps({'stage': stage, 'version': STAGE_VERSION, 'inputs': inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def fetch_or_build(stage, key, suffix, build, stats=None):
+    """
+    Path of the artifact for key, running build(out_path) on a miss. out_path ends in
+    suffix (so ffmpeg/MoviePy pick the container from it); build may return a JSON-able
+    dict that is kept next to the artifact. Returns (path, meta); stats[stage] gets 'hit'
+    or 'miss'.
+    """
+    path = stage_cache.lookup(key, suffix)
+    meta_path = stage_cache.lookup(key, '.json')
+    if path and meta_path:
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if stats is not None:
+                stats[stage] = 'hit'
+            return path, meta
+        except (OSError, ValueError):
+            pass  # unreadable metadata: rebuild both
+
+    meta = {}
+
+    def writer(tmp):
+        out = tmp + suffix
+        try:
+            meta.update(build(out) or {})
+            os.replace(out, tmp)
+        finally:
+            if os.path.exists(out):
+                os.remove(out)
+
+    path = stage_cache.store(key, writer, suffix)
+
+    def write_meta(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    stage_cache.store(key, write_meta, '.json')
+    if stats is not None:
+        stats[stage] = 'miss'
+    return path, meta
+
+
+def link_to(artifact_path, dest_path):
+    """Give a job its own name for an artifact (hard link, or a copy across filesystems)."""
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(artifact_path, dest_path)
+    except OSError:
+        shutil.copyfile(artifact_path, dest_path)
+    return dest_path
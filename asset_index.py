@@ -0,0 +1,136 @@
+"""
+Asset discovery without extraction.
+
+Regular files and zip members are indexed in one pass and classified from a short
+header read (magic bytes), not by decoding them. Zip members are addressed by a
+virtual path "<archive>::<member>" that the scene preprocessor can open, hash and
+decode straight out of the archive, so zipped images are never written to disk a
+second time. Only the narration, which ffmpeg needs as a real file, is extracted.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import zipfile
+from collections import namedtuple
+
+MEMBER_SEP = '::'
+HEADER_BYTES = 16
+READ_CHUNK_BYTES = 1024 * 1024
+
+AUDIO_EXTS = ('.mp3',)
+
+# path is a filesystem path or a virtual "<archive>::<member>" path
+AssetEntry = namedtuple('AssetEntry', 'path kind size')
+
+
+def sniff_kind(header, name=''):
+    """'image', 'audio' (MP3), 'zip' or None from a file's first bytes (extension as a fallback)."""
+    if header.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'II*\x00', b'MM\x00*')) \
+            or (header[:4] == b'RIFF' and header[8:12] == b'WEBP') \
+            or (header[:2] == b'BM' and header[6:10] == b'\x00\x00\x00\x00'):
+        return 'image'
+    if header.startswith(b'ID3') or (len(header) > 1 and header[0] == 0xFF and (header[1] & 0xE0) == 0xE0):
+        return 'audio'
+    if header.startswith(b'PK\x03\x04'):
+        return 'zip'
+    lower = name.lower()
+    if lower.endswith(AUDIO_EXTS):
+        return 'audio'
+    return None
+
+
+def member_path(zip_path, member):
+    return f"{zip_path}{MEMBER_SEP}{member}"
+
+
+def split_member(path):
+    """(archive, member) for a virtual member path, else (path, None)."""
+    if MEMBER_SEP in path:
+        archive, member = path.split(MEMBER_SEP, 1)
+        return archive, member
+    return path, None
+
+
+def open_asset(path):
+    """Binary file object for a file or zip member (members are read into memory, never to disk)."""
+    archive, member = split_member(path)
+    if member is None:
+        return open(path, 'rb')
+    with zipfile.ZipFile(archive) as zf:
+        return io.BytesIO(zf.read(member))
+
+
+def asset_digest(path):
+    """sha256 hex digest of a file's or zip member's bytes."""
+    archive, member = split_member(path)
+    h = hashlib.sha256()
+    if member is None:
+        f = open(path, 'rb')
+    else:
+        zf = zipfile.ZipFile(archive)
+        f = zf.open(member)
+    try:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b''):
+            h.update(chunk)
+    finally:
+        f.close()
+        if member is not None:
+            zf.close()
+    return h.hexdigest()
+
+
+def materialize(path, dest_dir=None):
+    """A real file for path: files as-is, zip members extracted (next to the archive by default)."""
+    archive, member = split_member(path)
+    if member is None:
+        return path
+    dest_dir = dest_dir or os.path.dirname(archive)
+    out = os.path.join(dest_dir, os.path.splitext(os.path.basename(archive))[0] + '_' + member.replace('/', '_'))
+    with zipfile.ZipFile(archive) as zf, zf.open(member) as src, open(out, 'wb') as dst:
+        shutil.copyfileobj(src, dst, READ_CHUNK_BYTES)
+    return out
+
+
+def index_zip(zip_path):
+    """AssetEntry for every image/audio member of an archive (header reads only)."""
+    entries = []
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info) as f:
+                    header = f.read(HEADER_BYTES)
+                kind = sniff_kind(header, info.filename)
+                if kind in ('image', 'audio'):
+                    entries.append(AssetEntry(member_path(zip_path, info.filename), kind, info.file_size))
+    except (zipfile.BadZipFile, OSError):
+        # Ignore bad zips; continue
+        pass
+    return entries
+
+
+def classify_file(path):
+    """AssetEntry kind for one regular file from its header, or None."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_BYTES)
+    except OSError:
+        return None
+    return sniff_kind(header, path)
+
+
+def index_assets(root_dir):
+    """One pass over root_dir: AssetEntry for every image/audio file and every image/audio zip member."""
+    entries = []
+    for r, _, files in os.walk(root_dir):
+        for f in files:
+            full = os.path.join(r, f)
+            kind = classify_file(full)
+            if kind == 'zip':
+                entries.extend(index_zip(full))
+            elif kind in ('image', 'audio'):
+                entries.append(AssetEntry(full, kind, os.path.getsize(full)))
+    return entries
@@ -0,0 +1,112 @@
+"""
+One-pass audio pre-mix.
+
+Narration and background music are decoded to float32 PCM, the music is looped and
+gain-scaled and summed into the narration with NumPy, and the result is encoded once
+to an AAC track the muxer can stream-copy. Decoded background music is cached on
+disk as .npy and memory-mapped, so every job and worker process shares one decode.
+"""
+
+import os
+import subprocess
+
+import numpy as np
+
+import disk_cache
+import parallel_render
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+AAC_BITRATE = "192k"
+# Loudness normalization target for the narration (RMS, dBFS) and the peak ceiling
+NARRATION_TARGET_DBFS = -18.0
+PEAK_CEILING_DBFS = -1.0
+
+# Decoded background music PCM; PCM_CACHE_DIR='' disables the disk tier
+pcm_cache = disk_cache.cache_from_env("PCM_CACHE_DIR", os.path.join("cache", "pcm"), "PCM_CACHE_MAX_MB", 1024)
+_mapped = {}
+
+
+def decode_pcm(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Decode any audio file to an interleaved float32 array of shape (n, channels)."""
+    out = subprocess.run(
+        [parallel_render.ffmpeg_binary(), "-v", "error", "-i", path, "-vn",
+         "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(sample_rate), "-ac", str(channels), "-"],
+        capture_output=True, check=True,
+    )
+    return np.frombuffer(out.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def cached_pcm(path):
+    """Decoded PCM for a (reused) file, memory-mapped from the PCM cache when enabled."""
+    if pcm_cache is None:
+        return decode_pcm(path)
+    key = f"{disk_cache.file_digest(path)}-{SAMPLE_RATE}x{CHANNELS}"
+    mapped = _mapped.get(key)
+    if mapped is not None:
+        return mapped
+    cached = pcm_cache.lookup(key, '.npy')
+    if not cached:
+        pcm = decode_pcm(path)
+        cached = pcm_cache.store(key, lambda tmp: _save_npy(tmp, pcm), '.npy')
+    mapped = _mapped[key] = np.load(cached, mmap_mode='r')
+    return mapped
+
+
+def _save_npy(path, arr):
+    with open(path, 'wb') as f:
+        np.save(f, arr, allow_pickle=False)
+
+
+def normalize_loudness(pcm, target_dbfs=NARRATION_TARGET_DBFS, ceiling_dbfs=PEAK_CEILING_DBFS):
+    """Scale to a target RMS level without letting peaks exceed the ceiling."""
+    rms = float(np.sqrt(np.mean(np.square(pcm, dtype=np.float64)))) if pcm.size else 0.0
+    if rms <= 1e-9:
+        return pcm
+    gain = 10 ** (target_dbfs / 20.0) / rms
+    peak = float(np.max(np.abs(pcm)))
+    if peak > 0:
+        gain = min(gain, 10 ** (ceiling_dbfs / 20.0) / peak)
+    return pcm * np.float32(gain)
+
+
+def mix(narration, bgm=None, bgm_level=0.0):
+    """Sum the looped, gain-scaled music into a copy of the narration (same length as narration)."""
+    out = np.array(narration, dtype=np.float32, copy=True)
+    if bgm is not None and len(bgm) and bgm_level > 0:
+        gain = np.float32(bgm_level)
+        n, period = len(out), len(bgm)
+        for offset in range(0, n, period):
+            span = min(period, n - offset)
+            out[offset:offset + span] += bgm[:span] * gain
+    np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+def encode_aac(pcm, out_path, sample_rate=SAMPLE_RATE):
+    """Encode float32 PCM to an AAC (.m4a) file in one ffmpeg pass."""
+    proc = subprocess.Popen(
+        [parallel_render.ffmpeg_binary(), "-y", "-v", "error",
+         "-f", "f32le", "-ar", str(sample_rate), "-ac", str(pcm.shape[1]), "-i", "-",
+         "-c:a", "aac", "-b:a", AAC_BITRATE, out_path],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    _, err = proc.communicate(np.ascontiguousarray(pcm, dtype=np.float32).tobytes())
+    if proc.returncode != 0:
+        raise RuntimeError(f"AAC encode failed: {err.decode('utf-8', 'ignore').strip()}")
+    return out_path
+
+
+def premix(narration_path, out_path, bgm_path=None, bgm_level=0.0, normalize=False, narration=None):
+    """
+    Build the job's final audio track at out_path (.m4a).
+    narration: already decoded PCM of narration_path (e.g. decoded while images were still downloading).
+    Returns the narration duration in seconds.
+    """
+    if narration is None:
+        narration = decode_pcm(narration_path)
+    if normalize:
+        narration = normalize_loudness(narration)
+    bgm = cached_pcm(bgm_path) if bgm_path else None
+    encode_aac(mix(narration, bgm, bgm_level), out_path)
+    return len(narration) / float(SAMPLE_RATE)
@@ -0,0 +1,431 @@
+"""
+In-process caption rendering.
+
+Captions are rasterized with Pillow/FreeType into a single RGBA sprite per
+caption (background panel + offset shadow + text), so building a caption
+track never forks ImageMagick or touches temp files.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+import disk_cache
+
+# --- Caption style constants (match the previous TextClip composition) ---
+SHADOW_OFFSET = 2        # px, shadow is drawn down/right of the text
+SHADOW_OPACITY = 0.6
+BG_OPACITY = 0.35
+FALLBACK_FONT = "DejaVuSans.ttf"  # shipped with fonts-dejavu-core in the Docker image
+
+# --- Sprite cache configuration ---
+# CAPTION_CACHE_MAX_MB bounds the in-process tier; CAPTION_CACHE_DIR enables a shared on-disk
+# tier (size-bounded LRU, CAPTION_CACHE_DISK_MAX_MB).
+CAPTION_CACHE_MAX_MB = float(os.getenv("CAPTION_CACHE_MAX_MB", "64"))
+
+
+def caption_padding(font_size: int) -> int:
+    """Padding around the text inside the background panel."""
+    return max(8, int(font_size * 0.25))
+
+
+@lru_cache(maxsize=32)
+def resolve_font_path(font: str) -> Optional[str]:
+    """
+    Resolve a font family name (e.g. 'Impact', 'Arial') or a font file path to a
+    file Pillow can load. Tries the name directly, then fontconfig, then DejaVu.
+    Returns None when nothing usable is found (Pillow's default bitmap font is used).
+    """
+    if font and os.path.isfile(font):
+        return font
+    candidates = []
+    if font:
+        candidates += [font, f"{font}.ttf", f"{font.lower()}.ttf"]
+    for name in candidates:
+        try:
+            # Pillow searches its font dirs for bare names; keep the file it found
+            return getattr(ImageFont.truetype(name, 12), "path", None) or name
+        except Exception:
+            pass
+    # fontconfig knows family names; run once per font (cached)
+    if font and shutil.which("fc-match"):
+        try:
+            out = subprocess.run(["fc-match", "-f", "%{file}", font], capture_output=True, text=True, timeout=5)
+            path = out.stdout.strip()
+            if path and os.path.isfile(path):
+                return path
+        except Exception:
+            pass
+    try:
+        return getattr(ImageFont.truetype(FALLBACK_FONT, 12), "path", None) or FALLBACK_FONT
+    except Exception:
+        return None
+
+
+def font_identity(font: str) -> Tuple[Optional[str], Optional[float]]:
+    """(resolved font file, its mtime): changes when the font resolves elsewhere or the file is replaced."""
+    path = resolve_font_path(font)
+    try:
+        mtime = os.stat(path).st_mtime if path else None
+    except OSError:
+        mtime = None  # a name Pillow finds on its own search path
+    return path, mtime
+
+
+@lru_cache(maxsize=64)
+def _load_font_file(path: Optional[str], mtime: Optional[float], font_size: int):
+    if path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, int(font_size))
+
+
+def load_font(font: str, font_size: int):
+    path, mtime = font_identity(font)
+    return _load_font_file(path, mtime, int(font_size))
+
+
+def parse_color(color, default=(255, 255, 255)) -> Tuple[int, int, int]:
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except Exception:
+        return default
+
+
+def render_caption_sprite(text, font, font_size, font_color):
+    """
+    Rasterize one caption into an RGBA uint8 array of shape (h, w, 4):
+    - semi-transparent black panel with padding
+    - black shadow offset by SHADOW_OFFSET at SHADOW_OPACITY
+    - anti-aliased text in font_color
+    Height uses the font's ascent + descent so word-by-word captions keep a stable baseline.
+    """
+    pil_font = load_font(font, font_size)
+    pad = caption_padding(font_size)
+    left, _, right, _ = pil_font.getbbox(text)
+    try:
+        ascent, descent = pil_font.getmetrics()
+        th = ascent + descent
+    except AttributeError:
+        _, top, _, bottom = pil_font.getbbox(text)
+        th = bottom - top
+    x0 = -min(0, left)
+    tw = max(1, right + x0)
+    size = (tw + 2 * pad, max(1, th) + 2 * pad)
+
+    sprite = Image.new("RGBA", size, (0, 0, 0, int(round(255 * BG_OPACITY))))
+
+    shadow = Image.new("RGBA", size, (0, 0, 0, 0))
+    ImageDraw.Draw(shadow).text(
+        (pad + x0 + SHADOW_OFFSET, pad + SHADOW_OFFSET), text, font=pil_font,
+        fill=(0, 0, 0, int(round(255 * SHADOW_OPACITY))),
+    )
+    sprite.alpha_composite(shadow)
+
+    fg = Image.new("RGBA", size, (0, 0, 0, 0))
+    ImageDraw.Draw(fg).text((pad + x0, pad), text, font=pil_font, fill=parse_color(font_color) + (255,))
+    sprite.alpha_composite(fg)
+
+    return np.asarray(sprite)
+
+
+def sprite_key(text, font, font_size, font_color):
+    """Content key covering everything that affects the rendered pixels (the font by file and mtime)."""
+    return (
+        text,
+        font_identity(font),
+        int(font_size),
+        parse_color(font_color),
+        caption_padding(font_size),
+        SHADOW_OFFSET,
+        SHADOW_OPACITY,
+        BG_OPACITY,
+    )
+
+
+class SpriteCache:
+    """
+    Two-tier cache of rendered caption sprites.
+    - Memory: LRU bounded by total array bytes, shared by all jobs in the process.
+    - Disk (optional): one .npy per key in a size-bounded DiskCache, shared by workers/processes.
+    Thread-safe; renders happen outside the lock.
+    """
+
+    def __init__(self, max_bytes, disk=None):
+        self.max_bytes = int(max_bytes)
+        self.disk = disk
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _disk_key(key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def _remember(self, key, sprite):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return
+            if sprite.nbytes > self.max_bytes:
+                return
+            self._items[key] = sprite
+            self._bytes += sprite.nbytes
+            while self._bytes > self.max_bytes and self._items:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= old.nbytes
+
+    def _load_disk(self, key):
+        if self.disk is None:
+            return None
+        path = self.disk.lookup(self._disk_key(key), ".npy")
+        if path is None:
+            return None
+        try:
+            return np.load(path, allow_pickle=False)
+        except Exception:
+            return None  # evicted or replaced under us: a miss
+
+    def _store_disk(self, key, sprite):
+        if self.disk is None:
+            return
+
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                np.save(f, sprite, allow_pickle=False)
+
+        try:
+            self.disk.store(self._disk_key(key), write, ".npy")  # atomic, so concurrent workers never read partial files
+        except Exception:
+            pass
+
+    def get(self, text, font, font_size, font_color, stats=None):
+        """
+        Return the sprite for these caption params, rendering it on a miss.
+        stats (optional dict) gets 'hits', 'disk_hits' and 'misses' incremented.
+        """
+        key = sprite_key(text, font, font_size, font_color)
+        with self._lock:
+            sprite = self._items.get(key)
+            if sprite is not None:
+                self._items.move_to_end(key)
+        if sprite is not None:
+            _bump(stats, "hits")
+            return sprite
+        sprite = self._load_disk(key)
+        if sprite is not None:
+            _bump(stats, "disk_hits")
+        else:
+            _bump(stats, "misses")
+            sprite = render_caption_sprite(text, font, font_size, font_color)
+            self._store_disk(key, sprite)
+        sprite.setflags(write=False)  # shared between clips and jobs
+        self._remember(key, sprite)
+        return sprite
+
+    def info(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+def _bump(stats, name):
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + 1
+
+
+sprite_cache = SpriteCache(
+    CAPTION_CACHE_MAX_MB * 1024 * 1024,
+    disk_cache.cache_from_env("CAPTION_CACHE_DIR", "", "CAPTION_CACHE_DISK_MAX_MB", 512),
+)
+
+
+class CaptionTrack:
+    """
+    Caption overlay layer backed by a start-sorted timeline.
+    The cue start/end times split the timeline into intervals over which the set of
+    captions on screen is constant; those sets are precomputed once, so lookup for time
+    t is a single binary search and per-frame cost only depends on how many captions are
+    actually on screen, not on the transcript length or on long cues elsewhere in it.
+    """
+
+    def __init__(self, cues, sprites, frame_size, rel_y):
+        """
+        cues: list of (text, start, end); sprites: matching RGBA arrays.
+        frame_size: (w, h) of the video; rel_y: caption top as a fraction of frame height.
+        """
+        order = sorted(range(len(cues)), key=lambda i: cues[i][1])
+        self.starts = np.array([cues[i][1] for i in order], dtype=np.float64)
+        self.ends = np.array([cues[i][2] for i in order], dtype=np.float64)
+        self._bounds, self._sets = self._interval_table()
+        self.frame_w, self.frame_h = frame_size
+        self.top = int(rel_y * self.frame_h)
+        self.sprites = [sprites[i] for i in order]
+        prepared = {}
+        self._layers = []
+        for i in order:
+            sprite = sprites[i]
+            layer = prepared.get(id(sprite))
+            if layer is None:
+                layer = prepared[id(sprite)] = self._prepare(sprite)
+            self._layers.append(layer)
+
+    def _prepare(self, sprite):
+        """Clip the sprite to the frame once and split it into premultiplied rgb + alpha."""
+        h, w = sprite.shape[:2]
+        x = (self.frame_w - w) // 2
+        y = self.top
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.frame_w, x + w), min(self.frame_h, y + h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        part = sprite[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float32)
+        alpha = part[:, :, 3:4] / 255.0
+        return (y0, y1, x0, x1, part[:, :, :3] * alpha, 1.0 - alpha)
+
+    def _interval_table(self):
+        """
+        Sweep the cue boundaries once: bounds[k] starts the interval whose active captions
+        (start <= t < end, in start order) are sets[k]; the last interval is always empty.
+        """
+        bounds = np.array(sorted(set(self.starts.tolist()) | set(self.ends.tolist())), dtype=np.float64)
+        by_end = np.argsort(self.ends, kind="stable")
+        sets = []
+        on = set()
+        i = e = 0
+        for b in bounds:
+            while i < len(self.starts) and self.starts[i] <= b:
+                on.add(i)
+                i += 1
+            while e < len(by_end) and self.ends[by_end[e]] <= b:
+                on.discard(int(by_end[e]))
+                e += 1
+            sets.append(tuple(sorted(on)))
+        return bounds, sets
+
+    def __len__(self):
+        return len(self._layers)
+
+    def active(self, t):
+        """Indices (in start order) of captions with start <= t < end."""
+        k = int(np.searchsorted(self._bounds, t, side="right")) - 1
+        return list(self._sets[k]) if k >= 0 else []
+
+    def segments(self):
+        """Yield (start, end, indices) for every interval over which the active caption set is constant."""
+        bounds = self._bounds.tolist()
+        for a, b, indices in zip(bounds, bounds[1:], self._sets):
+            if indices:
+                yield (a, b, list(indices))
+
+    def apply(self, get_frame, t):
+        """MoviePy `fl` filter: blit the captions active at t onto the frame."""
+        frame = get_frame(t)
+        layers = [self._layers[i] for i in self.active(t) if self._layers[i] is not None]
+        if not layers:
+            return frame
+        frame = np.array(frame, copy=True)
+        for (y0, y1, x0, x1, rgb, inv_alpha) in layers:
+            region = frame[y0:y1, x0:x1].astype(np.float32)
+            frame[y0:y1, x0:x1] = (rgb + region * inv_alpha + 0.5).astype(np.uint8)
+        return frame
+
+
+def build_caption_track(cues, frame_size, font, font_size, font_color, rel_y, stats=None):
+    """Fetch sprites for all cues through the shared cache and build a CaptionTrack."""
+    sprites = [sprite_cache.get(text, font, font_size, font_color, stats=stats) for (text, _, _) in cues]
+    return CaptionTrack(cues, sprites, frame_size, rel_y)
+
+
+# --- ASS subtitles (libass burn-in) ---
+
+def ass_color(rgb, opacity=1.0):
+    """ASS &HAABBGGRR colour (ASS alpha is inverted: 00 = opaque)."""
+    r, g, b = rgb
+    alpha = int(round(255 * (1.0 - max(0.0, min(1.0, opacity)))))
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def ass_time(t):
+    """H:MM:SS.cc (ASS timestamps are in centiseconds)."""
+    cs = max(0, int(round(t * 100)))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def ass_text(text):
+    """Caption text as an ASS event: override braces and backslash sequences cannot be escaped, so neutralize them."""
+    text = " ".join(str(text).split())
+    return text.replace("\\", "\\\u200b").replace("{", "(").replace("}", ")")
+
+
+def ass_font(font, font_size):
+    """(family name, fonts dir or None, ASS Fontsize) matching the sprite renderer's font.
+    ASS sizes a font by its line height (ascent + descent), Pillow by its em size."""
+    path = resolve_font_path(font)
+    pil_font = load_font(font, font_size)
+    try:
+        family = pil_font.getname()[0]
+        ascent, descent = pil_font.getmetrics()
+        size = ascent + descent
+    except AttributeError:
+        family, size = font, int(font_size)
+    fonts_dir = os.path.dirname(os.path.abspath(path)) if path and os.path.isfile(path) else None
+    return family, fonts_dir, max(1, int(size))
+
+
+def write_ass(cues, path, frame_size, font, font_size, font_color, rel_y):
+    """
+    Compile caption cues (text, start, end) into an ASS script that reproduces the sprite
+    style: a BG_OPACITY panel (layer 0, opaque-box border style padded by caption_padding)
+    under font_color text with a SHADOW_OFFSET / SHADOW_OPACITY drop shadow (layer 1),
+    horizontally centred with the panel top at rel_y. Returns the fonts dir libass needs
+    to find a font given as a file (or None).
+    """
+    frame_w, frame_h = frame_size
+    family, fonts_dir, size = ass_font(font, font_size)
+    pad = caption_padding(font_size)
+    transparent = ass_color((0, 0, 0), 0.0)
+    panel = ass_color((0, 0, 0), BG_OPACITY)
+    shadow = ass_color((0, 0, 0), SHADOW_OPACITY)
+    text_color = ass_color(parse_color(font_color))
+    x, y = frame_w // 2, int(rel_y * frame_h) + pad
+    # Style fields: Name, Fontname, Fontsize, Primary, Secondary, Outline, Back, Bold, Italic, Underline,
+    # StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR,
+    # MarginV, Encoding
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {frame_w}",
+        f"PlayResY: {frame_h}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, "
+        "Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+        "MarginL, MarginR, MarginV, Encoding",
+        f"Style: Panel,{family},{size},{transparent},{transparent},{panel},{transparent},"
+        f"0,0,0,0,100,100,0,0,3,{pad},0,8,0,0,0,1",
+        f"Style: Caption,{family},{size},{text_color},{text_color},{transparent},{shadow},"
+        f"0,0,0,0,100,100,0,0,1,0,{SHADOW_OFFSET},8,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for (text, start, end) in sorted(cues, key=lambda c: c[1]):
+        text = ass_text(text)
+        if not text:
+            continue
+        t0, t1 = ass_time(start), ass_time(max(end, start + 0.01))
+        # \pos pins every cue to the same spot (no collision stacking), as the sprite overlay does
+        for (layer, style) in ((0, "Panel"), (1, "Caption")):
+            lines.append(f"Dialogue: {layer},{t0},{t1},{style},,0,0,0,,{{\\an8\\pos({x},{y})}}{text}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return fonts_dir
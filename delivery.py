@@ -0,0 +1,137 @@
+"""
+Delivery of finished videos.
+
+Exports are made "fast start" (moov atom ahead of the media data) so players can begin
+playback and seek before the whole file has arrived. /download serves them with ETag and
+Range support; with X_ACCEL_REDIRECT_PREFIX set, the app only authorizes the request and
+hands the file to nginx (X-Accel-Redirect, see deploy/nginx.conf), which serves it with
+sendfile outside the app worker.
+
+Optionally a finished video is also packaged for in-browser viewing: a VOD HLS playlist
+with fMP4 segments cut from the MP4 by stream copy (no re-encode; exports carry a
+keyframe every ffmpeg_render.KEYFRAME_INTERVAL_S so cuts land on a regular grid) and a
+JPEG poster. Playback then starts after the first segment and only watched segments are
+transferred.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+
+import parallel_render
+import utils
+
+# e.g. '/protected-outputs/': an nginx `internal` location aliased to the outputs folder ('' = serve from Flask)
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX", "").strip()
+HLS_SEGMENT_S = float(os.getenv("HLS_SEGMENT_S", "4"))
+POSTER_AT_S = float(os.getenv("POSTER_AT_S", "1.0"))
+
+HLS_PLAYLIST = 'index.m3u8'
+HLS_INIT_SEGMENT = 'init.mp4'
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.jpg': 'image/jpeg',
+}
+
+
+def moov_first(path):
+    """True if the MP4's moov box comes before its mdat box (i.e. the file is already fast start)."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box = struct.unpack('>I4s', header)
+            if box == b'moov':
+                return True
+            if box == b'mdat':
+                return False
+            if size == 1:  # 64-bit box size follows the type
+                size = struct.unpack('>Q', f.read(8))[0]
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size == 0:  # box runs to the end of the file
+                return False
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+
+def ensure_faststart(path):
+    """Move the moov box to the front (stream copy) unless it already is. Returns True if rewritten."""
+    if moov_first(path):
+        return False
+    tmp = path + '.faststart.mp4'
+    try:
+        subprocess.run(
+            [parallel_render.ffmpeg_binary(), "-y", "-v", "error", "-i", path, "-map", "0", "-c", "copy",
+             "-movflags", "+faststart", tmp],
+            check=True, capture_output=True,
+        )
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+def accel_redirect_path(*parts):
+    """Internal nginx URI for a file under the outputs folder."""
+    return X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + '/'.join(p.strip('/') for p in parts)
+
+
+def hls_dir_for(video_path):
+    """Folder holding the HLS package of a video (next to it)."""
+    return os.path.splitext(video_path)[0] + '_hls'
+
+
+def poster_path_for(video_path):
+    return os.path.splitext(video_path)[0] + '_poster.jpg'
+
+
+def package_hls(video_path, out_dir=None, segment_s=HLS_SEGMENT_S):
+    """
+    Stream-copy video_path into a VOD HLS package (HLS_PLAYLIST, HLS_INIT_SEGMENT and
+    .m4s fMP4 segments of about segment_s each). Built in a temp folder and swapped in
+    whole, so a reader never sees a partial playlist. Returns the playlist path.
+    """
+    out_dir = out_dir or hls_dir_for(video_path)
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        subprocess.run(
+            [parallel_render.ffmpeg_binary(), "-y", "-v", "error", "-i", video_path,
+             "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+             "-f", "hls", "-hls_time", f"{segment_s:g}", "-hls_playlist_type", "vod",
+             "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", HLS_INIT_SEGMENT,
+             "-hls_segment_filename", os.path.join(tmp_dir, "seg_%04d.m4s"),
+             os.path.join(tmp_dir, HLS_PLAYLIST)],
+            check=True, capture_output=True,
+        )
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return os.path.join(out_dir, HLS_PLAYLIST)
+
+
+def make_poster(video_path, poster_path=None, at_s=POSTER_AT_S):
+    """JPEG of the frame at at_s (clamped into short videos). Returns the poster path."""
+    poster_path = poster_path or poster_path_for(video_path)
+    duration = utils.media_duration(video_path)
+    if duration:
+        at_s = min(at_s, duration / 2)
+    tmp = poster_path + '.tmp.jpg'
+    try:
+        subprocess.run(
+            [parallel_render.ffmpeg_binary(), "-y", "-v", "error", "-ss", f"{at_s:.3f}", "-i", video_path,
+             "-frames:v", "1", "-q:v", "3", tmp],
+            check=True, capture_output=True,
+        )
+        os.replace(tmp, poster_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return poster_path
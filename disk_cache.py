@@ -0,0 +1,101 @@
+"""
+Small content-addressed on-disk cache with size-bounded LRU eviction.
+
+Entries are plain files under <root>/<key[:2]>/<key><suffix>, written atomically
+(temp file + os.replace) so several workers/processes can share one cache dir.
+Recency is the file mtime: hits touch the file, eviction removes the oldest.
+"""
+
+import hashlib
+import os
+import threading
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 hex digest of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DiskCache:
+    def __init__(self, root, max_bytes, evict_every=32):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.evict_every = evict_every
+        self._stores = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, suffix=''):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def lookup(self, key, suffix=''):
+        """Return the entry path (and mark it recently used) or None."""
+        path = self.path(key, suffix)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key, writer, suffix=''):
+        """
+        writer(tmp_path) writes the entry; it is then atomically moved into place.
+        Returns the final path.
+        """
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            writer(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            self._stores += 1
+            due = self._stores % self.evict_every == 0
+        if due:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes."""
+        entries = []
+        total = 0
+        for r, _, files in os.walk(self.root):
+            for f in files:
+                if '.tmp' in f:
+                    continue  # in-flight writes: <entry>.<pid>.<tid>.tmp and builders' .tmp<suffix> outputs
+                full = os.path.join(r, f)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for (_, size, full) in sorted(entries):
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            if total <= self.max_bytes:
+                break
+        return removed
+
+
+def cache_from_env(dir_var, default_dir, max_mb_var, default_max_mb):
+    """Build a DiskCache from env settings; an empty dir setting disables the cache (returns None)."""
+    root = os.getenv(dir_var, default_dir).strip()
+    if not root:
+        return None
+    max_mb = float(os.getenv(max_mb_var, str(default_max_mb)))
+    return DiskCache(root, max_mb * 1024 * 1024)
@@ -0,0 +1,202 @@
+"""
+Google Drive folder ingestion.
+
+The folder is listed once, its files are downloaded concurrently (bounded by
+DRIVE_DOWNLOAD_WORKERS, which also sizes the HTTP connection pool), and every file
+goes through a local cache keyed by Drive file id and modification time, so
+re-rendering an unchanged folder downloads nothing. Jobs get hard links (or copies)
+of the cached files in their own directory and can delete it freely.
+
+The HTTP side is a transport object with list_folder(folder_id) and
+download(drive_file, dest_path):
+- DriveApiTransport: Drive API v3 over a pooled requests.Session; used when
+  GOOGLE_API_KEY is set. DRIVE_API_BASE can point it at a local stand-in server.
+- GdownTransport: gdown's public-folder listing and downloader (no API key). The
+  listing has no modification times, so cache entries are only trusted for
+  DRIVE_CACHE_TTL_S.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import disk_cache
+
+DRIVE_DOWNLOAD_WORKERS = int(os.getenv("DRIVE_DOWNLOAD_WORKERS", "8"))
+DRIVE_API_BASE = os.getenv("DRIVE_API_BASE", "https://www.googleapis.com/drive/v3").rstrip("/")
+DRIVE_CACHE_TTL_S = int(os.getenv("DRIVE_CACHE_TTL_S", "3600"))
+FOLDER_MIME = "application/vnd.google-apps.folder"
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+drive_cache = disk_cache.cache_from_env("DRIVE_CACHE_DIR", os.path.join("cache", "drive"), "DRIVE_CACHE_MAX_MB", 4096)
+
+# path is relative to the folder root (subfolders included); modified/size may be None
+DriveFile = namedtuple("DriveFile", "id name path modified size")
+
+
+def folder_id_from_url(folder_url):
+    """Drive folder id from a share link (…/folders/<id>, ?id=<id>) or a bare id."""
+    m = re.search(r"/folders/([\w-]+)", folder_url) or re.search(r"[?&]id=([\w-]+)", folder_url)
+    if m:
+        return m.group(1)
+    if re.fullmatch(r"[\w-]{10,}", folder_url.strip()):
+        return folder_url.strip()
+    raise ValueError(f"Not a Google Drive folder link: {folder_url}")
+
+
+class DriveApiTransport:
+    """Drive API v3 (API key) with a bounded, retrying connection pool."""
+
+    def __init__(self, api_key, base_url=DRIVE_API_BASE, pool_size=DRIVE_DOWNLOAD_WORKERS, session=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def list_folder(self, folder_id, prefix=""):
+        files = []
+        page_token = None
+        while True:
+            params = {
+                "q": f"'{folder_id}' in parents and trashed = false",
+                "fields": "nextPageToken, files(id, name, mimeType, modifiedTime, size)",
+                "pageSize": 1000,
+                "supportsAllDrives": "true",
+                "includeItemsFromAllDrives": "true",
+                "key": self.api_key,
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            resp = self.session.get(f"{self.base_url}/files", params=params, timeout=30)
+            resp.raise_for_status()
+            data = resp.json()
+            for item in data.get("files", []):
+                path = os.path.join(prefix, item["name"]) if prefix else item["name"]
+                if item.get("mimeType") == FOLDER_MIME:
+                    files.extend(self.list_folder(item["id"], path))
+                elif not str(item.get("mimeType", "")).startswith("application/vnd.google-apps."):
+                    size = item.get("size")
+                    files.append(DriveFile(item["id"], item["name"], path, item.get("modifiedTime"),
+                                           int(size) if size is not None else None))
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                return files
+
+    def download(self, drive_file, dest_path):
+        params = {"alt": "media", "supportsAllDrives": "true", "key": self.api_key}
+        with self.session.get(f"{self.base_url}/files/{drive_file.id}", params=params, stream=True, timeout=60) as resp:
+            resp.raise_for_status()
+            with open(dest_path, "wb") as f:
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    f.write(chunk)
+        return dest_path
+
+
+class GdownTransport:
+    """Public 'anyone with the link' folders via gdown (no API key)."""
+
+    def __init__(self):
+        try:
+            import gdown
+        except ImportError as e:
+            raise RuntimeError("gdown is required to download from Google Drive. Please install it.") from e
+        self.gdown = gdown
+
+    def list_folder(self, folder_id):
+        items = self.gdown.download_folder(id=folder_id, skip_download=True, quiet=True, use_cookies=False) or []
+        return [DriveFile(item.id, os.path.basename(item.path), item.path, None, None) for item in items]
+
+    def download(self, drive_file, dest_path):
+        if not self.gdown.download(id=drive_file.id, output=dest_path, quiet=True, use_cookies=False):
+            raise RuntimeError(f"Download failed for {drive_file.path}")
+        return dest_path
+
+
+def transport_from_env():
+    api_key = os.getenv("GOOGLE_API_KEY", "").strip()
+    if api_key:
+        return DriveApiTransport(api_key)
+    return GdownTransport()
+
+
+def cache_key(drive_file):
+    """Cache key: file id + modification time (or a DRIVE_CACHE_TTL_S time bucket when unknown)."""
+    version = drive_file.modified or f"t{int(time.time() // max(1, DRIVE_CACHE_TTL_S))}"
+    return hashlib.sha256(f"{drive_file.id}|{version}".encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+
+def fetch_file(transport, drive_file, dest_path):
+    """Place one Drive file at dest_path, via the cache when enabled. Returns 'hit', 'miss' or None."""
+    if drive_cache is None:
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        transport.download(drive_file, dest_path)
+        return None
+    key = cache_key(drive_file)
+    suffix = os.path.splitext(drive_file.name)[1].lower()
+    cached = drive_cache.lookup(key, suffix)
+    state = "hit"
+    if not cached:
+        cached = drive_cache.store(key, lambda tmp: transport.download(drive_file, tmp), suffix)
+        state = "miss"
+    _link_or_copy(cached, dest_path)
+    return state
+
+
+def ingest_folder(folder_url, dest_dir, transport=None, workers=None, on_file=None, stats=None, files=None):
+    """
+    List a Drive folder and download its files into dest_dir concurrently, keeping the
+    folder's relative layout. on_file(local_path) is called as each file lands (from a
+    worker thread). stats, if given, gets 'files', 'hits' and 'misses' counts.
+    files: an earlier list_folder() result, to skip listing again.
+    Returns the local paths in listing order.
+    """
+    transport = transport or transport_from_env()
+    if files is None:
+        files = transport.list_folder(folder_id_from_url(folder_url))
+    os.makedirs(dest_dir, exist_ok=True)
+    root = os.path.abspath(dest_dir)
+    lock = threading.Lock()
+    if stats is not None:
+        stats.update(files=len(files), hits=0, misses=0)
+
+    def fetch(drive_file):
+        local = os.path.abspath(os.path.join(root, drive_file.path))
+        if not local.startswith(root + os.sep):
+            local = os.path.join(root, drive_file.id + os.path.splitext(drive_file.name)[1])
+        state = fetch_file(transport, drive_file, local)
+        if stats is not None and state:
+            with lock:
+                stats["hits" if state == "hit" else "misses"] += 1
+        if on_file:
+            on_file(local)
+        return local
+
+    paths = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=max(1, workers or DRIVE_DOWNLOAD_WORKERS)) as pool:
+        futures = {pool.submit(fetch, f): i for i, f in enumerate(files)}
+        for future in as_completed(futures):
+            paths[futures[future]] = future.result()
+    return paths
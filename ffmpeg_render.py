@@ -0,0 +1,360 @@
+"""
+Native ffmpeg render engine for the slideshow path.
+
+Compiles the scene list (cropped images, per-scene duration, fades, Ken Burns
+zoom/pan, narration + background music mix, caption track and the closing
+outro) into one ffmpeg filtergraph and renders it in a single invocation, so
+no frame passes through Python. video_processor falls back to MoviePy when this
+engine fails.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from PIL import Image
+
+import parallel_render
+
+# Ken Burns easing as ffmpeg expressions of progress P (mirrors video_processor.KEN_BURNS_CURVES)
+FFMPEG_CURVES = {
+    'linear': "(P)",
+    'ease_in': "(P)*(P)",
+    'ease_out': "(1-(1-(P))*(1-(P)))",
+    'ease_in_out': "(P)*(P)*(3-2*(P))",
+}
+AUDIO_FORMAT = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
+# Keyframe spacing of every export, so HLS packaging can stream-copy cut segments on a regular grid
+KEYFRAME_INTERVAL_S = 2
+# x264 settings shared by every export encode, so renders can be stream-copy concatenated with the conformed outro
+EXPORT_X264_PARAMS = ['-profile:v', 'high', '-level', '4.1',
+                      '-force_key_frames', f'expr:gte(t,n_forced*{KEYFRAME_INTERVAL_S})']
+# Muxer flags of every deliverable write: moov box first, so players start and seek before the file has arrived
+FASTSTART_PARAMS = ['-movflags', '+faststart']
+
+
+def ffmpeg_available():
+    """True if the ffmpeg every stage uses (MoviePy's, see parallel_render.ffmpeg_binary) can be run."""
+    binary = parallel_render.ffmpeg_binary()
+    return bool(binary) and (os.path.isfile(binary) or shutil.which(binary) is not None)
+
+
+def require_ffmpeg():
+    """The ffmpeg binary to run; RuntimeError if there is none."""
+    if not ffmpeg_available():
+        raise RuntimeError(f"ffmpeg not found: {parallel_render.ffmpeg_binary()}")
+    return parallel_render.ffmpeg_binary()
+
+
+def probe_media(path):
+    """Return (duration_seconds, has_audio) for a media file from ffmpeg's header probe (no ffprobe needed)."""
+    info = ffmpeg_parse_infos(path)
+    return float(info.get("duration") or 0.0), bool(info.get("audio_found"))
+
+
+def escape_filter_value(value):
+    """Escape a filter option value (e.g. a path) for both the option and the filtergraph level."""
+    value = str(value)
+    for ch in "\\':":
+        value = value.replace(ch, "\\" + ch)
+    for ch in "\\'[],;":
+        value = value.replace(ch, "\\" + ch)
+    return value
+
+
+def ass_filter(ass_path, fonts_dir=None):
+    """libass burn-in filter for an ASS script (see captions.write_ass)."""
+    spec = f"ass=filename={escape_filter_value(os.path.abspath(ass_path))}"
+    if fonts_dir:
+        spec += f":fontsdir={escape_filter_value(fonts_dir)}"
+    return spec
+
+
+def scene_frame_counts(num_scenes, scene_duration, fps):
+    """Frames per scene, rounded on cumulative boundaries so the total matches the narration."""
+    counts = []
+    prev = 0
+    for i in range(num_scenes):
+        end = int(round((i + 1) * scene_duration * fps))
+        counts.append(max(1, end - prev))
+        prev = end
+    return counts
+
+
+def write_caption_strips(track, frame_size, total_duration, work_dir):
+    """
+    Flatten a captions.CaptionTrack into an ffconcat slideshow of full-width RGBA strips
+    (one per distinct set of on-screen captions, blank in gaps) so the whole caption
+    track is a single overlay input. Returns (ffconcat_path, strip_top).
+    """
+    frame_w, frame_h = frame_size
+    strip_h = max(s.shape[0] for s in track.sprites)
+    top = track.top
+    strips = {}
+
+    def strip_for(indices):
+        key = tuple(id(track.sprites[i]) for i in indices)
+        if key in strips:
+            return strips[key]
+        strip = Image.new("RGBA", (frame_w, strip_h), (0, 0, 0, 0))
+        for i in indices:
+            sprite = Image.fromarray(track.sprites[i], "RGBA")
+            layer = Image.new("RGBA", strip.size, (0, 0, 0, 0))
+            layer.paste(sprite, ((frame_w - sprite.width) // 2, 0))
+            strip = Image.alpha_composite(strip, layer)
+        path = os.path.join(work_dir, f"cap_{len(strips):05d}.png")
+        strip.save(path, compress_level=1)
+        strips[key] = path
+        return path
+
+    entries = []
+    t = 0.0
+    for (start, end, indices) in track.segments():
+        if start >= total_duration:
+            break
+        end = min(end, total_duration)
+        if start > t:
+            entries.append((strip_for(()), start - t))
+        entries.append((strip_for(indices), end - start))
+        t = end
+    if t < total_duration:
+        entries.append((strip_for(()), total_duration - t))
+
+    list_path = os.path.join(work_dir, "captions.ffconcat")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for (path, dur) in entries:
+            f.write(f"file '{os.path.basename(path)}'\nduration {dur:.6f}\n")
+        # concat demuxer quirk: the last file must be repeated for its duration to apply
+        f.write(f"file '{os.path.basename(entries[-1][0])}'\n")
+    return list_path, top
+
+
+def build_filtergraph(num_scenes, frame_counts, frame_size, fps, transition, ken_burns,
+                      audio_idx, bgm_idx, bgm_level, caption_idx, caption_top,
+                      outro_idx, outro_has_audio, outro_duration, outro_fade, fade_out=0.0, subtitles=None):
+    """
+    Compose the filter_complex script. Inputs 0..num_scenes-1 are the scene images.
+    fade_out fades the end of the main content when no outro input is composed in.
+    subtitles: an ass_filter() spec burned into the main content instead of a caption overlay input.
+    """
+    w, h = frame_size
+    zoom = max(0.0, float(ken_burns.get('zoom_factor', 0.1)))
+    curve = FFMPEG_CURVES.get(ken_burns.get('curve', 'linear'), FFMPEG_CURVES['linear'])
+    pan_x, pan_y = [max(-1.0, min(1.0, float(v))) for v in ken_burns.get('pan', (0.0, 0.0))]
+    lines = []
+
+    for i in range(num_scenes):
+        n = frame_counts[i]
+        dur = n / float(fps)
+        ease = curve.replace("P", f"on/{n}")
+        z = f"1+{zoom}*{ease}"
+        x = f"iw/2-iw/zoom/2+{pan_x}*{ease}*(iw-iw/zoom)/2"
+        y = f"ih/2-ih/zoom/2+{pan_y}*{ease}*(ih-ih/zoom)/2"
+        chain = (
+            f"[{i}:v]scale={2 * w}:{2 * h},setsar=1,"
+            f"zoompan=z='{z}':x='{x}':y='{y}':d={n}:s={w}x{h}:fps={fps},format=yuv420p"
+        )
+        fade = min(transition, dur / 2.0)
+        if fade > 0:
+            chain += f",fade=t=in:st=0:d={fade:.4f},fade=t=out:st={dur - fade:.4f}:d={fade:.4f}"
+        lines.append(f"{chain}[s{i}]")
+
+    main_duration = sum(frame_counts) / float(fps)
+    lines.append("".join(f"[s{i}]" for i in range(num_scenes)) + f"concat=n={num_scenes}:v=1:a=0[base]")
+    video = "base"
+    if caption_idx is not None:
+        lines.append(f"[{caption_idx}:v]format=rgba[cap]")
+        lines.append(f"[{video}][cap]overlay=0:{caption_top}:eof_action=pass:format=auto,format=yuv420p[capd]")
+        video = "capd"
+    elif subtitles:
+        lines.append(f"[{video}]{subtitles}[capd]")
+        video = "capd"
+
+    lines.append(f"[{audio_idx}:a]{AUDIO_FORMAT}[narr]")
+    if bgm_idx is not None:
+        lines.append(f"[{bgm_idx}:a]{AUDIO_FORMAT},volume={bgm_level:.4f}[bgm]")
+        lines.append("[narr][bgm]amix=inputs=2:duration=first:normalize=0[mix0]")
+    else:
+        lines.append("[narr]anull[mix0]")
+    lines.append(f"[mix0]apad,atrim=0:{main_duration:.6f}[mix]")
+
+    if outro_idx is None:
+        if fade_out > 0:
+            lines.append(f"[{video}]fade=t=out:st={max(0.0, main_duration - fade_out):.4f}:d={fade_out:.4f}[mainf]")
+            video = "mainf"
+        return ";\n".join(lines), video, "mix", main_duration
+
+    lines.append(f"[{video}]fade=t=out:st={max(0.0, main_duration - outro_fade):.4f}:d={outro_fade:.4f}[mainf]")
+    lines.append(
+        f"[{outro_idx}:v]scale={w}:{h},setsar=1,fps={fps},format=yuv420p,"
+        f"fade=t=in:st=0:d={outro_fade:.4f}[ov]"
+    )
+    if outro_has_audio:
+        lines.append(f"[{outro_idx}:a]{AUDIO_FORMAT},volume=0.5[oa]")
+    else:
+        lines.append(f"anullsrc=r=44100:cl=stereo,atrim=0:{outro_duration:.6f},{AUDIO_FORMAT}[oa]")
+    lines.append("[mainf][mix][ov][oa]concat=n=2:v=1:a=1[vout][aout]")
+    return ";\n".join(lines), "vout", "aout", main_duration + outro_duration
+
+
+def render_slideshow(image_paths, scene_duration, output_path, frame_size, audio_path,
+                     fps=24, transition=0.0, ken_burns=None, bgm_path=None, bgm_level=0.0,
+                     caption_track=None, outro_path=None, outro_fade=0.5, fade_out=0.0, progress=None,
+                     subtitles_path=None, fonts_dir=None, preset="medium"):
+    """
+    Render the whole job with one ffmpeg process.
+    subtitles_path: an ASS script burned in by libass in the same pass (instead of caption_track).
+    preset: x264 preset (previews use a fast one).
+    progress(pct) is called with 0..100 as ffmpeg reports encoded time.
+    Raises RuntimeError (with ffmpeg's stderr tail) on failure.
+    """
+    ffmpeg = require_ffmpeg()
+    num_scenes = len(image_paths)
+    frame_counts = scene_frame_counts(num_scenes, scene_duration, fps)
+    main_duration = sum(frame_counts) / float(fps)
+
+    work_dir = tempfile.mkdtemp(prefix="ffrender_")
+    try:
+        args = [ffmpeg, "-y", "-hide_banner", "-nostats", "-progress", "pipe:1"]
+        for p in image_paths:
+            args += ["-i", p]
+        idx = num_scenes
+        audio_idx = idx
+        args += ["-i", audio_path]
+        idx += 1
+        bgm_idx = None
+        if bgm_path:
+            bgm_idx = idx
+            args += ["-stream_loop", "-1", "-i", bgm_path]
+            idx += 1
+        caption_idx, caption_top = None, 0
+        if caption_track is not None and len(caption_track):
+            list_path, caption_top = write_caption_strips(caption_track, frame_size, main_duration, work_dir)
+            caption_idx = idx
+            args += ["-f", "concat", "-safe", "0", "-i", list_path]
+            idx += 1
+        outro_idx, outro_has_audio, outro_duration = None, False, 0.0
+        if outro_path and os.path.exists(outro_path):
+            outro_duration, outro_has_audio = probe_media(outro_path)
+            outro_fade = min(outro_fade, max(0.01, min(main_duration, outro_duration) / 2.0))
+            outro_idx = idx
+            args += ["-i", outro_path]
+            idx += 1
+
+        graph, vout, aout, total_duration = build_filtergraph(
+            num_scenes, frame_counts, frame_size, fps, transition, ken_burns or {},
+            audio_idx, bgm_idx, bgm_level, caption_idx, caption_top,
+            outro_idx, outro_has_audio, outro_duration, outro_fade, fade_out,
+            subtitles=ass_filter(subtitles_path, fonts_dir) if subtitles_path else None,
+        )
+        script_path = os.path.join(work_dir, "graph.txt")
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(graph)
+        args += [
+            "-filter_complex_script", script_path,
+            "-map", f"[{vout}]", "-map", f"[{aout}]",
+            "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p", *EXPORT_X264_PARAMS, "-r", str(fps),
+            "-c:a", "aac", "-b:a", "192k", *FASTSTART_PARAMS,
+            output_path,
+        ]
+        run_ffmpeg(args, total_duration, progress)
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_ffmpeg(args, total_duration, progress=None):
+    """
+    Run an ffmpeg command that was given "-progress pipe:1", reporting 0..100 to progress(pct).
+    Raises RuntimeError (with ffmpeg's stderr tail) on failure.
+    """
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stderr_tail = []
+
+    def drain_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line)
+            del stderr_tail[:-40]
+
+    err_thread = threading.Thread(target=drain_stderr, daemon=True)
+    err_thread.start()
+    for line in proc.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and progress and total_duration > 0:
+            try:
+                progress(min(100, int(100 * int(value) / 1e6 / total_duration)))
+            except ValueError:
+                pass
+    proc.wait()
+    err_thread.join(timeout=5)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {''.join(stderr_tail[-10:]).strip()}")
+    if progress:
+        progress(100)
+
+
+def burn_subtitles(video_path, ass_path, output_path, duration, fonts_dir=None, fps=24, progress=None,
+                   preset="medium"):
+    """
+    Burn an ASS script into an existing render with libass: one video encode (same export
+    settings, so the result still stream-copy concatenates with the outro), audio copied.
+    """
+    ffmpeg = require_ffmpeg()
+    args = [
+        ffmpeg, "-y", "-hide_banner", "-nostats", "-progress", "pipe:1",
+        "-i", video_path,
+        "-vf", ass_filter(ass_path, fonts_dir),
+        "-map", "0:v", "-map", "0:a?",
+        "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p", *EXPORT_X264_PARAMS, "-r", str(fps),
+        "-c:a", "copy", *FASTSTART_PARAMS,
+        output_path,
+    ]
+    run_ffmpeg(args, duration, progress)
+    return output_path
+
+
+def finish_render(base_path, audio_path, output_path, duration, frame_size, fps=24, caption_track=None,
+                  subtitles_path=None, fonts_dir=None, fade_out=0.0, preset="medium", progress=None):
+    """
+    Final pass over a captionless base render: burn in the captions (a caption track as one
+    overlay input, or an ASS script), fade out the end and mux audio_path (stream copy).
+    Without captions or fade the video is stream copied as well, so nothing is encoded.
+    """
+    ffmpeg = require_ffmpeg()
+    work_dir = tempfile.mkdtemp(prefix="fffinish_")
+    try:
+        args = [ffmpeg, "-y", "-hide_banner", "-nostats", "-progress", "pipe:1", "-i", base_path, "-i", audio_path]
+        lines = []
+        video = "0:v"
+        if caption_track is not None and len(caption_track):
+            list_path, caption_top = write_caption_strips(caption_track, frame_size, duration, work_dir)
+            args += ["-f", "concat", "-safe", "0", "-i", list_path]
+            lines.append("[2:v]format=rgba[cap]")
+            lines.append(f"[{video}][cap]overlay=0:{caption_top}:eof_action=pass:format=auto,format=yuv420p[capd]")
+            video = "capd"
+        elif subtitles_path:
+            lines.append(f"[{video}]{ass_filter(subtitles_path, fonts_dir)}[capd]")
+            video = "capd"
+        if fade_out > 0:
+            lines.append(f"[{video}]fade=t=out:st={max(0.0, duration - fade_out):.4f}:d={fade_out:.4f}[vout]")
+            video = "vout"
+
+        if lines:
+            script_path = os.path.join(work_dir, "graph.txt")
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(";\n".join(lines))
+            args += [
+                "-filter_complex_script", script_path, "-map", f"[{video}]", "-map", "1:a:0",
+                "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p", *EXPORT_X264_PARAMS, "-r", str(fps),
+            ]
+        else:
+            args += ["-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy"]
+        args += ["-c:a", "copy", *FASTSTART_PARAMS, output_path]
+        run_ffmpeg(args, duration, progress)
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
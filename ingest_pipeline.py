@@ -0,0 +1,135 @@
+"""
+Producer/consumer ingestion.
+
+Downloads produce files one at a time; ScenePipeline.add() classifies each one by its
+magic bytes and hands it to a consumer as soon as it lands instead of waiting for the
+whole folder: images go straight to the scene preprocessing pool (crop/resize via the
+scene cache), zip members are indexed and decoded straight out of the archive, and
+narration audio is decoded to PCM in the background (and sent for transcription when
+the pipeline has a provider), so download latency is hidden behind CPU and network work. Once the producer is done, scenes() returns the prepared scenes in
+the same numeric_key order create_video would use. A pipeline can prepare several
+aspect ratios at once (multi-rendition jobs): each image is then decoded once and
+cropped for every ratio.
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import asset_index
+import audio_mix
+import transcripts
+import video_processor
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class ScenePipeline:
+    def __init__(self, aspect_ratio='9:16', to_disk=False, workers=None, extra_aspect_ratios=(), scene_dir=None,
+                 keep_order=False, transcriber=None):
+        """
+        scene_dir: with to_disk, folder the prepared scene files go to (scene cache entries are
+        linked there, so eviction cannot pull them from under the job); close() removes it.
+        keep_order: render images in the order they were added instead of by filename
+        (uploaded assets, whose stored names carry no order).
+        transcriber: word-timing provider (transcripts.provider_for_job); narration is then
+        transcribed as soon as it lands, see transcript_future().
+        """
+        self.aspect_ratio = aspect_ratio
+        self.aspect_ratios = [aspect_ratio] + [a for a in dict.fromkeys(extra_aspect_ratios) if a != aspect_ratio]
+        self.to_disk = to_disk
+        self.scene_dir = scene_dir
+        self.keep_order = keep_order
+        self.transcriber = transcriber
+        self._pool = ThreadPoolExecutor(max_workers=workers or video_processor.IMAGE_WORKERS)
+        self._audio_pool = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._images = {}   # path -> future of prepare_scenes(path) for every aspect ratio
+        self._audio = {}    # path -> future of the decoded narration PCM
+        self._transcripts = {}  # path -> future of transcripts.transcribe_async(path)
+
+    def add(self, path):
+        """Route one landed file to its consumer by its magic bytes (thread-safe; usable as an on_file callback)."""
+        kind = asset_index.classify_file(path)
+        if kind == 'zip':
+            self.add_zip(path)
+        else:
+            self._route(path, kind)
+
+    def _route(self, path, kind):
+        if kind == 'image':
+            self.add_image(path)
+        elif kind == 'audio':
+            self.add_audio(path)
+
+    def add_image(self, path):
+        """Queue a known scene image (file or zip member path) for preprocessing."""
+        with self._lock:
+            if path not in self._images:
+                self._images[path] = self._pool.submit(
+                    video_processor.prepare_scenes, path, [(a, None) for a in self.aspect_ratios], self.to_disk,
+                    self.scene_dir,
+                )
+
+    def add_audio(self, path):
+        """Queue a known narration file for decoding."""
+        with self._lock:
+            if path in self._audio:
+                return
+            self._audio[path] = self._audio_pool.submit(audio_mix.decode_pcm, path)
+            # Only a file that is the narration so far (largest, as in audio_path()) is transcribed
+            if self.transcriber is not None and all(
+                    os.path.getsize(p) <= os.path.getsize(path) for p in self._audio if os.path.exists(p)):
+                self._transcripts[path] = transcripts.transcribe_async(path, self.transcriber)
+
+    def add_zip(self, zip_path):
+        """Feed an archive's members without extracting them (only the narration is written out)."""
+        for entry in asset_index.index_zip(zip_path):
+            path = entry.path
+            if entry.kind == 'audio':
+                path = asset_index.materialize(path)
+            self._route(path, entry.kind)
+
+    def audio_path(self):
+        """Narration: the largest .mp3 seen (same rule as utils.collect_assets)."""
+        with self._lock:
+            candidates = list(self._audio)
+        if not candidates:
+            return None
+        return max(candidates, key=lambda p: os.path.getsize(p) if os.path.exists(p) else -1)
+
+    def audio_pcm(self):
+        """Decoded PCM of audio_path(), or None if decoding failed."""
+        path = self.audio_path()
+        if path is None:
+            return None
+        try:
+            return self._audio[path].result()
+        except Exception:
+            return None
+
+    def transcript_future(self):
+        """Future of (transcript, stats) for audio_path(), started when it landed; None if not started."""
+        path = self.audio_path()
+        with self._lock:
+            return self._transcripts.get(path)
+
+    def image_paths(self):
+        """Scene images in render order (insertion order with keep_order, else path order, then numeric_key)."""
+        with self._lock:
+            paths = list(self._images) if self.keep_order else sorted(self._images)
+        if self.keep_order:
+            return paths
+        return sorted(paths, key=video_processor.numeric_key)
+
+    def scenes(self, aspect_ratio=None):
+        """Wait for preprocessing; (source, cache_state) pairs for aspect_ratio (default the first) in image_paths() order."""
+        index = self.aspect_ratios.index(aspect_ratio or self.aspect_ratio)
+        return [self._images[p].result()[index] for p in self.image_paths()]
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self._audio_pool.shutdown(wait=True)
+        if self.scene_dir:
+            shutil.rmtree(self.scene_dir, ignore_errors=True)
@@ -1,10 +1,24 @@
 import os
+import json
+import shutil
+import time
 import uuid
 import threading
-from flask import Flask, request, render_template, jsonify, url_for, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, render_template, jsonify, url_for, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import video_processor
+import delivery
+import asset_index
+import drive_ingest
+import ingest_pipeline
+import outro
+import renditions
+import scheduler
+import task_store
+import transcripts
+import upload_sessions
 import utils
 
 load_dotenv()
@@ -13,8 +27,33 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
 
-# In-memory store for task status. In a real app, you'd use a database or Redis.
-tasks = {}
+# Status stream: how often a stream checks its task's version, and the keep-alive interval
+STATUS_STREAM_POLL_S = float(os.getenv('STATUS_STREAM_POLL_S', '0.5'))
+STATUS_STREAM_HEARTBEAT_S = 15
+# A stream holds a worker thread: close it after STATUS_STREAM_MAX_S, or after STATUS_STREAM_IDLE_S
+# without a change (e.g. a task orphaned by a restart); the EventSource reconnects with Last-Event-ID
+STATUS_STREAM_MAX_S = float(os.getenv('STATUS_STREAM_MAX_S', '600'))
+STATUS_STREAM_IDLE_S = float(os.getenv('STATUS_STREAM_IDLE_S', '120'))
+STATUS_STREAM_IDLE_RETRY_MS = 30000
+TERMINAL_STATUSES = ('completed', 'error')
+
+# Completed previews keep their inputs (listed in a manifest here) until promoted or PREVIEW_RETAIN_H passes
+PREVIEW_DIR = os.getenv('PREVIEW_DIR', os.path.join('uploads', 'previews'))
+PREVIEW_RETAIN_H = float(os.getenv('PREVIEW_RETAIN_H', '24'))
+# How often each worker deletes the inputs of previews past PREVIEW_RETAIN_H (off the request path)
+PREVIEW_PURGE_INTERVAL_S = float(os.getenv('PREVIEW_PURGE_INTERVAL_S', '600'))
+
+# Task status store shared by all web workers (SQLite by default; TASK_STORE=memory for a single dev process)
+tasks = task_store.store_from_env()
+
+def publish_queue_info(task_id, info):
+    tasks.update(task_id, **info)
+
+# Bounded render queue: jobs wait here instead of each getting its own thread immediately
+job_scheduler = scheduler.JobScheduler(on_update=publish_queue_info, store=tasks)
+
+# Conform the closing clips to the export parameters once, ahead of the first job
+threading.Thread(target=outro.warm, daemon=True).start()
 
 def get_file_path(folder, filename):
     return os.path.join(folder, filename)
@@ -23,6 +62,111 @@ def get_file_path(folder, filename):
 def index():
     return render_template('index.html')
 
+def preview_manifest_path(task_id):
+    return os.path.join(PREVIEW_DIR, f"{secure_filename(task_id)}.json")
+
+def run_job(task_id, config, target, args):
+    """Scheduled job body: render, then keep a completed preview's inputs for promotion."""
+    target(*args)
+    if config.get('preview') and (tasks.get(task_id) or {}).get('status') == 'completed':
+        # Inputs as resolved by the job (a Drive job fills in the downloaded paths)
+        retained = {k: v for k, v in config.items() if k not in ('scene_pipeline', 'assemblyai_api_key')}
+        utils.ensure_dir(PREVIEW_DIR)
+        tmp = preview_manifest_path(task_id) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(retained, f)
+        os.replace(tmp, preview_manifest_path(task_id))
+        tasks.update(task_id, promotable=True)
+
+def release_inputs(config):
+    """Delete a job's own input files: direct uploads, linked assets and the Drive download folder."""
+    for p in config.get('temp_files') or []:
+        if p and os.path.exists(p):
+            os.remove(p)
+    if config.get('temp_dir'):
+        shutil.rmtree(config['temp_dir'], ignore_errors=True)
+
+def missing_inputs(config):
+    """Inputs of a retained preview that are no longer on disk (zip members: their archive)."""
+    paths = [config.get('audio_path'), config.get('srt_path')] + list(config.get('image_paths') or [])
+    return [p for p in paths if p and not os.path.exists(asset_index.split_member(p)[0])]
+
+def purge_stale_previews(max_age_h=PREVIEW_RETAIN_H):
+    """Delete the retained inputs of previews that were not promoted within max_age_h hours."""
+    cutoff = time.time() - max_age_h * 3600
+    try:
+        names = os.listdir(PREVIEW_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(PREVIEW_DIR, name)
+        try:
+            if not name.endswith('.json') or os.path.getmtime(path) >= cutoff:
+                continue
+            with open(path, encoding='utf-8') as f:
+                retained = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError):
+            continue
+        release_inputs(retained)
+
+def purge_previews_loop():
+    while True:
+        try:
+            purge_stale_previews()
+        except Exception as e:
+            print(f"Preview purge failed: {e}")
+        time.sleep(PREVIEW_PURGE_INTERVAL_S)
+
+threading.Thread(target=purge_previews_loop, daemon=True).start()
+
+def run_drive_job(task_id, config, drive_link, drive_files):
+    """
+    Scheduled Drive job: download the listed files, handing each one to the scene pipeline
+    as it lands (images are cropped, narration decoded, zips extracted while the rest is
+    still downloading), then render (every rendition of a multi-rendition job).
+    """
+    aspects = [r['aspect_ratio'] for r in config.get('renditions') or []]
+    pipeline = ingest_pipeline.ScenePipeline(config['aspect_ratio'], to_disk=True, extra_aspect_ratios=aspects,
+                                             scene_dir=config['output_path'] + '.scenes',
+                                             transcriber=transcripts.provider_for_job(config))
+    try:
+        tasks.set_step_state(task_id, 'download', 'in_progress')
+        tasks.append_log(task_id, 'Downloading...', status='processing', progress=8)
+        drive_stats = {}
+        drive_ingest.ingest_folder(drive_link, config['temp_dir'], files=drive_files,
+                                   on_file=pipeline.add, stats=drive_stats)
+        tasks.update(task_id, drive_cache=drive_stats)
+        audio_path, image_paths = pipeline.audio_path(), pipeline.image_paths()
+        if not audio_path or not image_paths:
+            raise ValueError('No audio/images found in the provided Drive folder.')
+        tasks.set_step_state(task_id, 'download', 'done')
+        tasks.append_log(task_id, 'Download completed', progress=10)
+    except Exception as e:
+        pipeline.close()
+        tasks.set_step_state(task_id, 'download', 'error')
+        video_processor.update_status(task_id, tasks, 'error', f'Drive download failed: {e}')
+        renditions.mark_failed(tasks, config, f'Drive download failed: {e}')
+        shutil.rmtree(config['temp_dir'], ignore_errors=True)
+        return
+    config.update(audio_path=audio_path, image_paths=image_paths, scene_pipeline=pipeline)
+    if config.get('renditions'):
+        renditions.create_renditions(task_id, tasks, config)
+    else:
+        video_processor.create_video(task_id, tasks, config)
+
+def caption_layout_for(aspect_ratio, font_size, position_vertical):
+    """(font_size, position_vertical_percent) for an aspect: 16:9 is fixed at 60 and 20% from the bottom."""
+    if aspect_ratio == '16:9':
+        return 60, 0.20
+    return font_size, position_vertical / 100.0
+
+def estimate_cost(num_images, aspect_ratio, audio_seconds, preview=False):
+    if preview:
+        return scheduler.estimate_job_cost(num_images, video_processor.preview_size_for(aspect_ratio),
+                                           audio_seconds, fps=video_processor.PREVIEW_FPS)
+    return scheduler.estimate_job_cost(num_images, video_processor.output_size_for(aspect_ratio), audio_seconds)
+
 @app.route('/generate', methods=['POST'])
 def generate():
     if request.method == 'POST':
@@ -57,22 +201,85 @@ def generate():
             if bgm_level not in {4, 6, 8, 10, 12}:
                 bgm_level = 4
 
+            # Optional loudness normalization of the narration (default off)
+            raw_normalize = request.form.get('normalize_narration')
+            normalize_narration = False
+            if raw_normalize is not None:
+                normalize_narration = str(raw_normalize).strip().lower() in ('on', 'true', '1', 'yes')
+
+            # Render engine: 'moviepy' (default) or 'ffmpeg' (single native filtergraph, falls back to MoviePy)
+            render_engine = str(request.form.get('render_engine', os.getenv('RENDER_ENGINE', 'moviepy'))).strip().lower()
+            if render_engine not in {'moviepy', 'ffmpeg'}:
+                render_engine = 'moviepy'
+
+            # Caption mode: 'sprite' (Pillow overlays, default) or 'ass' (ASS script burned in by ffmpeg/libass)
+            caption_mode = str(request.form.get('caption_mode', os.getenv('CAPTION_MODE', 'sprite'))).strip().lower()
+            if caption_mode not in {'sprite', 'ass'}:
+                caption_mode = 'sprite'
+
+            # Parallel export (MoviePy engine): render scene segments on all cores, then stream-copy concat
+            raw_parallel = request.form.get('parallel_export', os.getenv('PARALLEL_EXPORT', ''))
+            parallel_export = str(raw_parallel).strip().lower() in ('on', 'true', '1', 'yes')
+
+            # HLS packaging: stream-copied fMP4 segments + poster for in-browser playback (/stream, /poster)
+            raw_hls = request.form.get('hls', os.getenv('HLS_PACKAGING', ''))
+            hls = str(raw_hls).strip().lower() in ('on', 'true', '1', 'yes')
+
+            # Keep the captionless base render in the stage cache (one extra encode) so caption restyles reuse it
+            raw_keep_base = request.form.get('keep_base', os.getenv('KEEP_BASE_RENDER', ''))
+            keep_base = str(raw_keep_base).strip().lower() in ('on', 'true', '1', 'yes')
+
+            # Preview: fast low-resolution render of the same timeline, promotable via /promote/<task_id>
+            raw_preview = request.form.get('preview')
+            preview = raw_preview is not None and str(raw_preview).strip().lower() in ('on', 'true', '1', 'yes')
+
+            # Renditions: several aspect ratios (e.g. '9:16,16:9') rendered by one job from shared
+            # ingestion, transcription, audio mix and image decode; previews render aspect_ratio only
+            rendition_aspects = [] if preview else renditions.parse_aspects(request.form.get('renditions'))
+            if len(rendition_aspects) == 1:
+                aspect_ratio = rendition_aspects[0]
+            if len(rendition_aspects) < 2:
+                rendition_aspects = []
+            elif aspect_ratio not in rendition_aspects:
+                aspect_ratio = rendition_aspects[0]
+
+            # Queue priority: lower values start first; equal priorities run in arrival order
+            try:
+                priority = int(str(request.form.get('priority', '0')).strip())
+            except Exception:
+                priority = 0
+
             # --- File Handling ---
-            # Allow either: (a) Google Drive link, or (b) uploaded audio + images
-            if not drive_link and ('audio' not in request.files or 'images' not in request.files):
+            # Allow either: (a) Google Drive link, (b) assets finalized via /uploads, or (c) uploaded audio + images
+            audio_asset = request.form.get('audio_asset', '').strip()
+            image_assets = [a.strip() for v in request.form.getlist('image_assets') for a in v.split(',') if a.strip()]
+            srt_asset = request.form.get('srt_asset', '').strip()
+            use_assets = bool(audio_asset or image_assets)
+
+            if not drive_link and not use_assets and ('audio' not in request.files or 'images' not in request.files):
                 return jsonify({'status': 'error', 'message': 'Provide a Google Drive folder link or upload audio and images.'}), 400
 
             audio_file = request.files.get('audio')
             image_files = request.files.getlist('images') if 'images' in request.files else []
             srt_file = request.files.get('srt')
 
-            if not drive_link:
+            if not drive_link and not use_assets:
                 if (not audio_file or audio_file.filename == '') or (not any(f.filename for f in image_files)):
                     return jsonify({'status': 'error', 'message': 'No selected file.'}), 400
 
+            # Assets are shared, content-addressed files: resolve them up front (the job gets its own links below)
+            asset_paths = {}
+            for asset_id in ([audio_asset] if audio_asset else []) + image_assets + ([srt_asset] if srt_asset else []):
+                path = upload_sessions.asset_path(asset_id)
+                if not path:
+                    return jsonify({'status': 'error', 'message': f'Unknown asset: {asset_id}'}), 400
+                asset_paths[asset_id] = path
+            if use_assets and not drive_link and (not audio_asset or not image_assets):
+                return jsonify({'status': 'error', 'message': 'Provide both audio_asset and image_assets.'}), 400
+
             # --- Task Setup ---
             task_id = uuid.uuid4().hex
-            tasks[task_id] = {
+            tasks.create(task_id, {
                 'status': 'starting',
                 'logs': ['Task initiated...'],
                 'progress': 0,
@@ -81,17 +288,15 @@ def generate():
                     {'key': 'build_dir', 'label': 'Building directory structure', 'state': 'pending'},
                     {'key': 'download', 'label': 'Downloading', 'state': 'pending'},
                 ],
-            }
+            })
 
             def set_step_state(task_id_local, key, state):
-                for s in tasks[task_id_local].get('steps', []):
-                    if s['key'] == key:
-                        s['state'] = state
-                        return
+                tasks.set_step_state(task_id_local, key, state)
             def log(task_id_local, message, progress=None):
-                tasks[task_id_local]['logs'].append(message)
                 if isinstance(progress, (int, float)):
-                    tasks[task_id_local]['progress'] = int(progress)
+                    tasks.append_log(task_id_local, message, progress=int(progress))
+                else:
+                    tasks.append_log(task_id_local, message)
 
             # --- Project Setup ---
             project_id = f"{secure_filename(project_title)}-{task_id[:8]}"
@@ -101,77 +306,87 @@ def generate():
             # --- Resolve Inputs (Drive or Uploads) ---
             audio_path = None
             image_paths = []
-            temp_dir = None  # for Drive downloads cleanup
-            temp_files = []  # for direct uploads cleanup
-
+            temp_dir = None  # Drive download or direct upload folder, removed after the job
+            temp_files = []  # per-task files outside it (linked assets, uploaded SRT)
+
+            # Link the resolved assets into per-task files, removed with the job like direct uploads:
+            # the asset store is an LRU cache and may evict them while the job is queued or a
+            # preview waits for promotion
+            for asset_id, path in list(asset_paths.items()):
+                pinned = get_file_path(app.config['UPLOAD_FOLDER'], f"{task_id[:8]}_{os.path.basename(path)}")
+                try:
+                    asset_paths[asset_id] = video_processor.link_or_copy(path, pinned)
+                except OSError:
+                    return jsonify({'status': 'error', 'message': f'Asset expired: {asset_id}'}), 400
+                temp_files.append(pinned)
+
+            drive_files = None
             if drive_link:
-                # Download assets from Google Drive folder
+                # List the Google Drive folder now (one request); the download itself runs in the
+                # scheduled job, pipelined with image preprocessing (see run_drive_job)
                 log(task_id, 'Retrieving folder contents...', progress=1)
                 set_step_state(task_id, 'retrieve', 'in_progress')
+                drive_files = drive_ingest.transport_from_env().list_folder(drive_ingest.folder_id_from_url(drive_link))
+                if not drive_files:
+                    return jsonify({'status': 'error', 'message': 'No audio/images found in the provided Drive folder.'}), 400
+                set_step_state(task_id, 'retrieve', 'done')
+                log(task_id, 'Retrieving folder contents completed', progress=2)
                 download_dir = get_file_path(app.config['UPLOAD_FOLDER'], f"{project_id}_drive")
                 set_step_state(task_id, 'build_dir', 'in_progress')
                 log(task_id, 'Building directory structure...', progress=3)
                 utils.ensure_dir(download_dir)
                 set_step_state(task_id, 'build_dir', 'done')
                 log(task_id, 'Building directory structure completed', progress=5)
-                set_step_state(task_id, 'download', 'in_progress')
-                log(task_id, 'Downloading...', progress=8)
-                utils.download_drive_folder(drive_link, download_dir)
-                utils.extract_zip_files_in_dir(download_dir)
-                audio_path_drive, image_paths_drive = utils.collect_assets(download_dir)
-                set_step_state(task_id, 'download', 'done')
-                set_step_state(task_id, 'retrieve', 'done')
-                log(task_id, 'Retrieving folder contents completed', progress=10)
-                if not audio_path_drive or not image_paths_drive:
-                    return jsonify({'status': 'error', 'message': 'No audio/images found in the provided Drive folder.'}), 400
-                audio_path = audio_path_drive
-                image_paths = image_paths_drive
                 temp_dir = download_dir
+            elif use_assets:
+                audio_path = asset_paths[audio_asset]
+                image_paths = [asset_paths[a] for a in image_assets]
+                for key in ('build_dir', 'retrieve', 'download'):
+                    set_step_state(task_id, key, 'done')
+                log(task_id, 'Using uploaded assets', progress=10)
             else:
-                # Save uploaded files
+                # Save uploaded files in a folder of their own per task (queued jobs never share or delete
+                # each other's inputs), under their original names, which carry the scene order
                 set_step_state(task_id, 'build_dir', 'in_progress')
                 log(task_id, 'Building directory structure...', progress=3)
-                audio_filename = secure_filename(audio_file.filename)
-                audio_path = get_file_path(app.config['UPLOAD_FOLDER'], audio_filename)
+                upload_dir = get_file_path(app.config['UPLOAD_FOLDER'], f"{project_id}_uploads")
+                utils.ensure_dir(upload_dir)
+                temp_dir = upload_dir
+                audio_path = get_file_path(upload_dir, secure_filename(audio_file.filename))
                 audio_file.save(audio_path)
-                temp_files.append(audio_path)
                 set_step_state(task_id, 'build_dir', 'done')
                 log(task_id, 'Building directory structure completed', progress=5)
 
                 for image in image_files:
-                    image_filename = secure_filename(image.filename)
-                    image_path = get_file_path(app.config['UPLOAD_FOLDER'], image_filename)
+                    image_path = get_file_path(upload_dir, secure_filename(image.filename))
                     image.save(image_path)
                     image_paths.append(image_path)
-                    temp_files.append(image_path)
                 set_step_state(task_id, 'retrieve', 'done')
                 set_step_state(task_id, 'download', 'done')
                 log(task_id, 'Retrieving folder contents completed', progress=10)
 
             # Optional SRT upload
-            srt_path = None
-            if srt_file and srt_file.filename:
-                srt_filename = secure_filename(srt_file.filename)
+            srt_path = asset_paths.get(srt_asset) if srt_asset else None
+            if srt_path is None and srt_file and srt_file.filename:
+                srt_filename = f"{task_id[:8]}_{secure_filename(srt_file.filename)}"
                 srt_path = get_file_path(app.config['UPLOAD_FOLDER'], srt_filename)
                 srt_file.save(srt_path)
                 # treat uploaded SRT as temp file as well
                 temp_files.append(srt_path)
 
             # --- Video Generation Config ---
-            output_video_filename = f"{project_id}.mp4"
+            output_video_filename = f"{project_id}_preview.mp4" if preview else f"{project_id}.mp4"
             output_video_path = get_file_path(project_output_dir, output_video_filename)
 
             # Build a proper download URL via a Flask route (relative path for same-origin fetch)
             video_url = url_for('download_video', task_id=task_id, _external=False)
+            hls_url = url_for('stream_video', task_id=task_id, filename=delivery.HLS_PLAYLIST, _external=False)
+            poster_url = url_for('video_poster', task_id=task_id, _external=False)
 
 
-            # Compute vertical caption position percent: force 20% for 16:9; otherwise use slider
-            if aspect_ratio == '16:9':
-                position_vertical_percent = 0.20
-                # Force font size for widescreen
-                font_size = 60
-            else:
-                position_vertical_percent = position_vertical / 100.0
+            # Compute vertical caption position percent: force 20% for 16:9 (and font size 60); otherwise use slider
+            requested_font_size = font_size
+            font_size, position_vertical_percent = caption_layout_for(aspect_ratio, font_size, position_vertical)
 
             # Resolve background music path: env override or default to resource/Pulsar.mp3
             default_bgm_path = os.path.join(app.root_path, 'resource', 'Pulsar.mp3')
@@ -189,66 +404,391 @@ def generate():
                 "use_auto_captions": caption_auto,
                 "srt_path": srt_path,
                 "video_url": video_url,
+                "hls": hls,
+                "hls_url": hls_url,
+                "poster_url": poster_url,
                 "aspect_ratio": aspect_ratio,
                 "temp_dir": temp_dir,
                 "temp_files": temp_files,
                 "background_music_enabled": background_music_enabled,
                 "background_music_path": bgm_path,
                 "background_music_level_percent": bgm_level,
+                "normalize_narration": normalize_narration,
+                "render_engine": render_engine,
+                "caption_mode": caption_mode,
+                "parallel_export": parallel_export,
+                "keep_base": keep_base,
+                "preview": preview,
+                # Asset ids are content hashes: render in submission order, not by stored filename
+                "keep_image_order": bool(use_assets and not drive_link),
             }
 
             # Store project information on the task for download
-            tasks[task_id]['project_id'] = project_id
-            tasks[task_id]['output_video_filename'] = output_video_filename
-
-            # --- Run video creation in a background thread ---
-            thread = threading.Thread(target=video_processor.create_video, args=(task_id, tasks, config))
-            thread.start()
+            tasks.update(task_id, project_id=project_id, output_video_filename=output_video_filename, preview=preview)
+
+            if rendition_aspects:
+                # One task per rendition (own status, download and stream); the job reports on this parent task
+                rendition_configs = []
+                for aspect in rendition_aspects:
+                    child_id = uuid.uuid4().hex
+                    child_filename = renditions.rendition_filename(project_id, aspect)
+                    child_font_size, child_position = caption_layout_for(aspect, requested_font_size, position_vertical)
+                    tasks.create(child_id, {'status': 'queued', 'logs': [f'Rendition {aspect} of job {task_id}'],
+                                            'progress': 0, 'steps': []})
+                    tasks.update(child_id, project_id=project_id, output_video_filename=child_filename,
+                                 rendition_of=task_id, aspect_ratio=aspect)
+                    rendition_configs.append({
+                        'task_id': child_id,
+                        'aspect_ratio': aspect,
+                        'font_size': child_font_size,
+                        'position_vertical_percent': child_position,
+                        'output_path': get_file_path(project_output_dir, child_filename),
+                        'video_url': url_for('download_video', task_id=child_id, _external=False),
+                        'hls_url': url_for('stream_video', task_id=child_id, filename=delivery.HLS_PLAYLIST, _external=False),
+                        'poster_url': url_for('video_poster', task_id=child_id, _external=False),
+                    })
+                # The parent has no video of its own; its output path only prefixes the shared audio mix
+                config.update(renditions=rendition_configs, output_path=get_file_path(project_output_dir, f"{project_id}_shared"))
+                tasks.update(task_id, output_video_filename=None, renditions=renditions.summarize(tasks, rendition_configs))
+
+            # --- Queue video creation on the bounded scheduler ---
+            if drive_files is not None:
+                num_images = sum(1 for f in drive_files if f.name.lower().endswith(ingest_pipeline.IMAGE_EXTS))
+                audio_seconds = scheduler.DEFAULT_AUDIO_SECONDS
+                target, args = run_drive_job, (task_id, config, drive_link, drive_files)
+            else:
+                num_images = len(image_paths)
+                audio_seconds = utils.media_duration(audio_path)
+                target, args = video_processor.create_video, (task_id, tasks, config)
+                if rendition_aspects:
+                    target = renditions.create_renditions
+            cost = sum(estimate_cost(num_images, aspect, audio_seconds, preview)
+                       for aspect in (rendition_aspects or [aspect_ratio]))
+            tasks.update(task_id, status='queued', estimated_cost=round(cost, 1))
+            queue_info = job_scheduler.submit(task_id, run_job, args=(task_id, config, target, args),
+                                              cost=cost, priority=priority)
+            if queue_info.get('queue_state') == 'queued':
+                log(task_id, f"Queued (position {queue_info['queue_position']})")
 
             return jsonify({
                 'status': 'success',
-                'message': 'Video generation started!',
-                'task_id': task_id
+                'message': 'Video generation queued!',
+                'task_id': task_id,
+                'queue_position': queue_info.get('queue_position', 0),
+                'estimated_start': queue_info.get('estimated_start'),
+                'renditions': [{'aspect_ratio': r['aspect_ratio'], 'task_id': r['task_id']}
+                               for r in config.get('renditions') or []],
             })
 
         except Exception as e:
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/promote/<task_id>', methods=['POST'])
+def promote(task_id):
+    """
+    Re-render a completed preview at full quality from its retained inputs (no upload or
+    Drive download). Returns the new task like /generate.
+    """
+    source = tasks.get(task_id)
+    if not source or not source.get('preview'):
+        return jsonify({'status': 'error', 'message': 'Preview not found'}), 404
+    if source.get('status') != 'completed':
+        return jsonify({'status': 'error', 'message': 'Preview has not completed'}), 409
+    # Claim the manifest atomically so concurrent promotions (on any worker) start only one render
+    manifest = preview_manifest_path(task_id)
+    claimed = f"{manifest}.{uuid.uuid4().hex}.promoting"
+    try:
+        os.rename(manifest, claimed)
+    except OSError:
+        return jsonify({'status': 'error', 'message': 'Preview already promoted or expired',
+                        'promoted_to': source.get('promoted_to')}), 409
+    try:
+        expired = os.path.getmtime(claimed) < time.time() - PREVIEW_RETAIN_H * 3600
+        with open(claimed, encoding='utf-8') as f:
+            config = json.load(f)
+    finally:
+        os.remove(claimed)
+    # The purge runs on a timer, so a manifest past its retention may still be here
+    if expired or missing_inputs(config):
+        release_inputs(config)
+        tasks.update(task_id, promotable=False)
+        return jsonify({'status': 'error', 'message': 'Preview inputs expired; render it again'}), 410
+
+    try:
+        priority = int(str(request.form.get('priority', '0')).strip())
+    except Exception:
+        priority = 0
+    new_id = uuid.uuid4().hex
+    tasks.create(new_id, {
+        'status': 'starting',
+        'logs': [f'Promoting preview {task_id} to a full render...'],
+        'progress': 0,
+        'steps': [
+            {'key': 'retrieve', 'label': 'Retrieving folder contents', 'state': 'done'},
+            {'key': 'build_dir', 'label': 'Building directory structure', 'state': 'done'},
+            {'key': 'download', 'label': 'Downloading', 'state': 'done'},
+        ],
+    })
+    project_id = source.get('project_id')
+    output_video_filename = f"{project_id}.mp4"
+    config.update(
+        preview=False,
+        output_path=get_file_path(os.path.dirname(config['output_path']), output_video_filename),
+        video_url=url_for('download_video', task_id=new_id, _external=False),
+        hls_url=url_for('stream_video', task_id=new_id, filename=delivery.HLS_PLAYLIST, _external=False),
+        poster_url=url_for('video_poster', task_id=new_id, _external=False),
+        assemblyai_api_key=os.getenv("ASSEMBLYAI_API_KEY"),
+    )
+    tasks.update(new_id, project_id=project_id, output_video_filename=output_video_filename, promoted_from=task_id)
+    tasks.update(task_id, promotable=False, promoted_to=new_id)
+
+    cost = estimate_cost(len(config['image_paths']), config['aspect_ratio'], utils.media_duration(config['audio_path']))
+    tasks.update(new_id, status='queued', estimated_cost=round(cost, 1))
+    queue_info = job_scheduler.submit(new_id, run_job, args=(new_id, config, video_processor.create_video,
+                                                             (new_id, tasks, config)),
+                                      cost=cost, priority=priority)
+    if queue_info.get('queue_state') == 'queued':
+        tasks.append_log(new_id, f"Queued (position {queue_info['queue_position']})")
+    return jsonify({
+        'status': 'success',
+        'message': 'Full render queued!',
+        'task_id': new_id,
+        'queue_position': queue_info.get('queue_position', 0),
+        'estimated_start': queue_info.get('estimated_start'),
+    })
+
+def log_cursor_arg():
+    """Log cursor from ?since=N (or an EventSource reconnect's Last-Event-ID)."""
+    raw = request.args.get('since') or request.headers.get('Last-Event-ID') or 0
+    try:
+        return max(0, int(raw))
+    except (TypeError, ValueError):
+        return 0
+
+def status_delta(previous, current):
+    """Fields of current that differ from previous, plus the log lines read since previous."""
+    delta = {k: v for k, v in current.items()
+             if k not in ('logs', 'log_cursor', 'version') and previous.get(k) != v}
+    delta['logs'] = current['logs']
+    delta['log_cursor'] = current['log_cursor']
+    delta['version'] = current['version']
+    return delta
+
+def sse_event(data, event_id=None, event=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(',', ':')))
+    return "\n".join(lines) + "\n\n"
+
+# --- Resumable uploads ---
+# Images are cropped into the scene cache as soon as their upload is finalized
+scene_warm_pool = ThreadPoolExecutor(max_workers=video_processor.IMAGE_WORKERS)
+
+def upload_error(e):
+    return jsonify({'status': 'error', 'message': str(e), **e.extra}), e.status
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start an upload session: {filename, size?, aspect_ratio?} as JSON or form fields."""
+    params = request.get_json(silent=True) or request.form
+    try:
+        size = params.get('size')
+        size = int(size) if size not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid size'}), 400
+    try:
+        meta = upload_sessions.create_session(params.get('filename', ''), size=size, aspect_ratio=params.get('aspect_ratio'))
+    except upload_sessions.UploadError as e:
+        return upload_error(e)
+    meta['upload_url'] = url_for('upload_chunk', upload_id=meta['upload_id'], _external=False)
+    return jsonify(meta), 201
+
+def chunk_offset():
+    """Chunk start from the Upload-Offset header, a 'Content-Range: bytes a-b/n' header or ?offset=."""
+    if request.headers.get('Upload-Offset') is not None:
+        return int(request.headers['Upload-Offset'])
+    content_range = request.headers.get('Content-Range', '')
+    if content_range.startswith('bytes '):
+        return int(content_range[6:].split('-', 1)[0])
+    return int(request.args.get('offset', 0))
+
+@app.route('/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def upload_chunk(upload_id):
+    """Append one chunk; the raw request body is streamed to disk (no form parsing)."""
+    try:
+        offset = chunk_offset()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid offset'}), 400
+    try:
+        new_offset = upload_sessions.write_chunk(upload_id, offset, request.stream)
+    except upload_sessions.UploadError as e:
+        return upload_error(e)
+    resp = jsonify({'upload_id': upload_id, 'offset': new_offset})
+    resp.headers['Upload-Offset'] = str(new_offset)
+    return resp
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def upload_state(upload_id):
+    """Current offset of an upload, to resume after a dropped connection."""
+    try:
+        meta = upload_sessions.session_meta(upload_id)
+    except upload_sessions.UploadError as e:
+        return upload_error(e)
+    resp = jsonify(meta)
+    resp.headers['Upload-Offset'] = str(meta['offset'])
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Turn a complete upload into an asset; optional sha256 is verified."""
+    params = request.get_json(silent=True) or request.form
+    try:
+        asset = upload_sessions.finalize(upload_id, sha256=params.get('sha256'))
+    except upload_sessions.UploadError as e:
+        return upload_error(e)
+    path = asset.pop('path')
+    if asset['kind'] == 'image' and asset.get('aspect_ratio') in ('9:16', '16:9') and video_processor.scene_cache is not None:
+        scene_warm_pool.submit(video_processor.warm_scene, path, asset['aspect_ratio'])
+    return jsonify(asset)
+
 @app.route('/status/<task_id>')
 def task_status(task_id):
-    task = tasks.get(task_id)
+    # ?since=N returns only log lines from index N on; log_cursor is the value to send next time
+    since = log_cursor_arg()
+    version = tasks.version(task_id)
+    if version is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    if request.if_none_match.contains(f"{version}-{since}"):
+        return Response(status=304, headers={'ETag': f'"{version}-{since}"', 'Cache-Control': 'no-cache'})
+    task = tasks.get(task_id, since=since)
     if not task:
         return jsonify({'status': 'error', 'message': 'Task not found'}), 404
-    return jsonify(task)
+    resp = jsonify(task)
+    resp.set_etag(f"{task['version']}-{since}")
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
 
-@app.route('/download/<task_id>')
-def download_video(task_id):
-    task = tasks.get(task_id)
+@app.route('/status/<task_id>/stream')
+def task_status_stream(task_id):
+    """
+    Server-Sent Events: one full snapshot, then only changed fields and new log lines
+    whenever the task's version moves. Event ids are log cursors, so a reconnecting
+    EventSource resumes its log where it left off. The stream ends with an 'end' event
+    once the task completes or fails. Otherwise it is closed after STATUS_STREAM_MAX_S, or
+    after STATUS_STREAM_IDLE_S without changes (asking the client to wait longer before
+    reconnecting), so a task that never finishes cannot hold a worker thread forever.
+    """
+    task = tasks.get(task_id, since=log_cursor_arg())
     if not task:
         return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+
+    def stream(last):
+        yield sse_event(last, event_id=last['log_cursor'])
+        opened = last_sent = last_change = time.time()
+        while last.get('status') not in TERMINAL_STATUSES:
+            time.sleep(STATUS_STREAM_POLL_S)
+            now = time.time()
+            if now - last_change >= STATUS_STREAM_IDLE_S:
+                yield f"retry: {STATUS_STREAM_IDLE_RETRY_MS}\n\n"
+                return
+            if now - opened >= STATUS_STREAM_MAX_S:
+                return
+            version = tasks.version(task_id)
+            if version is None:
+                return
+            if version != last['version']:
+                current = tasks.get(task_id, since=last['log_cursor'])
+                if current is None:
+                    return
+                yield sse_event(status_delta(last, current), event_id=current['log_cursor'])
+                last, last_sent, last_change = current, time.time(), time.time()
+            elif now - last_sent >= STATUS_STREAM_HEARTBEAT_S:
+                yield ": keep-alive\n\n"
+                last_sent = now
+        yield sse_event({'status': last.get('status')}, event='end')
+
+    resp = Response(stream_with_context(stream(task)), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # let nginx pass events through immediately
+    return resp
+
+def completed_output(task_id):
+    """(project_id, output filename) of a completed task, or (None, error response)."""
+    task = tasks.get(task_id)
+    if not task:
+        return None, (jsonify({'status': 'error', 'message': 'Task not found'}), 404)
     if task.get('status') != 'completed':
-        return jsonify({'status': 'error', 'message': 'Video not ready for download'}), 400
+        return None, (jsonify({'status': 'error', 'message': 'Video not ready for download'}), 400)
     project_id = task.get('project_id')
     filename = task.get('output_video_filename')
     if not project_id or not filename:
-        return jsonify({'status': 'error', 'message': 'Download info missing'}), 500
+        return None, (jsonify({'status': 'error', 'message': 'Download info missing'}), 500)
+    return (project_id, filename), None
+
+
+def send_output(project_id, relpath, cache_control, as_attachment=False):
+    """Serve outputs/<project_id>/<relpath>: from Flask with Range/ETag, or handed to nginx via X-Accel-Redirect."""
     directory = os.path.join(app.config['OUTPUT_FOLDER'], project_id)
-    if not os.path.exists(os.path.join(directory, filename)):
+    if not os.path.exists(os.path.join(directory, relpath)):
         return jsonify({'status': 'error', 'message': 'File not found'}), 404
-    # Disable conditional and range requests to avoid 206 partial responses on first request
-    resp = send_from_directory(directory=directory, path=filename, as_attachment=True, conditional=False)
-    resp.headers['Accept-Ranges'] = 'none'
-    # Disable caching to prevent browsers from caching transient 400/404 and to ensure fresh file
-    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    resp.headers['Pragma'] = 'no-cache'
-    resp.headers['Expires'] = '0'
-    resp.headers['Content-Type'] = 'video/mp4'
+    if delivery.X_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the file itself (sendfile, Range, ETag) and types it from its own map; this
+        # worker only authorized the request
+        resp = app.response_class(status=200)
+        del resp.headers['Content-Type']
+        resp.headers['X-Accel-Redirect'] = delivery.accel_redirect_path(project_id, relpath)
+        if as_attachment:
+            resp.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(relpath)}"'
+    else:
+        # ETag/Last-Modified validators plus Range (206) and If-Range, so players can seek and retries resume
+        resp = send_from_directory(directory=directory, path=relpath, as_attachment=as_attachment,
+                                   conditional=True, etag=True)
+        resp.headers['Content-Type'] = delivery.CONTENT_TYPES.get(os.path.splitext(relpath)[1], 'application/octet-stream')
+    resp.headers['Cache-Control'] = cache_control
     return resp
 
 
+@app.route('/download/<task_id>')
+def download_video(task_id):
+    output, error = completed_output(task_id)
+    if error:
+        return error
+    project_id, filename = output
+    # Revalidate on every use (the ETag makes that a 304) instead of storing a possibly stale copy
+    return send_output(project_id, filename, 'private, no-cache', as_attachment=True)
+
+
+@app.route('/stream/<task_id>/<filename>')
+def stream_video(task_id, filename):
+    """HLS package of a completed video: the playlist, its init segment and .m4s segments."""
+    output, error = completed_output(task_id)
+    if error:
+        return error
+    project_id, video_filename = output
+    if filename != secure_filename(filename):
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    hls_dir = os.path.basename(delivery.hls_dir_for(video_filename))
+    # Segments never change under a name; the playlist is revalidated
+    cache_control = 'private, no-cache' if filename == delivery.HLS_PLAYLIST else 'private, max-age=86400'
+    return send_output(project_id, f"{hls_dir}/{filename}", cache_control)
+
+
+@app.route('/poster/<task_id>')
+def video_poster(task_id):
+    output, error = completed_output(task_id)
+    if error:
+        return error
+    project_id, video_filename = output
+    return send_output(project_id, delivery.poster_path_for(video_filename), 'private, max-age=86400')
+
+
 if __name__ == '__main__':
     for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
         os.makedirs(folder, exist_ok=True)
-    # Disable the auto-reloader to avoid losing in-memory `tasks` on restarts
+    # Disable the auto-reloader so running jobs (and an in-memory task store) survive code edits
     # This prevents issues like "Task not found" during long background jobs when watchdog triggers
     app.run(debug=True, use_reloader=False)
@@ -0,0 +1,104 @@
+"""
+Pre-conformed closing ("Thankyou") clips.
+
+The outro is transcoded once per (source, frame size, fade) to exactly the export
+parameters (EXPORT_FPS, libx264 High/yuv420p, AAC 44.1 kHz stereo) with its fade-in
+and 50% volume baked in. Jobs then append it to the rendered narration with the
+concat demuxer (stream copy) instead of decoding and re-encoding it every time.
+"""
+
+import hashlib
+import os
+import subprocess
+import threading
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+import ffmpeg_render
+import parallel_render
+
+EXPORT_FPS = 24
+# Shared by every encode that gets stream-copy concatenated, so SPS/PPS line up
+EXPORT_X264_PARAMS = ffmpeg_render.EXPORT_X264_PARAMS
+OUTRO_VOLUME = 0.5
+OUTRO_CACHE_DIR = os.getenv("OUTRO_CACHE_DIR", os.path.join("cache", "outro"))
+
+_lock = threading.Lock()
+_prepared = {}
+
+
+def outro_source_for(aspect_ratio, resource_dir='resource'):
+    """Closing clip shipped in resource/ for an aspect ratio."""
+    if aspect_ratio == '16:9':
+        return os.path.join(resource_dir, 'Thankyou169.mp4')
+    return os.path.join(resource_dir, 'Thankyou 916.mp4')
+
+
+def conform_outro(src, dst, frame_size, fade_in, fps=EXPORT_FPS):
+    """Transcode src to dst at the export parameters with fade-in and volume baked in."""
+    w, h = frame_size
+    infos = ffmpeg_parse_infos(src)
+    args = [parallel_render.ffmpeg_binary(), "-y", "-v", "error", "-i", src]
+    if infos.get('audio_found'):
+        audio_map = "0:a:0"
+        af = f"volume={OUTRO_VOLUME},aformat=sample_rates=44100:channel_layouts=stereo"
+    else:
+        # Keep an audio stream so the outro concatenates with narrated content
+        args += ["-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo"]
+        audio_map = "1:a:0"
+        af = "anull"
+    vf = f"scale={w}:{h},setsar=1,fps={fps},format=yuv420p"
+    if fade_in > 0:
+        vf += f",fade=t=in:st=0:d={fade_in:.4f}"
+    args += [
+        "-map", "0:v:0", "-map", audio_map, "-vf", vf, "-af", af, "-shortest",
+        "-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p", *EXPORT_X264_PARAMS,
+        "-c:a", "aac", "-ar", "44100", "-ac", "2",
+        "-movflags", "+faststart", dst,
+    ]
+    subprocess.run(args, check=True, capture_output=True)
+    return dst
+
+
+def prepared_outro(src, frame_size, fade_in):
+    """
+    Path and duration of the conformed outro for these params, building it on first use.
+    Returns (path, duration) or (None, 0.0) when src is missing.
+    """
+    if not src or not os.path.exists(src):
+        return None, 0.0
+    st = os.stat(src)
+    key = f"{os.path.abspath(src)}|{st.st_size}|{int(st.st_mtime)}|{frame_size[0]}x{frame_size[1]}|{fade_in:.3f}"
+    with _lock:
+        hit = _prepared.get(key)
+        if hit and os.path.exists(hit[0]):
+            return hit
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+        os.makedirs(OUTRO_CACHE_DIR, exist_ok=True)
+        dst = os.path.join(OUTRO_CACHE_DIR, f"outro_{digest}.mp4")
+        if not os.path.exists(dst):
+            tmp = f"{dst}.{os.getpid()}.tmp.mp4"
+            try:
+                conform_outro(src, tmp, frame_size, fade_in)
+                os.replace(tmp, dst)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        result = (dst, float(ffmpeg_parse_infos(dst).get('duration') or 0.0))
+        _prepared[key] = result
+        return result
+
+
+def append_outro(main_path, outro_path, output_path):
+    """Append the conformed outro to a rendered main file without re-encoding (fast start output)."""
+    return parallel_render.concat_segments([main_path, outro_path], output_path, faststart=True)
+
+
+def warm(aspect_ratios=('9:16', '16:9'), fade_in=0.5, resource_dir='resource'):
+    """Prepare outros ahead of the first job (best effort; run from a background thread)."""
+    from video_processor import output_size_for
+    for aspect_ratio in aspect_ratios:
+        try:
+            prepared_outro(outro_source_for(aspect_ratio, resource_dir), output_size_for(aspect_ratio), fade_in)
+        except Exception as e:
+            print(f"Outro warmup failed for {aspect_ratio}: {e}")
@@ -0,0 +1,123 @@
+"""
+Segment-parallel export for the MoviePy engine.
+
+The timeline is split at scene boundaries (fades never cross a scene), each
+segment is rendered video-only in its own process, the segments are joined
+with ffmpeg's concat demuxer without re-encoding, and the audio is muxed once
+at the end.
+"""
+
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+
+from moviepy.config import get_setting
+
+import scheduler
+
+# Segment processes per export; 0 = the job's share of the cores (scheduler.cores_per_job)
+PARALLEL_RENDER_WORKERS = int(os.getenv("PARALLEL_RENDER_WORKERS", "0"))
+
+
+def ffmpeg_binary():
+    return get_setting("FFMPEG_BINARY")
+
+
+def pool_size(concurrent_renders=1):
+    """
+    Segment processes for one export. Several jobs run at once (the scheduler's limit) and
+    a multi-rendition job renders concurrent_renders exports, so each gets its share of the
+    cores rather than all of them.
+    """
+    if PARALLEL_RENDER_WORKERS > 0:
+        return PARALLEL_RENDER_WORKERS
+    return max(1, scheduler.cores_per_job() // max(1, int(concurrent_renders)))
+
+
+def plan_segments(frame_counts, max_segments):
+    """
+    Group consecutive scenes into at most max_segments runs of roughly equal frame count.
+    Returns a list of (first_scene, last_scene_exclusive, start_frame, num_frames).
+    """
+    num_scenes = len(frame_counts)
+    max_segments = max(1, min(max_segments, num_scenes))
+    total = sum(frame_counts)
+    target = total / float(max_segments)
+    segments = []
+    first, start_frame, acc = 0, 0, 0
+    for i, n in enumerate(frame_counts):
+        acc += n
+        remaining_scenes = num_scenes - (i + 1)
+        remaining_segments = max_segments - len(segments) - 1
+        if remaining_scenes == 0 or (acc >= target and remaining_segments > 0):
+            segments.append((first, i + 1, start_frame, acc))
+            first, start_frame, acc = i + 1, start_frame + acc, 0
+    return segments
+
+
+def run_segments(worker, specs, workers, on_progress=None, poll_s=0.5):
+    """
+    Render specs with worker(spec, progress_map) in a process pool.
+    progress_map[spec['index']] holds frames written so far; on_progress(pct) receives
+    the frame-weighted total. Raises the first worker exception without waiting for the
+    other segments: queued ones are cancelled and running ones stopped, so the caller's
+    fallback starts right away.
+    """
+    ctx = multiprocessing.get_context("spawn")  # safe to start from a threaded web worker
+    total_frames = sum(spec['frames'] for spec in specs) or 1
+    with ctx.Manager() as manager:
+        progress_map = manager.dict()
+        pool = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx)
+        futures = []
+        try:
+            futures = [pool.submit(worker, spec, progress_map) for spec in specs]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=poll_s, return_when=FIRST_EXCEPTION)
+                for f in done:
+                    f.result()  # re-raise worker errors
+                if on_progress:
+                    written = sum(min(progress_map.get(s['index'], 0), s['frames']) for s in specs)
+                    on_progress(min(99, int(100 * written / total_frames)))
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            running = list((getattr(pool, '_processes', None) or {}).values())
+            pool.shutdown(wait=False, cancel_futures=True)
+            for p in running:
+                p.terminate()
+            raise
+        pool.shutdown()
+    return [spec['output'] for spec in specs]
+
+
+def concat_segments(segment_paths, output_path, faststart=False):
+    """Join identically-encoded segments with the concat demuxer (stream copy).
+    faststart writes the moov box first (for final deliverables)."""
+    list_path = output_path + ".txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in segment_paths:
+            f.write("file '{}'\n".format(os.path.abspath(p).replace("'", "'\\''")))
+    try:
+        subprocess.run(
+            [ffmpeg_binary(), "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+             "-c", "copy", *(["-movflags", "+faststart"] if faststart else []), output_path],
+            check=True, capture_output=True,
+        )
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+    return output_path
+
+
+def mux_audio(video_path, audio_path, output_path, faststart=False):
+    """Attach an already-encoded audio track to a video without re-encoding either.
+    faststart writes the moov box first (for final deliverables)."""
+    subprocess.run(
+        [ffmpeg_binary(), "-y", "-v", "error", "-i", video_path, "-i", audio_path,
+         "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", *(["-movflags", "+faststart"] if faststart else []),
+         output_path],
+        check=True, capture_output=True,
+    )
+    return output_path
@@ -0,0 +1,183 @@
+"""
+Multi-rendition jobs: several aspect ratios of one project from a single submission.
+
+Work every rendition shares runs once, in the parent job: ingestion (Drive download or
+uploads), narration decode and the audio pre-mix, transcription, and image decoding
+(a multi-aspect ScenePipeline decodes each source image once and crops it per ratio).
+Each rendition then renders its own crop, caption layout (word-by-word for 9:16,
+chunk_tokens chunks for 16:9) and encode in parallel through create_video, reporting on
+its own task, so /status, /download, /stream and /poster work per rendition unchanged.
+The parent task lists them under `renditions` and tracks their combined progress.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import ingest_pipeline
+import transcripts
+import video_processor
+
+RENDITION_ASPECTS = ('9:16', '16:9')
+PROGRESS_POLL_S = 1.0
+
+# Parent progress: shared inputs up to 12%, then the renditions' mean progress up to 99%
+SHARED_DONE_PROGRESS = 12
+
+
+def parse_aspects(raw):
+    """Known aspect ratios from a comma-separated list, in order, without duplicates."""
+    wanted = (a.strip() for a in str(raw or '').split(','))
+    return [a for a in dict.fromkeys(wanted) if a in RENDITION_ASPECTS]
+
+
+def rendition_filename(project_id, aspect_ratio):
+    return f"{project_id}_{aspect_ratio.replace(':', 'x')}.mp4"
+
+
+def shared_pipeline(config):
+    """The job's ScenePipeline (Drive jobs fill it while downloading), or one fed the uploaded inputs."""
+    pipeline = config.get('scene_pipeline')
+    if pipeline is not None:
+        return pipeline
+    aspects = [r['aspect_ratio'] for r in config['renditions']]
+    pipeline = ingest_pipeline.ScenePipeline(aspects[0], to_disk=True, extra_aspect_ratios=aspects[1:],
+                                             scene_dir=config['output_path'] + '.scenes',
+                                             keep_order=bool(config.get('keep_image_order')),
+                                             transcriber=transcripts.provider_for_job(config))
+    pipeline.add_audio(config['audio_path'])
+    for path in config['image_paths']:
+        pipeline.add_image(path)
+    return pipeline
+
+
+def mark_failed(tasks, config, message):
+    """Fail the renditions of a job that could not start them (e.g. its Drive download failed)."""
+    for r in config.get('renditions') or []:
+        if (tasks.get(r['task_id']) or {}).get('status') not in ('completed', 'error'):
+            video_processor.update_status(r['task_id'], tasks, 'error', message)
+
+
+def summarize(tasks, renditions):
+    """The parent task's `renditions` field: one entry per rendition with its current status."""
+    summary = []
+    for r in renditions:
+        child = tasks.get(r['task_id']) or {}
+        summary.append({
+            'aspect_ratio': r['aspect_ratio'], 'task_id': r['task_id'], 'video_url': r.get('video_url'),
+            'output_video_filename': os.path.basename(r['output_path']),
+            'status': child.get('status'), 'progress': child.get('progress', 0),
+        })
+    return summary
+
+
+def publish_progress(task_id, tasks, renditions):
+    """Mirror the renditions' status onto the parent task; returns the summary."""
+    summary = summarize(tasks, renditions)
+    mean = sum(int(s['progress'] or 0) for s in summary) / float(len(summary))
+    progress = min(99, SHARED_DONE_PROGRESS + int(mean * (99 - SHARED_DONE_PROGRESS) / 100.0))
+    tasks.update(task_id, renditions=summary, progress=progress)
+    return summary
+
+
+def create_renditions(task_id, tasks, config):
+    """
+    Render every entry of config['renditions'] (task_id, aspect_ratio and per-aspect
+    overrides such as font_size, position_vertical_percent and output paths/URLs) from
+    inputs prepared once. The parent completes when at least one rendition did.
+    """
+    renditions = config['renditions']
+    aspects = [r['aspect_ratio'] for r in renditions]
+    pipeline = None
+    shared_mix_path = None
+    try:
+        video_processor.update_status(task_id, tasks, 'processing',
+                                      f"Preparing shared inputs for {len(renditions)} renditions...", progress=10)
+        pipeline = shared_pipeline(config)
+        audio_path = config['audio_path']
+
+        # Narration + background music, mixed once for every rendition
+        shared_mix = None
+        bgm_path = config.get('background_music_path')
+        use_bgm = bool(config.get('background_music_enabled', True) and bgm_path and os.path.exists(bgm_path))
+        try:
+            bgm_level_percent = int(config.get('background_music_level_percent', 4))
+        except Exception:
+            bgm_level_percent = 4
+        if bgm_level_percent not in {4, 6, 8, 10, 12}:
+            bgm_level_percent = 4
+        try:
+            shared_mix_path = config['output_path'] + '.mix.m4a'
+            total_audio, audio_key = video_processor.premix_narration(
+                audio_path, shared_mix_path, bgm_path=bgm_path if use_bgm else None,
+                bgm_level_percent=bgm_level_percent, normalize=bool(config.get('normalize_narration', False)),
+                scene_pipeline=pipeline,
+            )
+            shared_mix = {'path': shared_mix_path, 'total_audio': total_audio, 'key': audio_key}
+        except Exception as mix_e:
+            video_processor.update_status(task_id, tasks, 'processing',
+                                          f"Shared audio pre-mix failed, each rendition mixes its own: {mix_e}", progress=10)
+
+        # Word timings, transcribed once (the per-aspect caption layout is built by each rendition);
+        # the pipeline sent the narration for transcription as soon as it had it
+        transcript = None
+        child_overrides = {}
+        transcriber = transcripts.provider_for_job(config)
+        if transcriber:
+            video_processor.update_status(task_id, tasks, 'processing',
+                                          "Transcribing narration once for all renditions...", progress=11)
+            try:
+                future = pipeline.transcript_future() if pipeline.audio_path() == audio_path else None
+                transcript, transcript_stats = (future or transcripts.transcribe_async(audio_path, transcriber)).result()
+                tasks.update(task_id, transcript_cache=transcript_stats.get('transcript_cache'))
+            except transcripts.TranscriptionError as e:
+                video_processor.update_status(task_id, tasks, 'processing', str(e), progress=11)
+                child_overrides['use_auto_captions'] = False
+
+        video_processor.update_status(task_id, tasks, 'processing',
+                                      f"Rendering {', '.join(aspects)} in parallel...", progress=SHARED_DONE_PROGRESS)
+        with ThreadPoolExecutor(max_workers=len(renditions)) as pool:
+            futures = []
+            for r in renditions:
+                child = dict(config, **{k: v for k, v in r.items() if k != 'task_id'})
+                child.pop('renditions', None)
+                child.update(child_overrides, scene_pipeline=pipeline, shared_mix=shared_mix,
+                             transcript=transcript, rendition_of=task_id, concurrent_renders=len(renditions))
+                futures.append(pool.submit(video_processor.create_video, r['task_id'], tasks, child))
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=PROGRESS_POLL_S)
+                publish_progress(task_id, tasks, renditions)
+            for f in futures:
+                f.result()  # create_video reports its own errors; surface anything it let through
+
+        summary = publish_progress(task_id, tasks, renditions)
+        failed = [s['aspect_ratio'] for s in summary if s['status'] != 'completed']
+        if len(failed) == len(renditions):
+            video_processor.update_status(task_id, tasks, 'error', "All renditions failed.")
+        elif failed:
+            video_processor.update_status(task_id, tasks, 'completed',
+                                          f"Renditions created; failed: {', '.join(failed)}.", progress=100)
+        else:
+            video_processor.update_status(task_id, tasks, 'completed',
+                                          f"All {len(renditions)} renditions created successfully.", progress=100)
+    except Exception as e:
+        message = f"An error occurred while preparing renditions: {e}"
+        mark_failed(tasks, config, message)
+        video_processor.update_status(task_id, tasks, 'error', message)
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        if shared_mix_path and os.path.exists(shared_mix_path):
+            os.remove(shared_mix_path)
+        # The renditions leave the inputs to the parent; remove them once all are done
+        try:
+            for f in config.get('temp_files') or []:
+                if f and os.path.exists(f):
+                    os.remove(f)
+            temp_dir = config.get('temp_dir')
+            if temp_dir and os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        except Exception:
+            # best-effort cleanup; do not fail the task for cleanup issues
+            pass
@@ -0,0 +1,94 @@
+"""
+Lazy scene pixels for the MoviePy timeline.
+
+Scenes are kept as files (scene cache entries or temp BMPs) rather than decoded arrays.
+A scene is decoded, and resampled once into its Ken Burns source, only when the timeline
+first asks for one of its frames; the next SCENE_PREFETCH scenes are decoded ahead on a
+background thread, and scenes behind the playhead (beyond the previous one, which a fade
+may still touch) are released. Only that window is resident, so a job's scene memory is
+constant instead of growing with the number of images.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Scenes decoded ahead of the one being rendered
+SCENE_PREFETCH = int(os.getenv("SCENE_PREFETCH", "2"))
+# Background decode threads shared by all jobs in the process
+SCENE_PREFETCH_WORKERS = int(os.getenv("SCENE_PREFETCH_WORKERS", "2"))
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=max(1, SCENE_PREFETCH_WORKERS))
+
+
+def oversample(image, frame_size, zoom_factor):
+    """Ken Burns source for a scene: frame_size scaled by 1 + zoom_factor (the scene itself when zoom is 0)."""
+    w, h = frame_size
+    if zoom_factor > 0:
+        return image.resize((round(w * (1 + zoom_factor)), round(h * (1 + zoom_factor))), Image.LANCZOS)
+    return image
+
+
+def load_source(source, frame_size, zoom_factor):
+    """Decode a scene (image path or RGB array) into its RGB Ken Burns source image."""
+    if isinstance(source, np.ndarray):
+        image = Image.fromarray(source)
+    else:
+        with Image.open(source) as im:
+            image = im.convert('RGB')
+    return oversample(image, frame_size, zoom_factor)
+
+
+class SceneFrames:
+    """
+    Windowed access to the Ken Burns sources of a scene list. get(i) returns scene i's
+    source, decoding it on demand, schedules scenes i+1..i+prefetch and drops everything
+    outside [i - keep_behind, i + prefetch]. Frames are requested in timeline order, so the
+    window slides forward with the playhead; a seek backwards just decodes again.
+    """
+
+    def __init__(self, sources, frame_size, zoom_factor=0.0, prefetch=SCENE_PREFETCH, keep_behind=1):
+        self.sources = list(sources)
+        self.frame_size = tuple(frame_size)
+        self.zoom_factor = max(0.0, float(zoom_factor))
+        self.prefetch = max(0, int(prefetch))
+        self.keep_behind = max(0, int(keep_behind))
+        self._lock = threading.Lock()
+        self._loaded = {}  # index -> future of load_source(...)
+        self._current = None
+
+    def __len__(self):
+        return len(self.sources)
+
+    def _load(self, index):
+        return load_source(self.sources[index], self.frame_size, self.zoom_factor)
+
+    def get(self, index):
+        with self._lock:
+            if index != self._current:
+                self._current = index
+                lo, hi = index - self.keep_behind, min(len(self.sources) - 1, index + self.prefetch)
+                for i in [i for i in self._loaded if i < lo or i > hi]:
+                    del self._loaded[i]
+                for i in range(index + 1, hi + 1):
+                    if i not in self._loaded:
+                        self._loaded[i] = _prefetch_pool.submit(self._load, i)
+            future = self._loaded.get(index)
+        if future is None:
+            # Decode the scene being rendered right here rather than queueing behind prefetches
+            image = self._load(index)
+            done = Future()
+            done.set_result(image)
+            with self._lock:
+                if self._current == index:
+                    self._loaded[index] = done
+            return image
+        return future.result()
+
+    def resident(self):
+        """Number of scenes currently held (decoded or being decoded)."""
+        with self._lock:
+            return len(self._loaded)
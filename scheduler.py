@@ -0,0 +1,236 @@
+"""
+Bounded job scheduler for video renders.
+
+Replaces one-thread-per-request: jobs wait in a priority queue (FIFO within a
+priority) and are admitted while both a concurrency slot and enough of the cost
+budget are free. Cost is an estimate of render work (images x resolution x audio
+length), which also drives the queue position / estimated start time reported on
+each task.
+
+Each app worker process has its own queue, but with a task store the slots are
+leases in that shared store (see task_store.py), so MAX_CONCURRENT_JOBS and
+JOB_COST_BUDGET hold across all workers: a process admits its next job only once
+the store grants it a lease, and polls while the other processes hold every slot.
+Refused jobs keep their place in a shared line, so slots go out in priority/FIFO
+order across processes too.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import task_store
+
+# Rough per-job resource needs used to derive the default concurrency limit
+CORES_PER_JOB = 4        # MoviePy/x264 export runs ~4 encoder threads
+MEMORY_PER_JOB_GB = 1.5
+# Narration length assumed for cost estimates before the audio is available (Drive jobs)
+DEFAULT_AUDIO_SECONDS = 60.0
+# Initial guess for throughput (cost units / second per running job) until jobs complete
+DEFAULT_COST_RATE = 2.0
+# How often a process waiting for a slot held by another process re-checks the shared leases
+LEASE_POLL_S = float(os.getenv("JOB_LEASE_POLL_S", "2"))
+
+
+def total_memory_gb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / float(1024 ** 3)
+    except (ValueError, OSError, AttributeError):
+        return 4.0
+
+
+def default_max_concurrent():
+    """Concurrency limit from MAX_CONCURRENT_JOBS, else from cores and memory."""
+    env = int(os.getenv("MAX_CONCURRENT_JOBS", "0") or 0)
+    if env > 0:
+        return env
+    cpu_slots = (os.cpu_count() or 1) // CORES_PER_JOB
+    mem_slots = int(total_memory_gb() // MEMORY_PER_JOB_GB)
+    return max(1, min(cpu_slots, mem_slots))
+
+
+def cores_per_job(max_concurrent=None):
+    """CPU cores one running job may use: the machine's cores split across the concurrency limit."""
+    return max(1, (os.cpu_count() or 1) // max(1, max_concurrent or default_max_concurrent()))
+
+
+def estimate_job_cost(num_images, frame_size, audio_seconds, fps=24):
+    """
+    Estimated render work in megapixel-frames: every output frame of the narration
+    plus decoding/cropping each scene image, at the output resolution.
+    """
+    megapixels = frame_size[0] * frame_size[1] / 1e6
+    return megapixels * (max(0.0, audio_seconds) * fps + max(0, num_images))
+
+
+class JobScheduler:
+    def __init__(self, max_concurrent=None, cost_budget=None, on_update=None, store=None):
+        """
+        max_concurrent: running-job limit (default_max_concurrent() when None).
+        cost_budget: max summed cost of running jobs (JOB_COST_BUDGET env, else unlimited).
+          A job is always admitted when nothing is running, so oversized jobs cannot starve.
+        on_update(task_id, info): called with queue info whenever a job's position changes.
+        store: task store whose job leases enforce both limits across processes
+          (None = this process only).
+        """
+        self.max_concurrent = max_concurrent or default_max_concurrent()
+        env_budget = float(os.getenv("JOB_COST_BUDGET", "0") or 0)
+        self.cost_budget = cost_budget or env_budget or None
+        self.on_update = on_update
+        self.store = store
+        self._queue = []          # heap of (priority, seq, job)
+        self._running = {}        # task_id -> job
+        self._remote = []         # leases held by other processes, as last seen
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._cost_rate = DEFAULT_COST_RATE
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+        if store is not None:
+            threading.Thread(target=self._renew_loop, daemon=True).start()
+
+    def submit(self, task_id, target, args=(), cost=0.0, priority=0):
+        """Queue target(*args) for task_id. Lower priority values start first."""
+        job = {'task_id': task_id, 'target': target, 'args': args, 'cost': float(cost),
+               'priority': int(priority), 'submitted': time.time()}
+        with self._cond:
+            heapq.heappush(self._queue, (job['priority'], next(self._seq), job))
+            self._cond.notify_all()
+        self._publish()
+        return self.describe(task_id)
+
+    def describe(self, task_id):
+        """Queue info for a task: state, queue_position (1-based) and estimated_start (epoch s)."""
+        with self._cond:
+            if task_id in self._running:
+                return {'queue_state': 'running', 'queue_position': 0,
+                        'estimated_start': self._running[task_id].get('started')}
+            snapshot = self._snapshot_locked()
+        return snapshot.get(task_id, {'queue_state': 'unknown'})
+
+    def stats(self):
+        with self._cond:
+            return {'running': len(self._running), 'running_elsewhere': len(self._remote),
+                    'queued': len(self._queue), 'max_concurrent': self.max_concurrent,
+                    'cost_budget': self.cost_budget, 'cost_rate': round(self._cost_rate, 3)}
+
+    # --- internals ---
+    def _fits_locked(self, job):
+        if len(self._running) >= self.max_concurrent:
+            return False
+        if not self._running or self.cost_budget is None:
+            return True
+        running_cost = sum(j['cost'] for j in self._running.values())
+        return running_cost + job['cost'] <= self.cost_budget
+
+    def _lease(self, job):
+        """Take a shared slot for job; falls back to the local rule if the store is unavailable."""
+        try:
+            admitted = self.store.acquire_lease(job['task_id'], job['cost'], self.max_concurrent, self.cost_budget,
+                                                priority=job['priority'], submitted=job['submitted'])
+            leases = self.store.leases()
+        except Exception as e:
+            print(f"Job lease unavailable, admitting locally: {e}")
+            with self._cond:
+                return self._fits_locked(job)
+        self._set_remote(leases, exclude=job['task_id'])
+        return admitted
+
+    def _set_remote(self, leases, exclude=None):
+        with self._cond:
+            self._remote = [lease for lease in leases
+                            if lease['task_id'] not in self._running and lease['task_id'] != exclude]
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not (self._queue and len(self._running) < self.max_concurrent):
+                    self._cond.wait()
+                entry = self._queue[0]
+                admitted = self._fits_locked(entry[2]) if self.store is None else None
+            if admitted is None:
+                admitted = self._lease(entry[2])
+            with self._cond:
+                if not admitted:
+                    # Slots freed by another process do not notify this one: poll the store
+                    self._cond.wait(timeout=None if self.store is None else LEASE_POLL_S)
+                    continue
+                self._queue.remove(entry)  # a higher-priority job may have been queued meanwhile
+                heapq.heapify(self._queue)
+                job = entry[2]
+                job['started'] = time.time()
+                self._running[job['task_id']] = job
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            self._publish()
+
+    def _renew_loop(self):
+        """Keep the leases of this process's running jobs alive (a crashed process's leases expire)."""
+        while True:
+            time.sleep(max(1.0, task_store.JOB_LEASE_TTL_S / 3.0))
+            with self._cond:
+                running = list(self._running)
+            try:
+                if running:
+                    self.store.renew_leases(running)
+                self._set_remote(self.store.leases())
+            except Exception as e:
+                print(f"Job lease renewal failed: {e}")
+
+    def _run(self, job):
+        try:
+            job['target'](*job['args'])
+        finally:
+            elapsed = max(1e-3, time.time() - job['started'])
+            if self.store is not None:
+                try:
+                    self.store.release_lease(job['task_id'])
+                except Exception as e:
+                    print(f"Job lease release failed: {e}")
+            with self._cond:
+                self._running.pop(job['task_id'], None)
+                if job['cost'] > 0:
+                    # Exponential moving average of observed throughput
+                    self._cost_rate = 0.7 * self._cost_rate + 0.3 * (job['cost'] / elapsed)
+                self._cond.notify_all()
+            if self.on_update:
+                try:
+                    self.on_update(job['task_id'], {'queue_state': 'finished', 'queue_position': 0})
+                except Exception:
+                    pass
+            self._publish()
+
+    def _snapshot_locked(self):
+        """Queue positions and estimated start times, simulating slots freeing up in order."""
+        now = time.time()
+        rate = max(1e-6, self._cost_rate)
+        # Each slot frees when its running job's remaining estimated work is done
+        slots = []
+        for job in list(self._running.values()) + self._remote:
+            remaining = job['cost'] / rate - (now - job['started'])
+            slots.append(now + max(0.0, remaining))
+        slots += [now] * max(0, self.max_concurrent - len(slots))
+        heapq.heapify(slots)
+        info = {}
+        for position, (_, _, job) in enumerate(sorted(self._queue), start=1):
+            start = heapq.heappop(slots)
+            info[job['task_id']] = {'queue_state': 'queued', 'queue_position': position,
+                                    'estimated_start': round(start, 1)}
+            heapq.heappush(slots, start + job['cost'] / rate)
+        return info
+
+    def _publish(self):
+        if not self.on_update:
+            return
+        with self._cond:
+            snapshot = self._snapshot_locked()
+            running = {tid: {'queue_state': 'running', 'queue_position': 0,
+                             'estimated_start': round(job['started'], 1)}
+                       for tid, job in self._running.items()}
+        snapshot.update(running)
+        for task_id, info in snapshot.items():
+            try:
+                self.on_update(task_id, info)
+            except Exception:
+                pass
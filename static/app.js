@@ -71,75 +71,147 @@ document.getElementById('video-form').addEventListener('submit', async function(
                 const taskId = data.task_id;
                 // no logs UI
 
-                // Start polling for status
-                statusInterval = setInterval(async () => {
-                    const statusResponse = await fetch(`/status/${taskId}`);
-                    const statusData = await statusResponse.json();
-
-                    if (statusResponse.ok) {
-                        // Update overall weighted progress
-                        let pct = 0;
-                        if (typeof statusData.progress === 'number') {
-                            pct = Math.max(0, Math.min(100, statusData.progress));
+                // Task state: a full snapshot first, then deltas (changed fields + new log lines)
+                const state = { logs: [], log_cursor: 0 };
+                let stream = null;
+                let finished = false;
+                let etag = null;
+                const stopUpdates = () => {
+                    finished = true;
+                    if (stream) { stream.close(); stream = null; }
+                    clearInterval(statusInterval);
+                    if (timerInterval) { clearInterval(timerInterval); timerInterval = null; }
+                };
+                const applyDelta = (delta) => {
+                    const { logs, ...fields } = delta;
+                    Object.assign(state, fields);
+                    if (Array.isArray(logs)) state.logs = state.logs.concat(logs);
+                };
+                const render = async (statusData) => {
+                    // Update overall weighted progress
+                    let pct = 0;
+                    if (typeof statusData.progress === 'number') {
+                        pct = Math.max(0, Math.min(100, statusData.progress));
+                    }
+                    if (progressBar) progressBar.style.width = `${pct}%`;
+                    if (progressText) {
+                        progressText.textContent = (statusData.status === 'queued' && statusData.queue_position)
+                            ? `Queued (#${statusData.queue_position})`
+                            : `${pct}%`;
+                    }
+
+                    // Check overall status
+                    if (statusData.status === 'completed') {
+                        stopUpdates();
+                        resultDiv.innerHTML = `<p>Video generation complete!</p>`;
+                        if (statusData.hls_url) {
+                            // Native HLS plays segment by segment; elsewhere the fast-start MP4 streams via Range requests
+                            const player = document.createElement('video');
+                            player.controls = true;
+                            player.playsInline = true;
+                            player.preload = 'metadata';
+                            player.style.maxWidth = '100%';
+                            player.style.maxHeight = '480px';
+                            if (statusData.poster_url) player.poster = statusData.poster_url;
+                            player.src = player.canPlayType('application/vnd.apple.mpegurl')
+                                ? statusData.hls_url
+                                : statusData.video_url;
+                            resultDiv.appendChild(player);
                         }
-                        if (progressBar) progressBar.style.width = `${pct}%`;
-                        if (progressText) progressText.textContent = `${pct}%`;
-
-                        // Check overall status
-                        if (statusData.status === 'completed') {
-                            clearInterval(statusInterval);
-                            if (timerInterval) { clearInterval(timerInterval); timerInterval = null; }
-                            resultDiv.innerHTML = `<p>Video generation complete!</p>`;
-                            if (statusData.video_url) {
-                                const bust = `t=${Date.now()}`;
-                                const sep = statusData.video_url.includes('?') ? '&' : '?';
-                                const url = `${statusData.video_url}${sep}${bust}`;
-                                // Verify availability before showing the link
-                                const ready = await checkUrlAvailable(url);
-                                const link = document.createElement('a');
-                                link.textContent = 'Download Video';
-                                link.className = 'btn-download';
-                                link.href = url;
-                                // Suggest filename when available
-                                if (statusData.output_video_filename) {
-                                    link.setAttribute('download', statusData.output_video_filename);
-                                } else {
-                                    link.setAttribute('download', '');
-                                }
-                                // If not ready yet, disable click and retry once clicked
-                                if (!ready) {
-                                    const prep = document.createElement('p');
-                                    prep.textContent = 'Preparing download…';
-                                    resultDiv.appendChild(prep);
-                                    link.addEventListener('click', async (e) => {
-                                        e.preventDefault();
-                                        const ok = await checkUrlAvailable(url, 5, 300);
-                                        if (ok) {
-                                            prep.remove();
-                                            window.location.href = url;
-                                        }
-                                    }, { once: true });
-                                }
-                                resultDiv.appendChild(link);
+                        if (statusData.video_url) {
+                            const bust = `t=${Date.now()}`;
+                            const sep = statusData.video_url.includes('?') ? '&' : '?';
+                            const url = `${statusData.video_url}${sep}${bust}`;
+                            // Verify availability before showing the link
+                            const ready = await checkUrlAvailable(url);
+                            const link = document.createElement('a');
+                            link.textContent = 'Download Video';
+                            link.className = 'btn-download';
+                            link.href = url;
+                            // Suggest filename when available
+                            if (statusData.output_video_filename) {
+                                link.setAttribute('download', statusData.output_video_filename);
+                            } else {
+                                link.setAttribute('download', '');
                             }
-                            generateBtn.disabled = false;
-                            // Optionally hide loading area now that we're done
-                            // loadingDiv.style.display = 'none';
-                        } else if (statusData.status === 'error') {
-                            clearInterval(statusInterval);
-                            if (timerInterval) { clearInterval(timerInterval); timerInterval = null; }
-                            resultDiv.innerHTML = `<p>Error during video generation: ${statusData.logs[statusData.logs.length - 1]}</p>`;
-                            generateBtn.disabled = false;
-                            loadingDiv.style.display = 'none';
+                            // If not ready yet, disable click and retry once clicked
+                            if (!ready) {
+                                const prep = document.createElement('p');
+                                prep.textContent = 'Preparing download…';
+                                resultDiv.appendChild(prep);
+                                link.addEventListener('click', async (e) => {
+                                    e.preventDefault();
+                                    const ok = await checkUrlAvailable(url, 5, 300);
+                                    if (ok) {
+                                        prep.remove();
+                                        window.location.href = url;
+                                    }
+                                }, { once: true });
+                            }
+                            resultDiv.appendChild(link);
                         }
-                    } else {
-                        clearInterval(statusInterval);
-                        if (timerInterval) { clearInterval(timerInterval); timerInterval = null; }
-                        resultDiv.innerHTML = `<p>Error fetching status: ${statusData.message || 'Unknown error'}</p>`;
+                        // Multi-rendition job: one download per aspect ratio
+                        (statusData.renditions || []).forEach((r) => {
+                            if (r.status !== 'completed' || !r.video_url) return;
+                            const link = document.createElement('a');
+                            link.textContent = `Download ${r.aspect_ratio}`;
+                            link.className = 'btn-download';
+                            link.href = r.video_url;
+                            link.setAttribute('download', r.output_video_filename || '');
+                            resultDiv.appendChild(link);
+                        });
+                        generateBtn.disabled = false;
+                        // Optionally hide loading area now that we're done
+                        // loadingDiv.style.display = 'none';
+                    } else if (statusData.status === 'error') {
+                        stopUpdates();
+                        resultDiv.innerHTML = `<p>Error during video generation: ${statusData.logs[statusData.logs.length - 1]}</p>`;
                         generateBtn.disabled = false;
                         loadingDiv.style.display = 'none';
                     }
-                }, 2000); // Poll every 2 seconds to reduce backend load
+                };
+
+                // Fallback: poll with a log cursor; unchanged tasks answer 304 with no body
+                const startPolling = () => {
+                    statusInterval = setInterval(async () => {
+                        const headers = etag ? { 'If-None-Match': etag } : {};
+                        const statusResponse = await fetch(`/status/${taskId}?since=${state.log_cursor}`, { cache: 'no-store', headers });
+                        if (statusResponse.status === 304) return;
+                        const statusData = await statusResponse.json();
+
+                        if (statusResponse.ok) {
+                            etag = statusResponse.headers.get('ETag');
+                            applyDelta(statusData);
+                            await render(state);
+                        } else {
+                            stopUpdates();
+                            resultDiv.innerHTML = `<p>Error fetching status: ${statusData.message || 'Unknown error'}</p>`;
+                            generateBtn.disabled = false;
+                            loadingDiv.style.display = 'none';
+                        }
+                    }, 2000); // Poll every 2 seconds to reduce backend load
+                };
+
+                // Preferred: Server-Sent Events push only what changed
+                if (window.EventSource) {
+                    stream = new EventSource(`/status/${taskId}/stream`);
+                    stream.onmessage = async (e) => {
+                        applyDelta(JSON.parse(e.data));
+                        await render(state);
+                    };
+                    stream.addEventListener('end', () => {
+                        if (stream) { stream.close(); stream = null; }
+                    });
+                    stream.onerror = () => {
+                        // EventSource retries by itself; fall back to polling only once it gives up
+                        if (stream && stream.readyState === EventSource.CLOSED && !finished) {
+                            stream = null;
+                            startPolling();
+                        }
+                    };
+                } else {
+                    startPolling();
+                }
 
             } else {
                 resultDiv.innerHTML = `<p>Error: ${data.message}</p>`;
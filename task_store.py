@@ -0,0 +1,428 @@
+"""
+Task state backends.
+
+Every piece of code that reports job state goes through the same small interface
+(create / get / update / append_log / add_steps / set_step_state) instead of mutating
+a dict in place, so the state can live outside the web worker. Each task carries a
+version that increases on every committed change, and logs are an append-only list
+that can be read from a cursor, so status readers can fetch only what changed:
+
+- MemoryTaskStore: the original process-local dict (development, single worker).
+- SqliteTaskStore: a SQLite database in WAL mode shared by every gunicorn worker and
+  render process. Writes are buffered per process and committed in one transaction
+  every TASK_STORE_FLUSH_MS, so per-frame progress ticks cost a dict update, not a
+  disk write.
+
+The store also holds the render slots (job leases) the schedulers of all processes
+admit jobs against, so the concurrency limit and cost budget hold for the whole
+deployment rather than per worker. A lease expires unless its holder renews it, so
+slots held by a crashed worker come back on their own.
+"""
+
+import atexit
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+TASK_STORE = os.getenv("TASK_STORE", "sqlite").strip().lower()
+TASK_DB_PATH = os.getenv("TASK_DB_PATH", os.path.join("cache", "tasks.sqlite3"))
+TASK_STORE_FLUSH_MS = int(os.getenv("TASK_STORE_FLUSH_MS", "250"))
+# Seconds a job lease lasts without renewal (the scheduler renews running jobs' leases)
+JOB_LEASE_TTL_S = float(os.getenv("JOB_LEASE_TTL_S", "60"))
+# Seconds a refused job keeps its place in the cross-process line without asking again
+JOB_WAIT_TTL_S = 10.0
+
+
+def _new_pending():
+    return {'fields': {}, 'logs': [], 'steps': [], 'step_states': []}
+
+
+def _apply(record, pending):
+    """Apply buffered changes to a task record (without its logs)."""
+    record.update(pending['fields'])
+    if pending['steps']:
+        record['steps'] = record.get('steps', []) + pending['steps']
+    for key, state in pending['step_states']:
+        for s in record.get('steps', []):
+            if s['key'] == key:
+                s['state'] = state
+                break
+    return record
+
+
+def _waits_behind(waiting, task_id, priority, submitted):
+    """True if another waiting job is ahead of this one (lower priority value, then earlier submission)."""
+    return any(w['task_id'] != task_id and (w['priority'], w['submitted']) < (priority, submitted)
+               for w in waiting)
+
+
+def _lease_fits(leases, cost, max_concurrent, cost_budget):
+    """Admission rule: a free slot and, with a budget, room for cost (always room when nothing runs)."""
+    if len(leases) >= max_concurrent:
+        return False
+    if not leases or cost_budget is None:
+        return True
+    return sum(lease['cost'] for lease in leases) + cost <= cost_budget
+
+
+class MemoryTaskStore:
+    """Process-local task state (the original behaviour)."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._versions = {}
+        self._leases = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id, record):
+        with self._lock:
+            self._tasks[task_id] = copy.deepcopy(record)
+            self._tasks[task_id].setdefault('logs', [])
+            self._versions[task_id] = 0
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def get(self, task_id, since=0):
+        """
+        Snapshot of the task record, or None. logs holds the lines from index `since` on;
+        log_cursor is the total line count and version the change counter.
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            logs = task['logs'][max(0, since):]
+            snapshot = copy.deepcopy({k: v for k, v in task.items() if k != 'logs'})
+            snapshot.update(logs=list(logs), log_cursor=len(task['logs']), version=self._versions[task_id])
+            return snapshot
+
+    def version(self, task_id):
+        """Change counter of a task, or None if it does not exist."""
+        with self._lock:
+            return self._versions.get(task_id)
+
+    def _change(self, task_id, pending):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return
+            _apply(task, pending)
+            task['logs'].extend(pending['logs'])
+            self._versions[task_id] += 1
+
+    def update(self, task_id, **fields):
+        pending = _new_pending()
+        pending['fields'] = fields
+        self._change(task_id, pending)
+
+    def append_log(self, task_id, message, **fields):
+        pending = _new_pending()
+        pending['fields'] = fields
+        pending['logs'] = [message]
+        self._change(task_id, pending)
+
+    def add_steps(self, task_id, steps):
+        pending = _new_pending()
+        pending['steps'] = copy.deepcopy(list(steps))
+        self._change(task_id, pending)
+
+    def set_step_state(self, task_id, key, state):
+        pending = _new_pending()
+        pending['step_states'] = [(key, state)]
+        self._change(task_id, pending)
+
+    def flush(self):
+        pass
+
+    # --- job leases (process-local here) ---
+    def _live_leases(self, now):
+        self._leases = {k: v for k, v in self._leases.items() if v['expires'] > now}
+        return self._leases
+
+    def acquire_lease(self, task_id, cost, max_concurrent, cost_budget=None, ttl=JOB_LEASE_TTL_S,
+                      priority=0, submitted=None):
+        """
+        Take a render slot for task_id if the admission rule allows it and no job queued
+        earlier (by priority, then submitted) is waiting; returns True when held. A refused
+        job is recorded as waiting, keeping its place while it keeps asking.
+        """
+        now = time.time()
+        submitted = now if submitted is None else submitted
+        with self._lock:
+            leases = self._live_leases(now)
+            self._waiting = {k: v for k, v in self._waiting.items() if v['expires'] > now}
+            if task_id not in leases and (
+                    _waits_behind(self._waiting.values(), task_id, priority, submitted)
+                    or not _lease_fits(list(leases.values()), cost, max_concurrent, cost_budget)):
+                self._waiting[task_id] = {'task_id': task_id, 'priority': priority, 'submitted': submitted,
+                                          'expires': now + JOB_WAIT_TTL_S}
+                return False
+            self._waiting.pop(task_id, None)
+            leases[task_id] = {'task_id': task_id, 'cost': float(cost), 'started': now, 'expires': now + ttl}
+            return True
+
+    def renew_leases(self, task_ids, ttl=JOB_LEASE_TTL_S):
+        with self._lock:
+            for task_id in task_ids:
+                if task_id in self._leases:
+                    self._leases[task_id]['expires'] = time.time() + ttl
+
+    def release_lease(self, task_id):
+        with self._lock:
+            self._leases.pop(task_id, None)
+
+    def leases(self):
+        """Live leases: dicts with task_id, cost and started (epoch s)."""
+        with self._lock:
+            return [dict(v) for v in self._live_leases(time.time()).values()]
+
+
+class SqliteTaskStore:
+    """Task state in a shared SQLite database (WAL) with per-process batched writes."""
+
+    def __init__(self, path=TASK_DB_PATH, flush_ms=TASK_STORE_FLUSH_MS):
+        self.path = path
+        self.flush_interval = max(0, flush_ms) / 1000.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._pending = {}
+        self._lock = threading.Lock()        # guards _pending
+        self._flush_lock = threading.Lock()  # serializes flushes from this process
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY, data TEXT NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_logs ("
+            " task_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL,"
+            " PRIMARY KEY (task_id, seq))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_leases ("
+            " task_id TEXT PRIMARY KEY, cost REAL NOT NULL, started REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_waiting ("
+            " task_id TEXT PRIMARY KEY, priority INTEGER NOT NULL, submitted REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        if self.flush_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def create(self, task_id, record):
+        record = dict(record)
+        logs = record.pop('logs', [])
+        conn = self._conn()
+        with self._flush_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tasks (task_id, data, version, updated) VALUES (?, ?, 0, ?)",
+                    (task_id, json.dumps(record), time.time()),
+                )
+                conn.execute("DELETE FROM task_logs WHERE task_id = ?", (task_id,))
+                conn.executemany(
+                    "INSERT INTO task_logs (task_id, seq, message) VALUES (?, ?, ?)",
+                    [(task_id, i, m) for i, m in enumerate(logs)],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def __contains__(self, task_id):
+        with self._lock:
+            if task_id in self._pending:
+                return True
+        row = self._conn().execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row is not None
+
+    def get(self, task_id, since=0):
+        """
+        Snapshot of the task record, or None (including this process's unflushed writes).
+        logs holds the lines from index `since` on; log_cursor is the total line count and
+        version the change counter.
+        """
+        self.flush()
+        conn = self._conn()
+        conn.execute("BEGIN")  # one read snapshot for the record and its logs
+        try:
+            row = conn.execute("SELECT data, version FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = json.loads(row[0])
+            task['logs'] = [m for (m,) in conn.execute(
+                "SELECT message FROM task_logs WHERE task_id = ? AND seq >= ? ORDER BY seq",
+                (task_id, max(0, since)))]
+            (count,) = conn.execute("SELECT COUNT(*) FROM task_logs WHERE task_id = ?", (task_id,)).fetchone()
+        finally:
+            conn.execute("COMMIT")
+        task['log_cursor'] = count
+        task['version'] = row[1]
+        return task
+
+    def version(self, task_id):
+        """Change counter of a task, or None if it does not exist."""
+        self.flush()
+        row = self._conn().execute("SELECT version FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def _buffer(self, task_id):
+        pending = self._pending.get(task_id)
+        if pending is None:
+            pending = self._pending[task_id] = _new_pending()
+        return pending
+
+    def _queued(self):
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            self._buffer(task_id)['fields'].update(fields)
+        self._queued()
+
+    def append_log(self, task_id, message, **fields):
+        with self._lock:
+            pending = self._buffer(task_id)
+            pending['fields'].update(fields)
+            pending['logs'].append(message)
+        self._queued()
+
+    def add_steps(self, task_id, steps):
+        with self._lock:
+            self._buffer(task_id)['steps'].extend(copy.deepcopy(list(steps)))
+        self._queued()
+
+    def set_step_state(self, task_id, key, state):
+        with self._lock:
+            self._buffer(task_id)['step_states'].append((key, state))
+        self._queued()
+
+    def flush(self):
+        """Commit all buffered changes from this process in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                for task_id, pending in batch.items():
+                    row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+                    if row is None:
+                        continue
+                    task = _apply(json.loads(row[0]), pending)
+                    conn.execute(
+                        "UPDATE tasks SET data = ?, version = version + 1, updated = ? WHERE task_id = ?",
+                        (json.dumps(task), now, task_id),
+                    )
+                    if pending['logs']:
+                        (last,) = conn.execute(
+                            "SELECT COALESCE(MAX(seq), -1) FROM task_logs WHERE task_id = ?", (task_id,)
+                        ).fetchone()
+                        conn.executemany(
+                            "INSERT INTO task_logs (task_id, seq, message) VALUES (?, ?, ?)",
+                            [(task_id, last + 1 + i, m) for i, m in enumerate(pending['logs'])],
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    for task_id, pending in batch.items():
+                        newer = self._pending.get(task_id)
+                        if newer is not None:
+                            pending['fields'].update(newer['fields'])
+                            pending['logs'].extend(newer['logs'])
+                            pending['steps'].extend(newer['steps'])
+                            pending['step_states'].extend(newer['step_states'])
+                        self._pending[task_id] = pending
+                raise
+
+    # --- job leases (shared by every process using the database) ---
+    def acquire_lease(self, task_id, cost, max_concurrent, cost_budget=None, ttl=JOB_LEASE_TTL_S,
+                      priority=0, submitted=None):
+        """
+        Take a render slot for task_id if the admission rule allows it and no job queued
+        earlier (by priority, then submitted) in any process is waiting; returns True when
+        held. A refused job is recorded as waiting, keeping its place while it keeps asking.
+        """
+        conn = self._conn()
+        now = time.time()
+        submitted = now if submitted is None else submitted
+        conn.execute("BEGIN IMMEDIATE")  # serializes admission across processes
+        try:
+            conn.execute("DELETE FROM job_leases WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM job_waiting WHERE expires <= ?", (now,))
+            leases = [{'task_id': t, 'cost': c} for (t, c) in conn.execute("SELECT task_id, cost FROM job_leases")]
+            waiting = [{'task_id': t, 'priority': p, 'submitted': sub}
+                       for (t, p, sub) in conn.execute("SELECT task_id, priority, submitted FROM job_waiting")]
+            held = any(lease['task_id'] == task_id for lease in leases)
+            admitted = held or (not _waits_behind(waiting, task_id, priority, submitted)
+                                and _lease_fits(leases, cost, max_concurrent, cost_budget))
+            if admitted:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_leases (task_id, cost, started, expires) VALUES (?, ?, ?, ?)",
+                    (task_id, float(cost), now, now + ttl),
+                )
+                conn.execute("DELETE FROM job_waiting WHERE task_id = ?", (task_id,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_waiting (task_id, priority, submitted, expires) VALUES (?, ?, ?, ?)",
+                    (task_id, int(priority), submitted, now + JOB_WAIT_TTL_S),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return admitted
+
+    def renew_leases(self, task_ids, ttl=JOB_LEASE_TTL_S):
+        expires = time.time() + ttl
+        self._conn().executemany("UPDATE job_leases SET expires = ? WHERE task_id = ?",
+                                 [(expires, task_id) for task_id in task_ids])
+
+    def release_lease(self, task_id):
+        self._conn().execute("DELETE FROM job_leases WHERE task_id = ?", (task_id,))
+
+    def leases(self):
+        """Live leases: dicts with task_id, cost and started (epoch s)."""
+        rows = self._conn().execute("SELECT task_id, cost, started FROM job_leases WHERE expires > ?", (time.time(),))
+        return [{'task_id': t, 'cost': c, 'started': st} for (t, c, st) in rows]
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Task store flush failed: {e}")
+
+
+def store_from_env():
+    """Task store selected by TASK_STORE ('sqlite' default, or 'memory')."""
+    if TASK_STORE == 'memory':
+        return MemoryTaskStore()
+    return SqliteTaskStore()
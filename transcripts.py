@@ -0,0 +1,189 @@
+"""
+Word-level transcription with a persistent cache.
+
+Transcripts are cached on disk keyed by the narration's content hash (plus the
+provider and its settings), so re-rendering the same voiceover in another aspect
+ratio, font or style never uploads or transcribes it again. Entries are stored
+columnar in a compressed .npz: int32 start/end arrays (ms) and a token array, which
+loads without pickle and is a fraction of the size of the provider's JSON.
+
+Providers are plain objects with a `cache_tag` and transcribe(audio_path) returning
+a Transcript; TRANSCRIBE_PROVIDER picks one:
+- assemblyai: AssemblyAI's API (needs ASSEMBLYAI_API_KEY).
+- stub: offline stand-in that spreads TRANSCRIBE_STUB_TEXT evenly over the audio,
+  for tests and local development.
+"""
+
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import disk_cache
+import utils
+
+TRANSCRIBE_PROVIDER = os.getenv("TRANSCRIBE_PROVIDER", "assemblyai").strip().lower()
+TRANSCRIBE_STUB_TEXT = os.getenv(
+    "TRANSCRIBE_STUB_TEXT",
+    "This is a placeholder transcript. It stands in for the real narration during local testing.",
+)
+
+# TRANSCRIPT_CACHE_DIR='' disables the cache
+transcript_cache = disk_cache.cache_from_env(
+    "TRANSCRIPT_CACHE_DIR", os.path.join("cache", "transcripts"), "TRANSCRIPT_CACHE_MAX_MB", 256
+)
+
+# Background transcriptions, started as soon as a job's narration is known (see transcribe_async)
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "4"))
+_background = ThreadPoolExecutor(max_workers=max(1, TRANSCRIBE_WORKERS))
+
+# Same shape as AssemblyAI's word objects: times in ms
+Word = namedtuple("Word", "text start end")
+
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+class TranscriptionError(Exception):
+    """The provider failed to produce a transcript."""
+
+
+class Transcript:
+    """Word timings held as columns: tokens plus start/end arrays in ms."""
+
+    def __init__(self, tokens, starts, ends):
+        self.tokens = [str(t) for t in tokens]
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+
+    @classmethod
+    def from_words(cls, words):
+        """Build from provider word objects with .text/.start/.end (ms)."""
+        words = list(words or [])
+        return cls(
+            [(w.text or "") for w in words],
+            [int(w.start or 0) for w in words],
+            [int(w.end if w.end is not None else (w.start or 0)) for w in words],
+        )
+
+    @property
+    def words(self):
+        return [Word(t, int(s), int(e)) for t, s, e in zip(self.tokens, self.starts, self.ends)]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def save(self, path):
+        # Write through a file object: np.savez would append '.npz' to a bare path
+        with open(path, "wb") as f:
+            np.savez_compressed(f, tokens=np.array(self.tokens, dtype=np.str_), starts=self.starts, ends=self.ends)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["tokens"].tolist(), data["starts"], data["ends"])
+
+
+class AssemblyAIProvider:
+    """AssemblyAI's hosted transcription (uploads the audio, blocks until done)."""
+
+    cache_tag = "assemblyai:v1"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def transcribe(self, audio_path):
+        import assemblyai as aai
+
+        aai.settings.api_key = self.api_key
+        transcript = aai.Transcriber().transcribe(audio_path)
+        if transcript.status == aai.TranscriptStatus.error:
+            raise TranscriptionError(f"AssemblyAI Error: {transcript.error}")
+        return Transcript.from_words(transcript.words)
+
+
+class StubProvider:
+    """Offline stand-in: `text` spread evenly over the audio's duration (no network)."""
+
+    def __init__(self, text=TRANSCRIBE_STUB_TEXT):
+        self.text = text
+        self.cache_tag = "stub:" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def transcribe(self, audio_path):
+        tokens = self.text.split()
+        duration_ms = int((utils.media_duration(audio_path) or len(tokens) * 0.4) * 1000)
+        if not tokens:
+            return Transcript([], [], [])
+        edges = np.linspace(0, duration_ms, len(tokens) + 1).astype(np.int32)
+        return Transcript(tokens, edges[:-1], edges[1:])
+
+
+def provider_from_env(api_key=None):
+    """The TRANSCRIBE_PROVIDER provider, or None if it cannot run (e.g. no API key)."""
+    if TRANSCRIBE_PROVIDER == "stub":
+        return StubProvider()
+    if TRANSCRIBE_PROVIDER == "assemblyai":
+        return AssemblyAIProvider(api_key) if api_key else None
+    raise ValueError(f"Unknown TRANSCRIBE_PROVIDER: {TRANSCRIBE_PROVIDER}")
+
+
+def provider_for_job(config):
+    """The provider a job's auto-captions use, or None (captions off, an SRT given, or no provider)."""
+    if not config.get("use_auto_captions", True) or config.get("srt_path"):
+        return None
+    return provider_from_env(config.get("assemblyai_api_key"))
+
+
+def cache_key(audio_path, provider):
+    """Cache key: sha256 of the audio bytes + the provider's cache_tag."""
+    digest = disk_cache.file_digest(audio_path)
+    return hashlib.sha256(f"{digest}|{provider.cache_tag}".encode("utf-8")).hexdigest()
+
+
+def _lock_for(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def transcribe(audio_path, provider, stats=None):
+    """
+    Transcript for audio_path, from the cache when possible. stats, if given, gets
+    'transcript_cache' = 'hit' / 'miss' (None when the cache is disabled).
+    Concurrent requests for the same audio in this process transcribe it once.
+    Raises TranscriptionError if the provider fails.
+    """
+    if transcript_cache is None:
+        if stats is not None:
+            stats["transcript_cache"] = None
+        return provider.transcribe(audio_path)
+    key = cache_key(audio_path, provider)
+    with _lock_for(key):
+        cached = transcript_cache.lookup(key, ".npz")
+        if cached:
+            try:
+                transcript = Transcript.load(cached)
+                if stats is not None:
+                    stats["transcript_cache"] = "hit"
+                return transcript
+            except (OSError, ValueError, KeyError):
+                pass  # unreadable entry: transcribe again and overwrite it
+        transcript = provider.transcribe(audio_path)
+        transcript_cache.store(key, transcript.save, ".npz")
+        if stats is not None:
+            stats["transcript_cache"] = "miss"
+        return transcript
+
+
+def transcribe_async(audio_path, provider):
+    """
+    Start transcribe() in the background, so the provider round trip overlaps ingestion
+    and scene preparation. Returns a future of (transcript, stats); its result() raises
+    TranscriptionError like transcribe().
+    """
+    def run():
+        stats = {}
+        return transcribe(audio_path, provider, stats=stats), stats
+    return _background.submit(run)
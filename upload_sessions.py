@@ -0,0 +1,236 @@
+"""
+Resumable chunked uploads.
+
+A client creates an upload session, PUTs the file in sequential chunks (each chunk
+is streamed straight to disk and into a running sha256, never buffered whole), and
+finalizes it. Finalized files become content-addressed assets (id = sha256 prefix)
+that /generate can reference, so identical files are stored once and each file can
+be uploaded independently of the render request. A dropped connection only loses the
+chunk in flight: the session's current offset is queryable and the upload resumes
+from there.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import disk_cache
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: rely on the per-process lock only
+    fcntl = None
+
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join("uploads", "sessions"))
+UPLOAD_SESSION_TTL_H = float(os.getenv("UPLOAD_SESSION_TTL_H", "24"))
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "2048"))
+READ_CHUNK_BYTES = 1024 * 1024
+
+AUDIO_EXTS = ('.mp3', '.wav', '.m4a', '.aac', '.ogg')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+SRT_EXTS = ('.srt',)
+
+# Finalized assets, keyed by content hash and bounded like the other on-disk caches
+asset_store = disk_cache.DiskCache(
+    os.getenv("ASSET_DIR", os.path.join("uploads", "assets")),
+    float(os.getenv("ASSET_MAX_MB", "10240")) * 1024 * 1024,
+)
+
+_ID_RE = re.compile(r'^[0-9a-f]{32,64}$')
+_lock = threading.Lock()
+_hashers = {}  # session_id -> (bytes_hashed, sha256 object), per process
+
+
+class UploadError(Exception):
+    """Client-facing upload failure; status is the HTTP status, extra goes into the JSON body."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+def asset_kind(filename):
+    """'audio', 'image', 'srt' or None from a file name's extension."""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in AUDIO_EXTS:
+        return 'audio'
+    if ext in IMAGE_EXTS:
+        return 'image'
+    if ext in SRT_EXTS:
+        return 'srt'
+    return None
+
+
+def _session_dir(session_id):
+    if not _ID_RE.match(session_id or ''):
+        raise UploadError('Upload not found', 404)
+    return os.path.join(UPLOAD_SESSION_DIR, session_id)
+
+
+def _part_path(session_id):
+    return os.path.join(_session_dir(session_id), 'data.part')
+
+
+def session_meta(session_id):
+    """Session metadata (filename, kind, size, aspect_ratio, created) plus the current offset."""
+    try:
+        with open(os.path.join(_session_dir(session_id), 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise UploadError('Upload not found', 404)
+    try:
+        meta['offset'] = os.path.getsize(_part_path(session_id))
+    except OSError:
+        meta['offset'] = 0
+    return meta
+
+
+def create_session(filename, size=None, aspect_ratio=None):
+    """
+    Start an upload of `filename` (its extension decides the asset kind).
+    size (bytes) is optional but lets finalize reject incomplete uploads.
+    aspect_ratio is an optional hint so images can be preprocessed as soon as they land.
+    """
+    kind = asset_kind(filename)
+    if kind is None:
+        raise UploadError('Unsupported file type')
+    if size is not None:
+        if size < 0 or size > UPLOAD_MAX_MB * 1024 * 1024:
+            raise UploadError('File too large', 413)
+    purge_stale_sessions()
+    session_id = uuid.uuid4().hex
+    directory = _session_dir(session_id)
+    os.makedirs(directory)
+    open(_part_path(session_id), 'wb').close()
+    meta = {
+        'upload_id': session_id,
+        'filename': os.path.basename(filename),
+        'kind': kind,
+        'size': size,
+        'aspect_ratio': aspect_ratio,
+        'created': time.time(),
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    meta['offset'] = 0
+    return meta
+
+
+def _hasher_at(session_id, offset, part_path):
+    """sha256 state after the first `offset` bytes, rebuilt from disk if this process lacks it."""
+    with _lock:
+        cached = _hashers.get(session_id)
+    if cached and cached[0] == offset:
+        return cached[1]
+    h = hashlib.sha256()
+    remaining = offset
+    with open(part_path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h
+
+
+def write_chunk(session_id, offset, stream):
+    """
+    Append the bytes of `stream` at `offset`, which must equal the current upload size
+    (chunks are sequential). Returns the new offset. Raises UploadError(409, offset=...)
+    on a mismatch so the client can resume from the right place.
+    """
+    meta = session_meta(session_id)
+    limit = meta['size'] if meta.get('size') is not None else UPLOAD_MAX_MB * 1024 * 1024
+    part = _part_path(session_id)
+    with open(part, 'ab') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0, os.SEEK_END)
+        current = f.tell()
+        if offset != current:
+            raise UploadError('Offset mismatch', 409, offset=current)
+        hasher = _hasher_at(session_id, current, part)
+        written = current
+        try:
+            while True:
+                chunk = stream.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if written + len(chunk) > limit:
+                    raise UploadError('Upload exceeds the declared size', 413, offset=written)
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+        finally:
+            f.flush()
+            with _lock:
+                _hashers[session_id] = (written, hasher)
+    return written
+
+
+def finalize(session_id, sha256=None):
+    """
+    Complete an upload and turn it into an asset. Optional sha256 (hex) is verified.
+    Returns {'asset_id', 'sha256', 'size', 'kind', 'filename', 'path'}.
+    """
+    meta = session_meta(session_id)
+    size = meta['offset']
+    if meta.get('size') is not None and size != meta['size']:
+        raise UploadError('Upload incomplete', 409, offset=size)
+    part = _part_path(session_id)
+    digest = _hasher_at(session_id, size, part).hexdigest()
+    if sha256 and sha256.lower() != digest:
+        discard_session(session_id)
+        raise UploadError('Checksum mismatch', 422, sha256=digest)
+    asset_id = digest[:40]
+    ext = os.path.splitext(meta['filename'])[1].lower()
+    path = asset_path(asset_id)
+    if path is None:
+        path = asset_store.store(asset_id, lambda tmp: os.replace(part, tmp), ext)
+    discard_session(session_id)
+    return {'asset_id': asset_id, 'sha256': digest, 'size': size, 'kind': meta['kind'],
+            'filename': meta['filename'], 'aspect_ratio': meta.get('aspect_ratio'), 'path': path}
+
+
+def asset_path(asset_id):
+    """Local path of a finalized asset (marked recently used), or None."""
+    if not _ID_RE.match(asset_id or ''):
+        return None
+    shard = os.path.dirname(asset_store.path(asset_id))
+    try:
+        names = os.listdir(shard)
+    except OSError:
+        return None
+    for name in names:
+        if name.startswith(asset_id + '.') and not name.endswith('.tmp'):
+            return asset_store.lookup(asset_id, name[len(asset_id):])
+    return None
+
+
+def discard_session(session_id):
+    with _lock:
+        _hashers.pop(session_id, None)
+    shutil.rmtree(_session_dir(session_id), ignore_errors=True)
+
+
+def purge_stale_sessions(max_age_h=UPLOAD_SESSION_TTL_H):
+    """Remove sessions not written to for max_age_h hours (abandoned uploads)."""
+    cutoff = time.time() - max_age_h * 3600
+    try:
+        entries = os.listdir(UPLOAD_SESSION_DIR)
+    except OSError:
+        return
+    for name in entries:
+        part = os.path.join(UPLOAD_SESSION_DIR, name, 'data.part')
+        try:
+            if os.path.getmtime(part) < cutoff:
+                discard_session(name)
+        except (OSError, UploadError):
+            continue
@@ -1,71 +1,53 @@
 # Utility functions can be added here later.
 
 import os
-import zipfile
 from typing import List, Tuple, Optional
-from PIL import Image
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
-def download_drive_folder(folder_url: str, dest_dir: str) -> str:
+def download_drive_folder(folder_url: str, dest_dir: str, stats: Optional[dict] = None) -> str:
     """
-    Download a shared Google Drive folder into dest_dir using gdown.
-    The link must be accessible to Anyone with the link (Viewer).
+    Download a shared Google Drive folder into dest_dir (concurrently, through the
+    per-file Drive cache; see drive_ingest.py).
+    The link must be accessible to Anyone with the link (Viewer), or GOOGLE_API_KEY must be set.
     Returns the directory where files were downloaded.
     """
+    import drive_ingest
     ensure_dir(dest_dir)
-    try:
-        import gdown
-    except ImportError as e:
-        raise RuntimeError("gdown is required to download from Google Drive. Please install it.") from e
-
-    # gdown will create subdirectories under dest_dir as needed
-    gdown.download_folder(url=folder_url, output=dest_dir, quiet=False, use_cookies=False)
+    drive_ingest.ingest_folder(folder_url, dest_dir, stats=stats)
     return dest_dir
 
-def extract_zip_files_in_dir(root_dir: str):
-    for root, _, files in os.walk(root_dir):
-        for f in files:
-            if f.lower().endswith('.zip'):
-                zip_path = os.path.join(root, f)
-                try:
-                    with zipfile.ZipFile(zip_path, 'r') as zf:
-                        zf.extractall(root)
-                except Exception:
-                    # Ignore bad zips; continue
-                    pass
-
 def collect_assets(root_dir: str) -> Tuple[Optional[str], List[str]]:
     """
-    Collect audio (.mp3) and images (.jpg/.jpeg/.png) recursively from root_dir.
+    Collect audio (MP3) and images recursively from root_dir, including members of zip
+    archives, classified by magic bytes (see asset_index.py). Zipped images are returned
+    as "<archive>::<member>" paths that the scene preprocessor reads in place; a zipped
+    narration is extracted next to its archive.
     If multiple mp3s exist, pick the largest by file size.
     Returns (audio_path, image_paths)
     """
-    images: List[str] = []
-    audios: List[str] = []
-    for r, _, files in os.walk(root_dir):
-        for f in files:
-            lf = f.lower()
-            full = os.path.join(r, f)
-            if lf.endswith('.mp3'):
-                audios.append(full)
-            elif lf.endswith('.jpg') or lf.endswith('.jpeg') or lf.endswith('.png') or lf.endswith('.webp'):
-                images.append(full)
-            else:
-                # Handle files without extensions: try to open as image
-                try:
-                    with Image.open(full) as im:
-                        im.verify()  # quick check
-                    images.append(full)
-                except Exception:
-                    pass
+    import asset_index
+    entries = asset_index.index_assets(root_dir)
+    images: List[str] = [e.path for e in entries if e.kind == 'image']
+    audios = [e for e in entries if e.kind == 'audio']
 
     # pick largest mp3 if any
     audio_path: Optional[str] = None
     if audios:
-        audio_path = max(audios, key=lambda p: os.path.getsize(p) if os.path.exists(p) else -1)
+        audio_path = asset_index.materialize(max(audios, key=lambda e: e.size).path)
 
     # sort images by name for stable ordering
     images.sort()
-    return audio_path, images
\ No newline at end of file
+    return audio_path, images
+
+def media_duration(path: str) -> float:
+    """
+    Container duration in seconds read from the ffmpeg header probe (no decoding).
+    Returns 0.0 when it cannot be determined.
+    """
+    try:
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        return float(ffmpeg_parse_infos(path).get('duration') or 0.0)
+    except Exception:
+        return 0.0
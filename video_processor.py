@@ -1,23 +1,38 @@
-from moviepy.editor import (AudioFileClip, ImageClip, VideoFileClip, ColorClip, concatenate_videoclips, TextClip, vfx, CompositeAudioClip)
+from moviepy.editor import (AudioFileClip, VideoClip, VideoFileClip, concatenate_videoclips, vfx, CompositeAudioClip)
 from moviepy.audio.fx.all import audio_loop
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from PIL import Image
+import numpy as np
 from proglog import ProgressBarLogger
 import shutil
-import assemblyai as aai
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
-import platform
 import re
+import artifacts
+import asset_index
+import audio_mix
+import captions
+import delivery
+import disk_cache
+import ffmpeg_render
+import outro
+import parallel_render
+import scene_frames
+import transcripts
 
-# --- Fix for Windows ImageMagick path ---
-# If you are on Windows, moviepy might not find the ImageMagick binary automatically.
-# Replace the path below with the correct path to your ImageMagick 'magick.exe' file.
-# Example: r"C:\\Program Files\\ImageMagick-7.1.1-Q16-HDRI\\magick.exe"
-if platform.system() == "Windows":
-    from moviepy.config import change_settings
-    # Prefer env var if provided, otherwise fall back to a common default
-    imagemagick_bin = os.getenv("IMAGEMAGICK_BINARY", r"C:\\Program Files\\ImageMagick-7.1.2-Q16-HDRI\\magick.exe")
-    change_settings({"IMAGEMAGICK_BINARY": imagemagick_bin})
+# Threads used to decode/crop scene images
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or (os.cpu_count() or 2)
+
+# Persistent cache of cropped scene images, keyed by source bytes + aspect + output size.
+# SCENE_CACHE_DIR='' disables it.
+scene_cache = disk_cache.cache_from_env("SCENE_CACHE_DIR", os.path.join("cache", "scenes"), "SCENE_CACHE_MAX_MB", 2048)
+
+# --- Preview renders (reduced size/fps, fast x264 preset, no Ken Burns or outro) ---
+PREVIEW_HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "360"))  # short side of the preview frame
+PREVIEW_FPS = int(os.getenv("PREVIEW_FPS", "12"))
+PREVIEW_PRESET = os.getenv("PREVIEW_PRESET", "ultrafast")
+EXPORT_PRESET = "medium"
 
 # --- Caption tuning constants ---
 CAPTION_MIN_WORDS_16_9 = 5
@@ -44,59 +59,13 @@ def chunk_tokens(tokens, min_words=CAPTION_MIN_WORDS_16_9, max_words=CAPTION_MAX
             chunks[-1] = moved + chunks[-1]
     return chunks
 
-def make_text_clip(text, start, end, final_clip, font, font_size, font_color, rel_y):
-    """
-    Build a readable caption with:
-    - Anti-aliased text (ImageMagick default via MoviePy TextClip)
-    - Subtle shadow (2px offset, ~0.6 opacity)
-    - Semi-transparent background for contrast
-    """
-    # Base text (no heavy stroke for cleaner anti-aliased edges)
-    txt = TextClip(
-        text,
-        font=font,
-        fontsize=font_size,
-        color=font_color,
-        stroke_color=None,
-        stroke_width=0,
-        method='label',  # tight surface around text; no full-width container
-        align='center'
-    ).set_duration(max(0.01, end - start))
-
-    # Shadow: a darker duplicate, slightly offset
-    shadow = TextClip(
-        text,
-        font=font,
-        fontsize=font_size,
-        color='black',
-        stroke_color=None,
-        stroke_width=0,
-        method='label',
-        align='center'
-    ).set_opacity(0.6).set_duration(txt.duration)
-
-    # Background: semi-transparent black panel with small padding
-    tw, th = txt.size
-    pad = max(8, int(font_size * 0.25))
-    bg = ColorClip(size=(tw + 2 * pad, th + 2 * pad), color=(0, 0, 0)).set_opacity(0.35).set_duration(txt.duration)
-
-    # Compose: background, shadow (offset), then text
-    shadow_offset = (pad + 2, pad + 2)
-    txt_offset = (pad, pad)
-    composed = CompositeVideoClip([
-        bg,
-        shadow.set_position(shadow_offset),
-        txt.set_position(txt_offset)
-    ])
-
-    return composed.set_start(start).set_end(end).set_position(('center', rel_y), relative=True)
-
 def update_status(task_id, tasks, status, log_message, progress=None):
-    tasks[task_id]['status'] = status
-    tasks[task_id]['logs'].append(log_message)
+    """tasks is a task store (see task_store.py)."""
+    fields = {'status': status}
     if progress is not None:
-        tasks[task_id]['progress'] = int(progress)
-    print(f"Task {task_id} - Status: {status}, Progress: {tasks[task_id].get('progress')}%, Log: {log_message}")
+        fields['progress'] = int(progress)
+    tasks.append_log(task_id, log_message, **fields)
+    print(f"Task {task_id} - Status: {status}, Progress: {progress}%, Log: {log_message}")
 
 def init_steps(task_id, tasks):
     steps = [
@@ -108,60 +77,445 @@ def init_steps(task_id, tasks):
         {'key': 'export', 'label': 'Export Video', 'state': 'pending'},
         {'key': 'cleanup', 'label': 'Cleanup', 'state': 'pending'},
     ]
-    existing = tasks[task_id].get('steps', [])
-    tasks[task_id]['steps'] = existing + steps
+    tasks.add_steps(task_id, steps)
     # Initialize export progress tracking
-    tasks[task_id]['export_progress'] = 0
+    tasks.update(task_id, export_progress=0)
 
 def set_step_state(task_id, tasks, key, state):
-    for s in tasks[task_id].get('steps', []):
-        if s['key'] == key:
-            s['state'] = state
-            return
+    tasks.set_step_state(task_id, key, state)
 
-def crop_to_aspect(image_path, aspect_ratio='9:16'):
-    """
-    Crop an image to the requested aspect ratio ('9:16' or '16:9') and resize to a
-    standard output size for that ratio. Returns a temp PNG path for MoviePy.
-    """
-    if aspect_ratio == '16:9':
-        target_aspect = 16.0 / 9.0
-        output_size = (1920, 1080)
-    else:
-        target_aspect = 9.0 / 16.0
-        output_size = (1080, 1920)
+def numeric_key(p):
+    """Natural sort key for scene images by numeric filename (e.g., 0.jpg, 1.png, ...)."""
+    base = os.path.splitext(os.path.basename(p))[0]
+    return (0, int(base)) if base.isdigit() else (1, base)
 
-    img = Image.open(image_path)
-    img_width, img_height = img.size
-    img_aspect = float(img_width) / float(img_height)
+def output_size_for(aspect_ratio):
+    """Standard output frame size (w, h) for an aspect ratio."""
+    return (1920, 1080) if aspect_ratio == '16:9' else (1080, 1920)
+
+def preview_size_for(aspect_ratio):
+    """Preview frame size: the output size scaled so its short side is PREVIEW_HEIGHT (even dimensions)."""
+    w, h = output_size_for(aspect_ratio)
+    scale = PREVIEW_HEIGHT / float(min(w, h))
+    return (int(round(w * scale / 2.0)) * 2, int(round(h * scale / 2.0)) * 2)
 
+def crop_box_for(size, target_aspect):
+    """Centered crop box (left, top, right, bottom) of `size` matching target_aspect (w/h)."""
+    img_width, img_height = size
+    img_aspect = float(img_width) / float(img_height)
     if img_aspect > target_aspect:
         # Image is wider than target, crop width
         new_width = int(target_aspect * img_height)
         offset = (img_width - new_width) / 2
-        box = (offset, 0, img_width - offset, img_height)
-    else:
-        # Image is taller than target, crop height
-        new_height = int(img_width / target_aspect)
-        offset = (img_height - new_height) / 2
-        box = (0, offset, img_width, img_height - offset)
+        return (offset, 0, img_width - offset, img_height)
+    # Image is taller than target, crop height
+    new_height = int(img_width / target_aspect)
+    offset = (img_height - new_height) / 2
+    return (0, offset, img_width, img_height - offset)
+
+def load_scene_images(image_path, targets):
+    """
+    Decode a source image once and crop/resize it for each (aspect_ratio, output_size)
+    target (output_size None = the standard size for that ratio). Returns RGB uint8
+    arrays in target order. JPEGs are decoded in draft mode (DCT scaling) when the source
+    is much larger than every target needs; other formats use Pillow's reduce() step
+    before the LANCZOS resample.
+    """
+    sizes = [output_size or output_size_for(aspect_ratio) for (aspect_ratio, output_size) in targets]
+    aspects = [float(w) / float(h) for (w, h) in sizes]
 
-    cropped_img = img.crop(box)
-    resized_img = cropped_img.resize(output_size, Image.LANCZOS)
+    # image_path may be a zip member ("<archive>::<member>"), decoded straight from the archive
+    with asset_index.open_asset(image_path) as f, Image.open(f) as img:
+        scale = max(w / float(box[2] - box[0])
+                    for (w, _), box in zip(sizes, (crop_box_for(img.size, a) for a in aspects)))
+        if scale < 1.0:
+            # Ask the decoder for the smallest size that still covers every output after cropping
+            img.draft('RGB', (int(img.size[0] * scale) + 1, int(img.size[1] * scale) + 1))
+        img = img.convert('RGB')
+        return [np.asarray(img.resize(size, Image.LANCZOS, box=crop_box_for(img.size, a), reducing_gap=3.0))
+                for size, a in zip(sizes, aspects)]
 
-    temp_path = os.path.splitext(image_path)[0] + f'_cropped_{aspect_ratio.replace(":","x")}.png'
-    resized_img.save(temp_path)
+def load_scene_image(image_path, aspect_ratio='9:16', output_size=None):
+    """
+    Decode, crop to the requested aspect ratio ('9:16' or '16:9') and resize to the
+    standard output size for that ratio (or output_size). Returns an RGB uint8 array.
+    """
+    return load_scene_images(image_path, [(aspect_ratio, output_size)])[0]
+
+def cropped_temp_path(image_path, aspect_ratio='9:16', output_size=None):
+    """Temp BMP path for an uncached cropped scene (next to the source, or its archive)."""
+    archive, member = asset_index.split_member(image_path)
+    base = os.path.splitext(archive)[0] + '_' + member.replace('/', '_') if member else image_path
+    size_tag = f'_{output_size[0]}x{output_size[1]}' if output_size else ''
+    return os.path.splitext(base)[0] + f'_cropped_{aspect_ratio.replace(":","x")}{size_tag}.bmp'
+
+def crop_to_aspect(image_path, aspect_ratio='9:16', output_size=None):
+    """
+    Crop an image to the requested aspect ratio ('9:16' or '16:9') and resize to a
+    standard output size for that ratio. Returns a temp uncompressed BMP path, for
+    consumers that need a file (ffmpeg engine, segment workers).
+    """
+    temp_path = cropped_temp_path(image_path, aspect_ratio, output_size)
+    Image.fromarray(load_scene_image(image_path, aspect_ratio, output_size)).save(temp_path)
     return temp_path
 
-def ken_burns_effect(clip, duration, zoom_factor=0.1):
+def scene_file_path(scene_dir, image_path, aspect_ratio, output_size):
+    """Job-owned file for a prepared scene: in scene_dir when given, else next to the source."""
+    if not scene_dir:
+        return cropped_temp_path(image_path, aspect_ratio, output_size)
+    name = hashlib.sha1(image_path.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(scene_dir, f"{name}_{aspect_ratio.replace(':', 'x')}_{output_size[0]}x{output_size[1]}.bmp")
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst (a copy across filesystems); dst keeps the bytes if src is deleted later."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        if not os.path.exists(src):
+            raise
+        shutil.copyfile(src, dst)
+    return dst
+
+def scene_key(digest, aspect_ratio, output_size):
+    """Scene cache key of one source image (content digest) cropped for aspect_ratio at output_size."""
+    return f"{digest}-{aspect_ratio.replace(':', 'x')}-{output_size[0]}x{output_size[1]}"
+
+def prepare_scenes(image_path, targets, to_disk=False, scene_dir=None):
     """
-    Applies a slow zoom-in effect to a clip.
+    Cropped/resized scenes of one source image for each (aspect_ratio, output_size)
+    target, via the persistent scene cache when enabled; the source is decoded at most
+    once, and only if some target is not cached.
+    Returns (source, cache_state) per target: source is an RGB array or, with to_disk, the
+    path of a file the caller owns (in scene_dir, or next to the source); cache_state is
+    'hit', 'miss' or None (cache disabled).
+    With to_disk, cache entries are hard-linked into place rather than returned: the cache
+    is size-bounded and may evict an entry while the job still needs it. An entry evicted
+    between lookup and use counts as a miss.
     """
-    def effect(t):
+    targets = [(aspect_ratio, output_size or output_size_for(aspect_ratio)) for (aspect_ratio, output_size) in targets]
+    results = [None] * len(targets)
+    keys = [None] * len(targets)
+    if scene_dir:
+        os.makedirs(scene_dir, exist_ok=True)
+    if scene_cache is not None:
+        digest = asset_index.asset_digest(image_path)
+        for i, (aspect_ratio, size) in enumerate(targets):
+            keys[i] = scene_key(digest, aspect_ratio, size)
+            cached = scene_cache.lookup(keys[i], '.bmp')
+            if not cached:
+                continue
+            try:
+                if to_disk:
+                    path = link_or_copy(cached, scene_file_path(scene_dir, image_path, *targets[i]))
+                    results[i] = (path, 'hit')
+                else:
+                    with Image.open(cached) as im:
+                        results[i] = (np.asarray(im.convert('RGB')), 'hit')
+            except OSError:
+                results[i] = None  # evicted under us: rebuild it below
+    missing = [i for i, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+    arrays = load_scene_images(image_path, [targets[i] for i in missing])
+    for i, arr in zip(missing, arrays):
+        if keys[i] is None:
+            if to_disk:
+                path = scene_file_path(scene_dir, image_path, *targets[i])
+                Image.fromarray(arr).save(path)
+                results[i] = (path, None)
+            else:
+                results[i] = (arr, None)
+        else:
+            cached = scene_cache.store(keys[i], lambda tmp, arr=arr: Image.fromarray(arr).save(tmp, format='BMP'), '.bmp')
+            if to_disk:
+                path = scene_file_path(scene_dir, image_path, *targets[i])
+                try:
+                    link_or_copy(cached, path)
+                except OSError:
+                    Image.fromarray(arr).save(path)
+                results[i] = (path, 'miss')
+            else:
+                results[i] = (arr, 'miss')
+    return results
+
+def prepare_scene(image_path, aspect_ratio='9:16', to_disk=False, output_size=None, scene_dir=None):
+    """
+    Cropped/resized scene for one source image (at output_size, default the standard
+    output size), via the persistent scene cache when enabled. Returns (source, cache_state)
+    as prepare_scenes does for a single target.
+    """
+    return prepare_scenes(image_path, [(aspect_ratio, output_size)], to_disk, scene_dir)[0]
+
+def warm_scene(image_path, aspect_ratio='9:16', output_size=None):
+    """
+    Fill the scene cache for one source image ahead of a job. Nothing is written outside the
+    cache: jobs link the entry into their own scene folder when they run.
+    """
+    if scene_cache is None:
+        return
+    size = output_size or output_size_for(aspect_ratio)
+    key = scene_key(asset_index.asset_digest(image_path), aspect_ratio, size)
+    if scene_cache.lookup(key, '.bmp'):
+        return
+    arr = load_scene_image(image_path, aspect_ratio, size)
+    scene_cache.store(key, lambda tmp: Image.fromarray(arr).save(tmp, format='BMP'), '.bmp')
+
+def preprocess_images(image_paths, aspect_ratio='9:16', to_disk=False, workers=None, output_size=None,
+                      scene_dir=None):
+    """
+    Crop/resize all scene images in a thread pool (Pillow releases the GIL while decoding
+    and resampling). Returns, in input order, (source, cache_state) pairs from prepare_scene:
+    RGB arrays for in-process MoviePy clips or, with to_disk, image paths (in scene_dir).
+    """
+    with ThreadPoolExecutor(max_workers=workers or IMAGE_WORKERS) as pool:
+        return list(pool.map(lambda p: prepare_scene(p, aspect_ratio, to_disk, output_size, scene_dir), image_paths))
+
+# --- Ken Burns easing curves (progress 0..1 -> eased 0..1) ---
+KEN_BURNS_CURVES = {
+    'linear': lambda p: p,
+    'ease_in': lambda p: p * p,
+    'ease_out': lambda p: 1 - (1 - p) * (1 - p),
+    'ease_in_out': lambda p: p * p * (3 - 2 * p),
+}
+
+def frame_clip(make_frame, frame_size, duration):
+    """
+    VideoClip of make_frame with a known size. MoviePy's constructor renders get_frame(0)
+    just to learn the size, which for a lazily loaded scene means decoding it while the
+    timeline is being built (and again when it is rendered).
+    """
+    clip = VideoClip(duration=duration)
+    clip.make_frame = make_frame
+    clip.size = tuple(frame_size)
+    return clip
+
+def ken_burns_clip(get_source, frame_size, duration, zoom_factor=0.1, curve='linear', pan=(0.0, 0.0)):
+    """
+    A scene clip with a slow zoom (and optional pan). get_source() returns the scene
+    resampled once into its oversampled source (1 + zoom_factor larger, see
+    scene_frames.oversample) and is called per frame, so the pixels can be loaded lazily;
+    each frame is a single crop-and-scale of that source (Pillow resize with a box), so no
+    full-size resize + recomposite happens per frame. That sub-pixel resample (~25 ms at
+    1080x1920 on one core) is the floor for a smooth zoom; cheaper filters jitter or blur, so
+    larger speedups come from parallel_export or the ffmpeg engine, not from this function.
+    - curve: key of KEN_BURNS_CURVES shaping zoom/pan progress over the scene
+    - pan: (x, y) in [-1, 1], fraction of the zoom margin to drift towards by the end
+    """
+    w, h = frame_size
+    ease = KEN_BURNS_CURVES.get(curve, KEN_BURNS_CURVES['linear'])
+    zoom_factor = max(0.0, float(zoom_factor))
+    pan_x = max(-1.0, min(1.0, float(pan[0])))
+    pan_y = max(-1.0, min(1.0, float(pan[1])))
+
+    def make_frame(t):
+        source = get_source()
+        src_w, src_h = source.size
         # This will zoom from 1 to 1 + zoom_factor over the duration
-        return 1 + (zoom_factor * (t / duration))
+        p = ease(max(0.0, min(1.0, t / duration))) if duration else 0.0
+        z = 1 + zoom_factor * p
+        view_w, view_h = src_w / z, src_h / z
+        cx = src_w / 2.0 + pan_x * p * (src_w - view_w) / 2.0
+        cy = src_h / 2.0 + pan_y * p * (src_h - view_h) / 2.0
+        box = (cx - view_w / 2.0, cy - view_h / 2.0, cx + view_w / 2.0, cy + view_h / 2.0)
+        return np.asarray(source.resize((w, h), Image.BILINEAR, box=box))
 
-    return clip.fx(vfx.resize, effect).set_position(('center', 'center'))
+    return frame_clip(make_frame, frame_size, duration)
+
+def scene_timeline(scene_sources, frame_size, scene_duration, eff_transition, ken_burns):
+    """
+    Concatenated Ken Burns scenes with non-overlapping fades. Scene pixels come from a
+    scene_frames.SceneFrames window, so only the scenes around the playhead are decoded.
+    Scenes are back to back, frame-sized and opaque, so a timeline frame is the current
+    scene's frame as is (concatenate_videoclips' compose method would blit it onto a
+    background, a full-frame copy per frame), dimmed in place inside the fades (float32,
+    rather than vfx.fadein/fadeout's float64 blend with a colour). Building it decodes
+    nothing; each scene is decoded once, when the playhead reaches its window.
+    """
+    frames = scene_frames.SceneFrames(scene_sources, frame_size, ken_burns.get('zoom_factor', 0.0))
+    scenes = [ken_burns_clip(lambda i=i: frames.get(i), frame_size, scene_duration, **ken_burns)
+              for i in range(len(frames))]
+    last = len(scenes) - 1
+
+    def make_frame(t):
+        i = max(0, min(last, int(t // scene_duration)))
+        local_t = t - i * scene_duration
+        frame = scenes[i].get_frame(local_t)
+        if eff_transition > 0:
+            # Fade in at start and fade out at end; keep duration unchanged
+            level = min(1.0, local_t / eff_transition, (scene_duration - local_t) / eff_transition)
+            if level < 1.0:
+                frame = (frame * np.float32(max(0.0, level))).astype(np.uint8)
+        return frame
+
+    return frame_clip(make_frame, frame_size, len(scenes) * scene_duration)
+
+def assemble_clip(scene_sources, frame_size, scene_duration, total_audio, eff_transition, ken_burns, audio_clip, bgm_clip):
+    """
+    Build the MoviePy timeline: Ken Burns per scene, non-overlapping fades, concatenation
+    and the narration (+ optional background music) audio.
+    scene_sources are cropped image paths (decoded lazily) or RGB arrays.
+    """
+    base_clip = scene_timeline(scene_sources, frame_size, scene_duration, eff_transition, ken_burns)
+    # Rule 1: Ensure final duration equals audio duration exactly (account for rounding)
+    base_clip = base_clip.set_duration(total_audio)
+    # Attach audio: main at 100% plus optional background at the selected level
+    if bgm_clip is not None:
+        mixed_audio = CompositeAudioClip([audio_clip.volumex(1.0), bgm_clip])
+        return base_clip.set_audio(mixed_audio)
+    return base_clip.set_audio(audio_clip)
+
+def premix_narration(audio_path, out_path, bgm_path=None, bgm_level_percent=4, normalize=False,
+                     scene_pipeline=None, stats=None):
+    """
+    Mix the narration and looped background music (bgm_path, None for none) once with NumPy
+    into one AAC track at out_path, via the audio stage artifact when the stage cache is
+    enabled. Narration PCM already decoded by scene_pipeline is reused.
+    Returns (total_audio, audio_key); audio_key is None without the stage cache.
+    """
+    def build_mix(mix_path):
+        narration_pcm = None
+        if scene_pipeline is not None and scene_pipeline.audio_path() == audio_path:
+            narration_pcm = scene_pipeline.audio_pcm()
+        duration = audio_mix.premix(
+            audio_path, mix_path,
+            bgm_path=bgm_path,
+            bgm_level=bgm_level_percent / 100.0,
+            normalize=normalize,
+            narration=narration_pcm,
+        )
+        return {'total_audio': duration}
+
+    if artifacts.stage_cache is None:
+        return build_mix(out_path)['total_audio'], None
+    audio_key = artifacts.stage_key(
+        'audio', narration=artifacts.content_digest(audio_path),
+        bgm=artifacts.content_digest(bgm_path) if bgm_path else None,
+        level=bgm_level_percent, normalize=normalize,
+    )
+    mix_artifact, mix_meta = artifacts.fetch_or_build('audio', audio_key, '.m4a', build_mix, stats)
+    artifacts.link_to(mix_artifact, out_path)
+    return float(mix_meta['total_audio']), audio_key
+
+def report_export_progress(task_id, tasks, pct):
+    """Record export percent and smoothly advance overall progress from 10% to 99%."""
+    base = 10
+    span = 89  # 10 -> 99
+    tasks.update(task_id, export_progress=pct, progress=min(99, base + int((pct / 100.0) * span)))
+
+class SegmentLogger(ProgressBarLogger):
+    """Publishes a segment worker's written-frame count to the shared progress map."""
+
+    def __init__(self, progress_map, index):
+        super().__init__()
+        self.progress_map = progress_map
+        self.index = index
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == 't' and attr == 'index':
+            self.progress_map[self.index] = value
+
+def render_segment(spec, progress_map):
+    """
+    Process-pool worker: render one run of scenes (or the outro) video-only to spec['output'].
+    Segments share codec/fps/size so they can be concatenated without re-encoding.
+    """
+    fps = spec['fps']
+    w, h = spec['frame_size']
+    # MoviePy samples np.arange(0, duration, 1/fps); stay just under frames/fps to write exactly `frames` frames
+    duration = spec['frames'] / float(fps) - 1e-6
+    if spec['kind'] == 'outro':
+        clip = VideoFileClip(spec['outro_path'], audio=False)
+        if clip.w != w or clip.h != h:
+            clip = clip.resize((w, h))
+        clip = clip.fx(vfx.fadein, spec['fade_in'])
+    else:
+        clip = scene_timeline(spec['scenes'], (w, h), spec['scene_duration'], spec['transition'], spec['ken_burns'])
+        offset = max(0.0, spec['offset'])
+        clip = clip.subclip(offset, min(clip.duration, offset + duration)).set_duration(duration)
+        if spec['cues']:
+            style = spec['caption_style']
+            track = captions.build_caption_track(spec['cues'], (w, h), style['font'], style['font_size'],
+                                                 style['font_color'], style['rel_y'])
+            clip = clip.fl(track.apply)
+        if spec['fade_out'] > 0:
+            clip = clip.fx(vfx.fadeout, spec['fade_out'])
+    clip = clip.set_duration(duration)
+    clip.write_videofile(spec['output'], codec='libx264', audio=False, fps=fps, threads=spec['threads'],
+                         ffmpeg_params=outro.EXPORT_X264_PARAMS, logger=SegmentLogger(progress_map, spec['index']))
+    progress_map[spec['index']] = spec['frames']
+    return spec['output']
+
+def export_parallel(task_id, tasks, cropped_paths, scene_duration, output_path, frame_size, eff_transition,
+                    ken_burns, caption_cues, caption_style, audio_clip, bgm_clip, outro_path, outro_fade,
+                    fade_out=0.0, premixed_audio=None, fps=outro.EXPORT_FPS, workers=None):
+    """
+    Split the timeline at scene boundaries, render segments in a process pool, join them with
+    the concat demuxer (no re-encode) and mux the mixed audio once.
+    outro_path renders the Thankyou clip as an extra segment; fade_out fades the end of the
+    main content when the (pre-conformed) outro is appended by the caller instead.
+    premixed_audio (an AAC file from audio_mix.premix) is muxed as-is when no outro is composed here.
+    workers defaults to parallel_render.pool_size().
+    """
+    workers = workers or parallel_render.pool_size()
+    frame_counts = ffmpeg_render.scene_frame_counts(len(cropped_paths), scene_duration, fps)
+    main_duration = sum(frame_counts) / float(fps)
+    parts_dir = tempfile.mkdtemp(prefix="parts_")  # not next to output_path: that may be inside the stage cache
+    try:
+        outro_clip = VideoFileClip(outro_path) if outro_path else None
+        fade_dur = 0.0
+        if outro_clip is not None:
+            fade_dur = min(outro_fade, max(0.01, min(main_duration, outro_clip.duration) / 2.0))
+
+        specs = []
+        for (first, last, start_frame, frames) in parallel_render.plan_segments(frame_counts, workers):
+            t0 = start_frame / float(fps)
+            t1 = (start_frame + frames) / float(fps)
+            cues = [(text, max(s, t0) - t0, min(e, t1) - t0) for (text, s, e) in caption_cues if e > t0 and s < t1]
+            specs.append({
+                'index': len(specs), 'kind': 'scenes', 'frames': frames, 'fps': fps, 'frame_size': frame_size,
+                'scenes': cropped_paths[first:last], 'scene_duration': scene_duration,
+                'offset': t0 - first * scene_duration, 'transition': eff_transition, 'ken_burns': ken_burns,
+                'cues': cues, 'caption_style': caption_style, 'fade_out': 0.0, 'threads': 1,
+                'output': os.path.join(parts_dir, f"seg_{len(specs):04d}.mp4"),
+            })
+        specs[-1]['fade_out'] = fade_out
+        if outro_clip is not None:
+            specs[-1]['fade_out'] = fade_dur
+            specs.append({
+                'index': len(specs), 'kind': 'outro', 'frames': max(1, int(round(outro_clip.duration * fps))),
+                'fps': fps, 'frame_size': frame_size, 'outro_path': outro_path, 'fade_in': fade_dur, 'threads': 1,
+                'output': os.path.join(parts_dir, f"seg_{len(specs):04d}.mp4"),
+            })
+
+        segment_paths = parallel_render.run_segments(
+            render_segment, specs, workers, on_progress=lambda pct: report_export_progress(task_id, tasks, pct)
+        )
+
+        # Audio is mixed and encoded once for the whole timeline
+        video_path = os.path.join(parts_dir, "video.mp4")
+        parallel_render.concat_segments(segment_paths, video_path)
+        if premixed_audio and outro_clip is None:
+            parallel_render.mux_audio(video_path, premixed_audio, output_path, faststart=True)
+            report_export_progress(task_id, tasks, 100)
+            return output_path
+        main_audio = CompositeAudioClip([audio_clip, bgm_clip]) if bgm_clip is not None else audio_clip
+        main_audio = main_audio.set_duration(main_duration)
+        if outro_clip is not None and outro_clip.audio is not None:
+            outro_audio = outro_clip.audio.volumex(outro.OUTRO_VOLUME).set_start(main_duration)
+            full_audio = CompositeAudioClip([main_audio, outro_audio]).set_duration(main_duration + outro_clip.duration)
+        else:
+            full_audio = main_audio
+        audio_path = os.path.join(parts_dir, "audio.m4a")
+        full_audio.write_audiofile(audio_path, fps=44100, codec='aac', logger=None)
+        parallel_render.mux_audio(video_path, audio_path, output_path, faststart=True)
+        report_export_progress(task_id, tasks, 100)
+        if outro_clip is not None:
+            outro_clip.close()
+        return output_path
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
 
 def create_video(task_id, tasks, config):
     """
@@ -170,7 +524,9 @@ def create_video(task_id, tasks, config):
     update_status(task_id, tasks, "processing", "Video processing started...", progress=1)
     init_steps(task_id, tasks)
 
-    cropped_image_paths = [] # Initialize here to ensure it's always defined for cleanup
+    scene_dir = None  # this job's prepared scene files (when not taken from a ScenePipeline)
+    mixed_audio_path = None
+    ass_path = None
 
     try:
         # --- Initialization ---
@@ -184,12 +540,45 @@ def create_video(task_id, tasks, config):
         # Horizontal position removed; captions will be centered
         assemblyai_api_key = config.get("assemblyai_api_key")
         use_auto_captions = bool(config.get("use_auto_captions", True))
+        # Pluggable word-timing provider (TRANSCRIBE_PROVIDER); None when it cannot run
+        transcriber = transcripts.provider_from_env(assemblyai_api_key) if use_auto_captions else None
         provided_srt_path = config.get("srt_path")
         video_url = config.get("video_url")
+        # Optional ingest_pipeline.ScenePipeline that already preprocessed images/decoded audio while downloading
+        scene_pipeline = config.get("scene_pipeline")
+        # Set by renditions.create_renditions: inputs, mix and transcript are shared with sibling renditions
+        shared_inputs = bool(config.get("rendition_of"))
+        shared_mix = config.get("shared_mix")
+        shared_transcript = config.get("transcript")
         aspect_ratio = config.get("aspect_ratio", "9:16")
         transition_duration = float(config.get("transition_duration", 0.7))
+        ken_burns = {
+            'zoom_factor': float(config.get("ken_burns_zoom", 0.1)),
+            'curve': config.get("ken_burns_curve", "linear"),
+            'pan': tuple(config.get("ken_burns_pan", (0.0, 0.0))),
+        }
+        # 'moviepy' (default) renders frames in Python; 'ffmpeg' compiles one native filtergraph
+        render_engine = str(config.get("render_engine", "moviepy")).strip().lower()
+        # MoviePy engine only: render scene segments in a process pool and stream-copy concat them
+        parallel_export = bool(config.get("parallel_export", False))
+        # Segment processes: this export's share of the cores (renditions of one job render concurrently)
+        segment_workers = parallel_render.pool_size(int(config.get("concurrent_renders", 1)))
+        # 'sprite' (default) blits Pillow caption sprites; 'ass' compiles an ASS script that libass burns in
+        caption_mode = str(config.get("caption_mode", "sprite")).strip().lower()
+        # Preview: same scene and caption timeline at PREVIEW_HEIGHT/PREVIEW_FPS with a fast preset,
+        # no Ken Burns, no outro; inputs are kept afterwards so the job can be promoted to a full render
+        preview = bool(config.get("preview", False))
+        # Also store the captionless base render (one extra encode) so caption restyles reuse it
+        keep_base = bool(config.get("keep_base", False))
+        export_fps = PREVIEW_FPS if preview else outro.EXPORT_FPS
+        x264_preset = PREVIEW_PRESET if preview else EXPORT_PRESET
+        if preview:
+            ken_burns['zoom_factor'] = 0.0
+            parallel_export = False
         background_music_enabled = bool(config.get("background_music_enabled", True))
         background_music_path = config.get("background_music_path")
+        # Optional loudness normalization of the narration during the audio pre-mix
+        normalize_narration = bool(config.get("normalize_narration", False))
         # User-selected level percent for background music
         try:
             bgm_level_percent = int(config.get("background_music_level_percent", 4))
@@ -201,31 +590,61 @@ def create_video(task_id, tasks, config):
         if not all([audio_path, image_paths, output_path]):
             raise ValueError("Missing required configuration for video creation.")
 
+        # Word timings come back over the network: start them now so they overlap the audio mix and
+        # scene preparation (a Drive job's pipeline started them when the narration landed)
+        transcript_future = None
+        if not provided_srt_path and use_auto_captions and transcriber and shared_transcript is None:
+            if scene_pipeline is not None and scene_pipeline.audio_path() == audio_path:
+                transcript_future = scene_pipeline.transcript_future()
+            if transcript_future is None:
+                transcript_future = transcripts.transcribe_async(audio_path, transcriber)
+
         set_step_state(task_id, tasks, 'init', 'done')
         set_step_state(task_id, tasks, 'durations', 'in_progress')
         update_status(task_id, tasks, "processing", "Calculating scene durations...", progress=3)
         # --- Scene Calculation ---
-        audio_clip = AudioFileClip(audio_path)
-        total_audio = audio_clip.duration
-        # Prepare background music if enabled
+        use_bgm = bool(background_music_enabled and background_music_path and os.path.exists(background_music_path))
         bgm_clip = None
+        stage_stats = {}
+        audio_key = None
+        # Pre-mix narration + looped background music once with NumPy into a single AAC track
         try:
-            if background_music_enabled and background_music_path and os.path.exists(background_music_path):
-                raw_bgm = AudioFileClip(background_music_path)
-                if raw_bgm.duration >= total_audio:
-                    bgm_clip = raw_bgm.subclip(0, total_audio)
-                else:
-                    bgm_clip = audio_loop(raw_bgm, duration=total_audio)
-                # Set background music volume based on selected percent
-                bgm_clip = bgm_clip.volumex(bgm_level_percent / 100.0)
-        except Exception:
-            # If anything goes wrong with BGM, proceed without it
-            bgm_clip = None
-        # Natural sort image paths by numeric filename (e.g., 0.jpg, 1.png, ...)
-        def numeric_key(p):
-            base = os.path.splitext(os.path.basename(p))[0]
-            return (0, int(base)) if base.isdigit() else (1, base)
-        image_paths = sorted(image_paths, key=numeric_key)
+            mixed_audio_path = output_path + '.mix.m4a'
+            if shared_mix:
+                # Mixed once for all renditions of a multi-rendition job
+                artifacts.link_to(shared_mix['path'], mixed_audio_path)
+                total_audio, audio_key = float(shared_mix['total_audio']), shared_mix.get('key')
+            else:
+                total_audio, audio_key = premix_narration(
+                    audio_path, mixed_audio_path, bgm_path=background_music_path if use_bgm else None,
+                    bgm_level_percent=bgm_level_percent, normalize=normalize_narration,
+                    scene_pipeline=scene_pipeline, stats=stage_stats,
+                )
+            audio_clip = AudioFileClip(mixed_audio_path)
+            audio_clip = audio_clip.subclip(0, min(total_audio, audio_clip.duration))
+            if stage_stats:
+                tasks.update(task_id, stage_cache=stage_stats)
+        except Exception as mix_e:
+            update_status(task_id, tasks, "processing", f"Audio pre-mix failed, mixing during export: {mix_e}", progress=3)
+            mixed_audio_path = None
+            audio_key = None
+            audio_clip = AudioFileClip(audio_path)
+            total_audio = audio_clip.duration
+            # Prepare background music if enabled
+            try:
+                if use_bgm:
+                    raw_bgm = AudioFileClip(background_music_path)
+                    if raw_bgm.duration >= total_audio:
+                        bgm_clip = raw_bgm.subclip(0, total_audio)
+                    else:
+                        bgm_clip = audio_loop(raw_bgm, duration=total_audio)
+                    # Set background music volume based on selected percent
+                    bgm_clip = bgm_clip.volumex(bgm_level_percent / 100.0)
+            except Exception:
+                # If anything goes wrong with BGM, proceed without it
+                bgm_clip = None
+        if not config.get('keep_image_order'):
+            image_paths = sorted(image_paths, key=numeric_key)  # Drive/upload filenames carry the order
 
         num_images = len(image_paths)
         # Rule 1: exact per-image duration
@@ -234,15 +653,29 @@ def create_video(task_id, tasks, config):
         set_step_state(task_id, tasks, 'durations', 'done')
         set_step_state(task_id, tasks, 'images', 'in_progress')
         update_status(task_id, tasks, "processing", "Processing images (crop to aspect) and applying Ken Burns...", progress=5)
-        # --- Image Processing & Animation ---
-        video_clips = []
-        for img_path in image_paths:
-            cropped_path = crop_to_aspect(img_path, aspect_ratio=aspect_ratio)
-            cropped_image_paths.append(cropped_path)
-            
-            img_clip = ImageClip(cropped_path).set_duration(scene_duration)
-            animated_clip = ken_burns_effect(img_clip, scene_duration)
-            video_clips.append(animated_clip)
+        # --- Image Processing ---
+        # Scenes are files for every engine (fast uncompressed images, linked from the scene cache
+        # into a job folder so eviction cannot remove them mid-render): the ffmpeg engine and segment
+        # workers read them directly, and the MoviePy timeline decodes each one only while it is on
+        # screen (scene_frames), so decoded scenes are not held per job.
+        frame_size = preview_size_for(aspect_ratio) if preview else output_size_for(aspect_ratio)
+        if (scene_pipeline is not None and scene_pipeline.to_disk and not preview
+                and aspect_ratio in scene_pipeline.aspect_ratios and scene_pipeline.image_paths() == image_paths):
+            prepared = scene_pipeline.scenes(aspect_ratio)
+        else:
+            scene_dir = output_path + '.scenes'
+            prepared = preprocess_images(image_paths, aspect_ratio=aspect_ratio, to_disk=True,
+                                         output_size=frame_size, scene_dir=scene_dir)
+        if preview:
+            # Same caption layout relative to the smaller frame
+            font_size = max(8, int(round(font_size * frame_size[1] / float(output_size_for(aspect_ratio)[1]))))
+        scene_sources = [source for (source, _) in prepared]
+        scene_hits = sum(1 for (_, state) in prepared if state == 'hit')
+        tasks.update(task_id, scene_cache={
+            'hits': scene_hits,
+            'misses': sum(1 for (_, state) in prepared if state == 'miss'),
+            'hit_rate': round(scene_hits / float(len(prepared)), 3) if prepared else 0.0,
+        })
 
         set_step_state(task_id, tasks, 'images', 'done')
         set_step_state(task_id, tasks, 'assemble', 'in_progress')
@@ -252,22 +685,12 @@ def create_video(task_id, tasks, config):
         # We'll apply fade in/out per clip (no overlap) and concatenate.
         # Cap transition to at most half the scene duration.
         eff_transition = max(0.0, min(transition_duration, scene_duration / 2.0))
-        faded_clips = []
-        for idx, clip in enumerate(video_clips):
-            c = clip
-            if eff_transition > 0:
-                # Fade in at start and fade out at end; keep duration unchanged
-                c = c.fx(vfx.fadein, eff_transition).fx(vfx.fadeout, eff_transition)
-            faded_clips.append(c)
-        base_clip = concatenate_videoclips(faded_clips, method="compose")
-        # Rule 1: Ensure final duration equals audio duration exactly (account for rounding)
-        base_clip = base_clip.set_duration(total_audio)
-        # Attach audio: main at 100% plus optional background at 20%
-        if bgm_clip is not None:
-            mixed_audio = CompositeAudioClip([audio_clip.volumex(1.0), bgm_clip])
-            final_clip = base_clip.set_audio(mixed_audio)
-        else:
-            final_clip = base_clip.set_audio(audio_clip)
+        # The ffmpeg engine compiles the timeline itself at export; MoviePy clips are only
+        # built for the MoviePy engine (or as a fallback if ffmpeg fails).
+        final_clip = None
+        if render_engine != 'ffmpeg' and not parallel_export:
+            final_clip = assemble_clip(scene_sources, frame_size, scene_duration, total_audio, eff_transition,
+                                       ken_burns, audio_clip, bgm_clip)
 
         # --- Subtitle Generation ---
         set_step_state(task_id, tasks, 'assemble', 'done')
@@ -275,22 +698,36 @@ def create_video(task_id, tasks, config):
 
         # removed unused legacy variable 'subtitles'
         srt_path = None
-        overlay_clips = []  # holds per-word TextClip overlays
+        caption_cues = []  # (text, start, end) per caption word/chunk
+        caption_track = None
+        ass_fonts_dir = None
+        cache_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        tasks.update(task_id, caption_cache=cache_stats)
+        # Compute vertical relative y (0=top, 1=bottom). Slider is distance from bottom.
+        rel_y = 1.0 - max(0.0, min(1.0, position_vertical_percent))
 
         # Prepare transcription (for auto) or set SRT path if provided
         if provided_srt_path:
             srt_path = provided_srt_path
             update_status(task_id, tasks, "processing", "Using provided SRT for subtitles...", progress=9)
-        elif use_auto_captions and assemblyai_api_key:
-            update_status(task_id, tasks, "processing", "Transcribing with AssemblyAI for word timings...", progress=9)
-            aai.settings.api_key = assemblyai_api_key
-            transcriber = aai.Transcriber()
-            transcript = transcriber.transcribe(audio_path)
-            if transcript.status == aai.TranscriptStatus.error:
-                error_message = f"AssemblyAI Error: {transcript.error}"
+        elif use_auto_captions and transcriber:
+            update_status(task_id, tasks, "processing",
+                          "Using the job's shared transcript..." if shared_transcript else "Transcribing narration for word timings...",
+                          progress=9)
+            transcript_stats = {}
+            try:
+                # Cached by audio content hash: a re-render of the same narration skips the provider
+                transcript = shared_transcript
+                if transcript is None:
+                    transcript, transcript_stats = transcript_future.result()
+                tasks.update(task_id, transcript_cache=transcript_stats.get('transcript_cache'))
+                if transcript_stats.get('transcript_cache') == 'hit':
+                    update_status(task_id, tasks, "processing", "Reused cached transcript (no transcription request).", progress=9)
+            except transcripts.TranscriptionError as e:
+                transcript = None
                 # mark subtitles step as error but continue without subtitles
                 set_step_state(task_id, tasks, 'subtitles', 'error')
-                update_status(task_id, tasks, "processing", error_message, progress=60)
+                update_status(task_id, tasks, "processing", str(e), progress=60)
         else:
             update_status(task_id, tasks, "processing", "Skipping captions (no SRT and auto disabled or API key missing).", progress=9)
 
@@ -319,9 +756,6 @@ def create_video(task_id, tasks, config):
                         if start < end and text:
                             entries.append((start, end, text))
 
-                # Compute vertical relative y (0=top, 1=bottom). Slider is distance from bottom.
-                rel_y = 1.0 - max(0.0, min(1.0, position_vertical_percent))
-
                 for (start, end, text) in entries:
                     words = [w for w in text.split() if w]
                     if not words:
@@ -343,9 +777,7 @@ def create_video(task_id, tasks, config):
                             ch_start = acc
                             ch_end = min(end, ch_start + ch_dur)
                             acc = ch_end
-                            overlay_clips.append(
-                                make_text_clip(ch_text, ch_start, ch_end, final_clip, font, font_size, font_color, rel_y)
-                            )
+                            caption_cues.append((ch_text, ch_start, ch_end))
                     else:
                         # Word-by-word for vertical formats
                         total = len(words)
@@ -353,16 +785,12 @@ def create_video(task_id, tasks, config):
                         t0 = start
                         for w in words:
                             t1 = t0 + slice_dur
-                            overlay_clips.append(
-                                make_text_clip(w, t0, t1, final_clip, font, font_size, font_color, rel_y)
-                            )
+                            caption_cues.append((w, t0, t1))
                             t0 = t1
                 set_step_state(task_id, tasks, 'subtitles', 'done')
-            elif use_auto_captions and assemblyai_api_key:
+            elif use_auto_captions and transcriber:
                 # Already transcribed above if enabled; use word timestamps
                 if 'transcript' in locals() and transcript and getattr(transcript, 'words', None):
-                    # Compute vertical relative y (0=top, 1=bottom). Slider is distance from bottom.
-                    rel_y = 1.0 - max(0.0, min(1.0, position_vertical_percent))
                     if aspect_ratio == '16:9':
                         # Group words into sentences by punctuation or pauses
                         sentence_tokens = []
@@ -384,9 +812,7 @@ def create_video(task_id, tasks, config):
                                 ch_end = ch_start + ch_dur
                                 acc = ch_end
                                 text = " ".join(chunk).strip()
-                                overlay_clips.append(
-                                    make_text_clip(text, ch_start, ch_end, final_clip, font, font_size, font_color, rel_y)
-                                )
+                                caption_cues.append((text, ch_start, ch_end))
                         for w in transcript.words:
                             # AssemblyAI word times are ms
                             w_start = (w.start or 0) / 1000.0
@@ -424,13 +850,22 @@ def create_video(task_id, tasks, config):
                             txt = (w.text or '').strip()
                             if not txt:
                                 continue
-                            overlay_clips.append(
-                                make_text_clip(txt, start, end, final_clip, font, font_size, font_color, rel_y)
-                            )
+                            caption_cues.append((txt, start, end))
                 set_step_state(task_id, tasks, 'subtitles', 'done')
             else:
                 # No subtitles
                 set_step_state(task_id, tasks, 'subtitles', 'done')
+            if caption_cues and caption_mode == 'ass':
+                # Compile the same cues and style into an ASS script; libass burns it in during an encode,
+                # so no caption overlays are built in Python
+                ass_path = output_path + '.ass'
+                ass_fonts_dir = captions.write_ass(caption_cues, ass_path, frame_size, font, font_size, font_color, rel_y)
+            elif caption_cues:
+                # Rasterize (via the sprite cache) and index all captions on one timeline
+                caption_track = captions.build_caption_track(
+                    caption_cues, frame_size, font, font_size, font_color, rel_y, stats=cache_stats
+                )
+                tasks.update(task_id, caption_cache=cache_stats)
         except Exception as sub_e:
             # Fail gracefully on subtitle overlay generation
             set_step_state(task_id, tasks, 'subtitles', 'error')
@@ -448,62 +883,223 @@ def create_video(task_id, tasks, config):
                     pct = 0
                     if total:
                         pct = int(100 * index / total)
-                    tasks[task_id]['export_progress'] = pct
-                    # Smoothly advance overall progress from 10% to 99% during export
-                    try:
-                        base = 10
-                        span = 89  # 10 -> 99
-                        tasks[task_id]['progress'] = min(99, base + int((pct / 100.0) * span))
-                    except Exception:
-                        pass
+                    report_export_progress(task_id, tasks, pct)
         export_logger = ExportLogger()
-        tasks[task_id]['export_progress'] = 0
+        tasks.update(task_id, export_progress=0)
 
-        # 1) Build main content (with overlays if any) strictly limited to narration duration
-        if overlay_clips:
-            main_clip = CompositeVideoClip([final_clip] + overlay_clips).set_duration(final_clip.duration)
-        else:
-            main_clip = final_clip
-
-        # 2) Load closing Thankyou clip based on aspect ratio, set its audio to 50%, and add smooth transition
+        # Closing Thankyou clip based on aspect ratio (audio at 50%, smooth fade transition)
+        thankyou_path = outro.outro_source_for(aspect_ratio)
+        # Subtle non-overlapping fades (0.3–0.5s), clamped to clip lengths
         try:
-            if aspect_ratio == '16:9':
-                thankyou_path = os.path.join('resource', 'Thankyou169.mp4')
-            else:
-                thankyou_path = os.path.join('resource', 'Thankyou 916.mp4')
-
-            if os.path.exists(thankyou_path):
-                ty_clip = VideoFileClip(thankyou_path)
-                # Ensure sizes match composition; if not, resize to main clip size
-                if ty_clip.w != main_clip.w or ty_clip.h != main_clip.h:
-                    ty_clip = ty_clip.resize((main_clip.w, main_clip.h))
-                # Thankyou clip audio at 50%
-                if ty_clip.audio is not None:
-                    ty_clip = ty_clip.volumex(0.5)
-                # Subtle non-overlapping fades (0.3–0.5s), clamped to clip lengths
+            base_fd = float(transition_duration) if transition_duration else 0.5
+        except Exception:
+            base_fd = 0.5
+        outro_fade = max(0.3, min(0.5, base_fd))
+        # Preferred: the outro is conformed once to the export params (fade-in and volume baked in)
+        # and appended by stream copy; the main render only carries the fade-out bridge into it.
+        conformed_outro = None
+        if not preview:
+            try:
+                conformed_outro, _ = outro.prepared_outro(thankyou_path, frame_size, outro_fade)
+            except Exception as outro_e:
+                update_status(task_id, tasks, "processing", f"Outro pre-conform failed, encoding it inline: {outro_e}", progress=10)
+        inline_outro = (thankyou_path if not preview and conformed_outro is None and os.path.exists(thankyou_path)
+                        else None)
+        main_fade = min(outro_fade, max(0.01, total_audio / 2.0)) if conformed_outro else 0.0
+        main_output = output_path + '.main.mp4' if conformed_outro else output_path
+        def render_timeline(target, caption_track, ass_path, caption_cues, fade_out):
+            """
+            Render the scene timeline (with the given captions and fade-out) to target with the first
+            engine that works. Returns True if the ffmpeg engine rendered it (ASS captions included).
+            """
+            if render_engine == 'ffmpeg':
                 try:
-                    base_fd = float(transition_duration) if transition_duration else 0.5
-                except Exception:
-                    base_fd = 0.5
-                fade_dur = max(0.3, min(0.5, base_fd))
-                max_allowed = max(0.01, min(main_clip.duration, ty_clip.duration) / 2.0)
-                fade_dur = min(fade_dur, max_allowed)
-                main_faded = main_clip.fx(vfx.fadeout, fade_dur)
-                ty_faded = ty_clip.fx(vfx.fadein, fade_dur)
-                output_clip = concatenate_videoclips([main_faded, ty_faded], method='compose')
+                    ffmpeg_render.render_slideshow(
+                        scene_sources, scene_duration, target, frame_size, mixed_audio_path or audio_path,
+                        fps=export_fps, transition=eff_transition, ken_burns=ken_burns,
+                        bgm_path=background_music_path if bgm_clip is not None else None,
+                        bgm_level=bgm_level_percent / 100.0,
+                        caption_track=caption_track,
+                        outro_path=inline_outro, outro_fade=outro_fade, fade_out=fade_out,
+                        progress=lambda pct: report_export_progress(task_id, tasks, pct),
+                        subtitles_path=ass_path, fonts_dir=ass_fonts_dir, preset=x264_preset,
+                    )
+                    return True
+                except Exception as ff_e:
+                    update_status(task_id, tasks, "processing", f"ffmpeg engine failed, falling back to MoviePy: {ff_e}", progress=10)
+                    tasks.update(task_id, export_progress=0)
+
+            if parallel_export and num_images > 1 and segment_workers > 1:
+                try:
+                    update_status(task_id, tasks, "processing", "Rendering scene segments in parallel...", progress=10)
+                    export_parallel(
+                        task_id, tasks, scene_sources, scene_duration, target, frame_size,
+                        eff_transition, ken_burns, [] if ass_path else caption_cues,
+                        {'font': font, 'font_size': font_size, 'font_color': font_color, 'rel_y': rel_y},
+                        audio_clip, bgm_clip, inline_outro, outro_fade, fade_out=fade_out,
+                        premixed_audio=mixed_audio_path, workers=segment_workers,
+                    )
+                    return False
+                except Exception as par_e:
+                    update_status(task_id, tasks, "processing", f"Parallel export failed, falling back to single process: {par_e}", progress=10)
+                    tasks.update(task_id, export_progress=0)
+
+            clip = final_clip
+            if clip is None:
+                clip = assemble_clip(scene_sources, frame_size, scene_duration, total_audio, eff_transition,
+                                     ken_burns, audio_clip, bgm_clip)
+            # 1) Build main content (with captions if any) strictly limited to narration duration.
+            # Captions are blitted by a single interval-indexed layer instead of one clip per caption.
+            if caption_track is not None and len(caption_track):
+                main_clip = clip.fl(caption_track.apply).set_duration(clip.duration)
             else:
-                # Fallback: no thankyou clip available, export main as-is
-                output_clip = main_clip
-        except Exception:
-            # If anything fails around the thankyou clip, proceed with main content only
+                main_clip = clip
+
+            # 2) Fade into the pre-conformed outro, or compose the Thankyou clip inline
             output_clip = main_clip
+            # The pre-mixed AAC track is stream-copied by the writer unless the outro audio is composed here
+            export_audio = mixed_audio_path or True
+            if fade_out > 0:
+                output_clip = main_clip.fx(vfx.fadeout, fade_out)
+            elif inline_outro:
+                try:
+                    ty_clip = VideoFileClip(inline_outro)
+                    # Ensure sizes match composition; if not, resize to main clip size
+                    if ty_clip.w != main_clip.w or ty_clip.h != main_clip.h:
+                        ty_clip = ty_clip.resize((main_clip.w, main_clip.h))
+                    # Thankyou clip audio at 50%
+                    if ty_clip.audio is not None:
+                        ty_clip = ty_clip.volumex(outro.OUTRO_VOLUME)
+                    max_allowed = max(0.01, min(main_clip.duration, ty_clip.duration) / 2.0)
+                    fade_dur = min(outro_fade, max_allowed)
+                    main_faded = main_clip.fx(vfx.fadeout, fade_dur)
+                    ty_faded = ty_clip.fx(vfx.fadein, fade_dur)
+                    output_clip = concatenate_videoclips([main_faded, ty_faded], method='compose')
+                    export_audio = True
+                except Exception:
+                    # If anything fails around the thankyou clip, proceed with main content only
+                    output_clip = main_clip
 
-        # 3) Export final video
-        output_clip.write_videofile(output_path, codec='libx264', audio_codec='aac', fps=24, threads=4, logger=export_logger)
+            # 3) Export final video
+            output_clip.write_videofile(target, codec='libx264', audio=export_audio, audio_codec='aac',
+                                        fps=export_fps, preset=x264_preset, threads=4,
+                                        ffmpeg_params=outro.EXPORT_X264_PARAMS + ffmpeg_render.FASTSTART_PARAMS,
+                                        logger=export_logger)
+            return False
+
+        def render_captioned(target):
+            """
+            Render the finished main video to target in one pass (captions, fade-out, audio). ASS
+            captions: the ffmpeg engine burns them in within its own pass; the other engines render a
+            captionless base that a single libass encode then captions. Returns False if the burn-in
+            failed and target was written without captions.
+            """
+            base_output = target + '.nocap.mp4' if ass_path else target
+            captions_burned = render_timeline(base_output, caption_track, ass_path, caption_cues, main_fade)
+            if captions_burned and base_output != target:
+                os.replace(base_output, target)
+            if not ass_path or captions_burned:
+                return True
+            update_status(task_id, tasks, "processing", "Burning in captions (libass)...", progress=10)
+            tasks.update(task_id, export_progress=0)
+            try:
+                ffmpeg_render.burn_subtitles(
+                    base_output, ass_path, target, total_audio, fonts_dir=ass_fonts_dir, fps=export_fps,
+                    preset=x264_preset,
+                    progress=lambda pct: report_export_progress(task_id, tasks, pct),
+                )
+                return True
+            except Exception as burn_e:
+                # Keep the captionless render rather than failing the whole job
+                set_step_state(task_id, tasks, 'subtitles', 'error')
+                tasks.update(task_id, caption_error=f"Caption burn-in failed: {burn_e}")
+                update_status(task_id, tasks, "processing", f"WARNING: caption burn-in failed, exporting without captions: {burn_e}", progress=10)
+                os.replace(base_output, target)
+                return False
+            finally:
+                if os.path.exists(base_output):
+                    os.remove(base_output)
 
+        # Stage artifacts: the finished main render keyed by the scene timeline + audio + captions, and
+        # optionally a captionless, unfaded base render keyed by the timeline alone, so a restyle
+        # redoes only what changed
+        staged = artifacts.stage_cache is not None and audio_key is not None and inline_outro is None
+        if staged:
+            base_key = artifacts.stage_key(
+                'base', images=[artifacts.content_digest(p) for p in image_paths], aspect_ratio=aspect_ratio,
+                frame_size=frame_size, fps=export_fps, preset=x264_preset, total_audio=round(total_audio, 3),
+                transition=round(eff_transition, 4), ken_burns=ken_burns,
+                engine='ffmpeg' if render_engine == 'ffmpeg' else 'moviepy',
+            )
+            main_key = artifacts.stage_key(
+                'main', base=base_key, audio=audio_key, cues=caption_cues if (caption_track or ass_path) else [],
+                caption_mode=caption_mode, font=captions.font_identity(font), font_size=font_size, font_color=font_color,
+                rel_y=round(rel_y, 4), fade_out=round(main_fade, 4), fps=export_fps, preset=x264_preset,
+            )
+
+            def build_base(out_path):
+                render_timeline(out_path, None, None, [], 0.0)
+
+            def build_main(out_path):
+                # The base costs a second full encode, so it is only built when asked for (keep_base,
+                # for jobs that expect restyles); an already cached base is always used
+                if not (keep_base or artifacts.stage_cache.lookup(base_key, '.mp4')):
+                    return None if render_captioned(out_path) else {'captions': False}
+                base_video, _ = artifacts.fetch_or_build('base', base_key, '.mp4', build_base, stage_stats)
+                tasks.update(task_id, stage_cache=stage_stats)
+                if stage_stats['base'] == 'hit':
+                    update_status(task_id, tasks, "processing", "Reusing the cached base render; finishing captions and audio...", progress=10)
+                tasks.update(task_id, export_progress=0)
+                try:
+                    ffmpeg_render.finish_render(
+                        base_video, mixed_audio_path, out_path, total_audio, frame_size, fps=export_fps,
+                        caption_track=caption_track, subtitles_path=ass_path, fonts_dir=ass_fonts_dir,
+                        fade_out=main_fade, preset=x264_preset,
+                        progress=lambda pct: report_export_progress(task_id, tasks, pct),
+                    )
+                except Exception as fin_e:
+                    # The base is only a shortcut: render the whole thing instead of failing the job
+                    update_status(task_id, tasks, "processing", f"Finishing over the cached base failed, rendering in full: {fin_e}", progress=10)
+                    tasks.update(task_id, export_progress=0)
+                    return None if render_captioned(out_path) else {'captions': False}
+
+            main_artifact, main_meta = artifacts.fetch_or_build('main', main_key, '.mp4', build_main, stage_stats)
+            tasks.update(task_id, stage_cache=stage_stats)
+            artifacts.link_to(main_artifact, main_output)
+            report_export_progress(task_id, tasks, 100)
+            if main_meta.get('captions') is False:
+                # Do not keep serving the captionless fallback for this key
+                os.remove(main_artifact)
+        else:
+            render_captioned(main_output)
+
+        if conformed_outro:
+            try:
+                outro.append_outro(main_output, conformed_outro, output_path)
+            finally:
+                if os.path.exists(main_output):
+                    os.remove(main_output)
+
+        # Every writer above puts the moov box first; this only rewrites an output that missed it
+        try:
+            delivery.ensure_faststart(output_path)
+        except Exception as fs_e:
+            update_status(task_id, tasks, "processing", f"Fast-start rewrite failed, keeping the export as written: {fs_e}", progress=99)
         set_step_state(task_id, tasks, 'export', 'done')
-        update_status(task_id, tasks, "completed", f"Video created successfully.", progress=100)
-        tasks[task_id]['video_url'] = video_url # Store the URL for frontend
+        tasks.update(task_id, video_url=video_url) # Store the URL for frontend
+        if config.get("hls"):
+            # In-browser viewing: stream-copied HLS segments + poster; the MP4 download stays available either way
+            try:
+                update_status(task_id, tasks, "processing", "Packaging HLS stream and poster...", progress=99)
+                delivery.package_hls(output_path)
+                delivery.make_poster(output_path)
+                tasks.update(task_id, hls_url=config.get("hls_url"), poster_url=config.get("poster_url"))
+            except Exception as hls_e:
+                update_status(task_id, tasks, "processing", f"HLS packaging failed, MP4 download only: {hls_e}", progress=99)
+        if (tasks.get(task_id) or {}).get('caption_error'):
+            update_status(task_id, tasks, "completed", "Video created without captions (caption burn-in failed).", progress=100)
+        else:
+            update_status(task_id, tasks, "completed", f"Video created successfully.", progress=100)
 
     except Exception as e:
         error_message = f"An error occurred during video processing: {e}"
@@ -512,17 +1108,24 @@ def create_video(task_id, tasks, config):
     finally:
         # --- Cleanup --- 
         set_step_state(task_id, tasks, 'cleanup', 'in_progress')
-        update_status(task_id, tasks, tasks[task_id]['status'], "Cleaning up temporary files...", progress=tasks[task_id].get('progress'))
-        for path in cropped_image_paths:
-            if os.path.exists(path):
+        if scene_pipeline is not None and not shared_inputs:
+            scene_pipeline.close()
+        final = tasks.get(task_id) or {}
+        update_status(task_id, tasks, final.get('status'), "Cleaning up temporary files...", progress=final.get('progress'))
+        for path in [mixed_audio_path, ass_path]:
+            if path and os.path.exists(path):
                 os.remove(path)
-        # Remove uploaded temp files (direct uploads) and Drive temp dir if present
+        if scene_dir:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+        # Remove the per-task input files and the upload/Drive folder if present; a completed
+        # preview keeps them so it can be promoted to a full render without ingesting again
+        keep_inputs = (bool(config.get('preview')) and final.get('status') == 'completed') or shared_inputs
         try:
-            for f in (config.get('temp_files') or []):
+            for f in ([] if keep_inputs else (config.get('temp_files') or [])):
                 if f and os.path.exists(f):
                     os.remove(f)
             temp_dir = config.get('temp_dir')
-            if temp_dir and os.path.exists(temp_dir):
+            if temp_dir and not keep_inputs and os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir, ignore_errors=True)
         except Exception as _cleanup_err:
             # best-effort cleanup; do not fail the task for cleanup issues